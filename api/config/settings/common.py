@@ -60,6 +60,16 @@ FEDERATION_MUSIC_NEEDS_APPROVAL = env.bool(
 )
 # XXX: deprecated, see #186
 FEDERATION_ACTOR_FETCH_DELAY = env.int("FEDERATION_ACTOR_FETCH_DELAY", default=60 * 12)
+# maximum number of activities delivered in parallel to a single remote host
+FEDERATION_DELIVERY_CONCURRENCY = env.int("FEDERATION_DELIVERY_CONCURRENCY", default=4)
+# number of request signatures kept in memory per actor, to avoid signing
+# identical requests (same target, date and body) twice. Disabled by default.
+FEDERATION_SIGNATURE_CACHE_SIZE = env.int("FEDERATION_SIGNATURE_CACHE_SIZE", default=0)
+# deliver activities from the asynchronous federation_worker command,
+# instead of celery tasks
+FEDERATION_DELIVERY_WORKER = env.bool("FEDERATION_DELIVERY_WORKER", default=False)
+# maximum number of concurrent requests for a federation_worker process
+FEDERATION_WORKER_CONCURRENCY = env.int("FEDERATION_WORKER_CONCURRENCY", default=500)
 ALLOWED_HOSTS = env.list("DJANGO_ALLOWED_HOSTS")
 
 # APP CONFIGURATION
@@ -279,6 +289,10 @@ MEDIA_ROOT = env("MEDIA_ROOT", default=str(APPS_DIR("media")))
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = env("MEDIA_URL", default="/media/")
 FILE_UPLOAD_PERMISSIONS = 0o644
+FILE_UPLOAD_HANDLERS = [
+    "funkwhale_api.common.upload_handlers.ChecksumMemoryFileUploadHandler",
+    "funkwhale_api.common.upload_handlers.ChecksumTemporaryFileUploadHandler",
+]
 # URL Configuration
 # ------------------------------------------------------------------------------
 ROOT_URLCONF = "config.urls"
@@ -407,12 +421,31 @@ CELERY_BROKER_URL = env(
 # Your common stuff: Below this line define 3rd party library settings
 CELERY_TASK_DEFAULT_RATE_LIMIT = 1
 CELERY_TASK_TIME_LIMIT = 300
+# image renditions can be generated by dedicated workers, by setting this to
+# e.g. "images" and running celery -A funkwhale_api.taskapp worker -Q images
+IMAGES_CELERY_QUEUE = env("IMAGES_CELERY_QUEUE", default="celery")
+CELERY_TASK_ROUTES = {"music.warm_album_covers": {"queue": IMAGES_CELERY_QUEUE}}
 CELERY_BEAT_SCHEDULE = {
     "federation.clean_music_cache": {
         "task": "federation.clean_music_cache",
         "schedule": crontab(hour="*/2"),
         "options": {"expires": 60 * 2},
-    }
+    },
+    "music.clean_transcoding_cache": {
+        "task": "music.clean_transcoding_cache",
+        "schedule": crontab(minute="*/30"),
+        "options": {"expires": 60 * 2},
+    },
+    "music.clean_upload_sessions": {
+        "task": "music.clean_upload_sessions",
+        "schedule": crontab(minute="0", hour="*/6"),
+        "options": {"expires": 60 * 2},
+    },
+    "music.flush_accessed_dates": {
+        "task": "music.flush_accessed_dates",
+        "schedule": crontab(minute="*/5"),
+        "options": {"expires": 60 * 2},
+    },
 }
 
 JWT_AUTH = {
@@ -472,9 +505,13 @@ USE_X_FORWARDED_HOST = True
 USE_X_FORWARDED_PORT = True
 
 # Wether we should use Apache, Nginx (or other) headers when serving audio files
-# Default to Nginx
+# Default to Nginx. Use "none" to stream files directly from the API process
 REVERSE_PROXY_TYPE = env("REVERSE_PROXY_TYPE", default="nginx")
-assert REVERSE_PROXY_TYPE in ["apache2", "nginx"], "Unsupported REVERSE_PROXY_TYPE"
+assert REVERSE_PROXY_TYPE in [
+    "apache2",
+    "nginx",
+    "none",
+], "Unsupported REVERSE_PROXY_TYPE"
 
 # Which path will be used to process the internal redirection
 # **DO NOT** put a slash at the end
@@ -524,6 +561,20 @@ ACCOUNT_USERNAME_BLACKLIST = [
 ] + env.list("ACCOUNT_USERNAME_BLACKLIST", default=[])
 
 EXTERNAL_REQUESTS_VERIFY_SSL = env.bool("EXTERNAL_REQUESTS_VERIFY_SSL", default=True)
+# default timeout, in seconds, for outbound HTTP requests
+EXTERNAL_REQUESTS_TIMEOUT = env.float("EXTERNAL_REQUESTS_TIMEOUT", default=10)
+# outbound HTTP connections are kept alive and reused, those settings control
+# how many hosts have a connection pool, and how many connections are kept per host
+EXTERNAL_REQUESTS_POOL_CONNECTIONS = env.int(
+    "EXTERNAL_REQUESTS_POOL_CONNECTIONS", default=50
+)
+EXTERNAL_REQUESTS_POOL_MAXSIZE = env.int("EXTERNAL_REQUESTS_POOL_MAXSIZE", default=10)
+# how many times idempotent requests are retried on connection errors
+# and 502/503/504 responses, with an exponential backoff
+EXTERNAL_REQUESTS_RETRIES = env.int("EXTERNAL_REQUESTS_RETRIES", default=2)
+EXTERNAL_REQUESTS_RETRY_BACKOFF = env.float(
+    "EXTERNAL_REQUESTS_RETRY_BACKOFF", default=0.5
+)
 # XXX: deprecated, see #186
 API_AUTHENTICATION_REQUIRED = env.bool("API_AUTHENTICATION_REQUIRED", True)
 
@@ -0,0 +1,32 @@
+"""
+Generation of the renditions (e.g. square thumbnails) of image fields.
+
+Renditions are created in the background or in bulk, instead of during
+the request or import that sets the image.
+"""
+import logging
+
+from versatileimagefield.image_warmer import VersatileImageFieldWarmer
+
+logger = logging.getLogger(__name__)
+
+
+def warm(queryset, image_attr, rendition_key_set):
+    """
+    Create the renditions of the images of the given objects. Renditions
+    that already exist in the storage are not generated again.
+
+    Return a (created, failed) tuple.
+    """
+    queryset = queryset.exclude(**{"{}__isnull".format(image_attr): True}).exclude(
+        **{image_attr: ""}
+    )
+    warmer = VersatileImageFieldWarmer(
+        instance_or_queryset=queryset,
+        rendition_key_set=rendition_key_set,
+        image_attr=image_attr,
+    )
+    num_created, failed_to_create = warmer.warm()
+    for path in failed_to_create:
+        logger.warning("Cannot create renditions for %s", path)
+    return num_created, len(failed_to_create)
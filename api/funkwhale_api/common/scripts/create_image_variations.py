@@ -1,30 +1,70 @@
 """
-Compute different sizes of image used for Album covers and User avatars
+Compute different sizes of image used for Album covers and User avatars.
+
+Images are processed in parallel batches, and existing sizes are skipped.
+If interrupted, the script resumes where it stopped when launched again.
 """
+import concurrent.futures
+import os
 
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
+from django import db
+from django.core.cache import cache
 
+from funkwhale_api.common import images
+from funkwhale_api.common import utils as common_utils
 from funkwhale_api.music.models import Album
 from funkwhale_api.users.models import User
 
 
 MODELS = [(Album, "cover", "square"), (User, "avatar", "square")]
+BATCH_SIZE = 100
+WORKERS = os.cpu_count() or 1
+
+
+def get_cursor_key(model, attribute):
+    return "scripts:create_image_variations:{}:{}".format(
+        model._meta.label_lower, attribute
+    )
+
+
+def warm_batch(model, attribute, key_set, pks):
+    try:
+        return images.warm(model.objects.filter(pk__in=pks), attribute, key_set)
+    finally:
+        # each worker thread has its own connection
+        db.connection.close()
 
 
 def main(command, **kwargs):
     for model, attribute, key_set in MODELS:
+        cursor_key = get_cursor_key(model, attribute)
+        cursor = cache.get(cursor_key) or 0
         qs = model.objects.exclude(**{"{}__isnull".format(attribute): True})
-        qs = qs.exclude(**{attribute: ""})
-        warmer = VersatileImageFieldWarmer(
-            instance_or_queryset=qs,
-            rendition_key_set=key_set,
-            image_attr=attribute,
-            verbose=True,
-        )
-        command.stdout.write(
-            "Creating images for {} / {}".format(model.__name__, attribute)
-        )
-        num_created, failed_to_create = warmer.warm()
+        qs = qs.exclude(**{attribute: ""}).filter(pk__gt=cursor).order_by("pk")
+        pks = list(qs.values_list("pk", flat=True))
         command.stdout.write(
-            "  {} created, {} in error".format(num_created, len(failed_to_create))
+            "Creating images for {} / {}, {} objects{}".format(
+                model.__name__,
+                attribute,
+                len(pks),
+                " (resuming after #{})".format(cursor) if cursor else "",
+            )
         )
+        batches = list(common_utils.batch(pks, BATCH_SIZE))
+        done = created = failed = 0
+        with concurrent.futures.ThreadPoolExecutor(WORKERS) as pool:
+            results = pool.map(
+                lambda batch: warm_batch(model, attribute, key_set, batch), batches
+            )
+            # results come in order, so everything before the cursor is done
+            for batch, (batch_created, batch_failed) in zip(batches, results):
+                cache.set(cursor_key, batch[-1], None)
+                done += len(batch)
+                created += batch_created
+                failed += batch_failed
+                command.stdout.write(
+                    "  {}/{} objects, {} created, {} in error".format(
+                        done, len(pks), created, failed
+                    )
+                )
+        cache.delete(cursor_key)
@@ -144,6 +144,8 @@ def main(command, **kwargs):
     libraries_by_user = create_libraries(open_api, command.stdout)
     update_uploads(libraries_by_user, command.stdout)
     update_orphan_uploads(open_api, command.stdout)
+    command.stdout.write("* Updating tracks availability...")
+    models.rebuild_track_availabilities()
 
     set_fid_params = [
         (
@@ -1,8 +1,22 @@
+import logging
+import os
+import threading
+
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import funkwhale_api
 
+logger = logging.getLogger(__name__)
+
+# the session is shared by all threads of a process, and rebuilt after a fork
+# (e.g. in celery prefork workers), because sockets must not be shared
+# between processes
+_state = {"session": None, "pid": None}
+_lock = threading.Lock()
+
 
 def get_user_agent():
     return "python-requests (funkwhale/{}; +{})".format(
@@ -10,7 +24,90 @@ def get_user_agent():
     )
 
 
-def get_session():
-    s = requests.Session()
+class FunkwhaleSession(requests.Session):
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", settings.EXTERNAL_REQUESTS_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+
+def get_adapter():
+    retries = Retry(
+        total=settings.EXTERNAL_REQUESTS_RETRIES,
+        backoff_factor=settings.EXTERNAL_REQUESTS_RETRY_BACKOFF,
+        # only idempotent requests are retried on those errors
+        status_forcelist=[502, 503, 504],
+        raise_on_status=False,
+    )
+    return HTTPAdapter(
+        pool_connections=settings.EXTERNAL_REQUESTS_POOL_CONNECTIONS,
+        pool_maxsize=settings.EXTERNAL_REQUESTS_POOL_MAXSIZE,
+        max_retries=retries,
+    )
+
+
+def build_session():
+    s = FunkwhaleSession()
     s.headers["User-Agent"] = get_user_agent()
+    adapter = get_adapter()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
     return s
+
+
+def get_session():
+    """
+    Return the HTTP session of the current process. Connections are kept
+    alive and reused across requests to the same host.
+    """
+    pid = os.getpid()
+    if _state["session"] is None or _state["pid"] != pid:
+        with _lock:
+            if _state["session"] is None or _state["pid"] != pid:
+                # we don't close the inherited session, its sockets
+                # are still used by the parent process
+                _state["session"] = build_session()
+                _state["pid"] = pid
+    return _state["session"]
+
+
+def close_session():
+    with _lock:
+        if _state["session"] is not None and _state["pid"] == os.getpid():
+            _state["session"].close()
+        _state["session"] = None
+        _state["pid"] = None
+
+
+def get_pool_stats():
+    """
+    Return usage statistics about the connection pools of the current
+    process, by host.
+    """
+    session = _state["session"]
+    if session is None or _state["pid"] != os.getpid():
+        return {}
+    stats = {}
+    adapter = session.get_adapter("https://")
+    for key in adapter.poolmanager.pools.keys():
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is None:
+            continue
+        stats["{}://{}:{}".format(pool.scheme, pool.host, pool.port)] = {
+            "connections": pool.num_connections,
+            "requests": pool.num_requests,
+            "idle": pool.pool.qsize() if pool.pool else 0,
+            "maxsize": pool.pool.maxsize if pool.pool else 0,
+        }
+    return stats
+
+
+def log_pool_stats():
+    for host, stats in sorted(get_pool_stats().items()):
+        logger.info(
+            "HTTP pool %s: %s connections opened, %s requests, %s/%s idle",
+            host,
+            stats["connections"],
+            stats["requests"],
+            stats["idle"],
+            stats["maxsize"],
+        )
@@ -0,0 +1,130 @@
+"""
+Serve files directly from the application process, for setups where no
+reverse proxy is available to handle X-Accel-Redirect / X-Sendfile headers.
+
+Responses honor Range and If-Range request headers, so clients can seek
+in large files without downloading them entirely. The file is read by the
+application server in blocks of BLOCK_SIZE: under daphne (ASGI), which is
+what we ship, there is no ``wsgi.file_wrapper`` / sendfile, and each download
+keeps a worker thread busy until it completes. This is why the reverse proxy
+(X-Accel-Redirect / X-Sendfile) remains the default.
+"""
+import os
+import re
+
+from django import http
+from django.utils.http import http_date, quote_etag
+
+RANGE_REGEX = re.compile(r"^bytes=(?P<start>\d*)-(?P<end>\d*)$")
+BLOCK_SIZE = 64 * 1024
+
+
+class UnsatisfiableRange(ValueError):
+    pass
+
+
+def parse_range_header(header, size):
+    """
+    Given the value of a Range header and the size of the file,
+    return a (start, end) tuple of inclusive offsets.
+
+    Return None if the header is missing or unsupported (e.g. multiple ranges),
+    in which case the whole file should be served.
+    """
+    if not header:
+        return
+    match = RANGE_REGEX.match(header.strip())
+    if not match:
+        return
+    start, end = match.group("start"), match.group("end")
+    if not start and not end:
+        return
+    if not start:
+        # suffix range, such as bytes=-500 (last 500 bytes)
+        length = int(end)
+        if length == 0:
+            raise UnsatisfiableRange(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise UnsatisfiableRange(header)
+    return start, min(end, size - 1)
+
+
+class RangedFile(object):
+    """
+    A file-like object that only exposes the bytes between start and end
+    (inclusive) of the underlying file.
+    """
+
+    def __init__(self, file, start, end):
+        self.file = file
+        self.remaining = end - start + 1
+        self.file.seek(start)
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b""
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        # used by wsgi.file_wrapper to rely on sendfile
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def get_validators(file):
+    try:
+        stat = os.fstat(file.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None, None
+    etag = quote_etag("{:x}-{:x}".format(int(stat.st_mtime), stat.st_size))
+    return etag, http_date(stat.st_mtime)
+
+
+def range_applies(request, etag, last_modified):
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    return if_range in [v for v in [etag, last_modified] if v]
+
+
+def serve_file(request, file, size, content_type=None):
+    """
+    Return a streaming response for the given open file, honoring
+    the Range and If-Range headers of the request, if any.
+    """
+    etag, last_modified = get_validators(file)
+    byte_range = None
+    if request is not None and range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range_header(request.META.get("HTTP_RANGE"), size)
+        except UnsatisfiableRange:
+            file.close()
+            response = http.HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(size)
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        response = http.FileResponse(RangedFile(file, start, end), status=206)
+        response["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+        response["Content-Length"] = end - start + 1
+    else:
+        response = http.FileResponse(RangedFile(file, 0, size - 1))
+        response["Content-Length"] = size
+    response.block_size = BLOCK_SIZE
+    response["Accept-Ranges"] = "bytes"
+    if content_type:
+        response["Content-Type"] = content_type
+    if etag:
+        response["ETag"] = etag
+        response["Last-Modified"] = last_modified
+    return response
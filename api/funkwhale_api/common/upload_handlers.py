@@ -0,0 +1,40 @@
+"""
+Upload handlers computing a checksum of uploaded files while they are
+received, so the content can be deduplicated without reading it again.
+
+The checksum is available as the ``checksum`` attribute of the resulting
+uploaded file.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class ChecksumMixin(object):
+    def new_file(self, *args, **kwargs):
+        self.hash = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # the memory handler lets other handlers receive the data
+        # of large files, which it does not handle
+        if getattr(self, "activated", True):
+            self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        f = super().file_complete(file_size)
+        if f is not None:
+            f.checksum = self.hash.hexdigest()
+        return f
+
+
+class ChecksumMemoryFileUploadHandler(ChecksumMixin, MemoryFileUploadHandler):
+    pass
+
+
+class ChecksumTemporaryFileUploadHandler(ChecksumMixin, TemporaryFileUploadHandler):
+    pass
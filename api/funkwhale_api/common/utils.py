@@ -1,5 +1,6 @@
 from django.utils.deconstruct import deconstructible
 
+import itertools
 import os
 import shutil
 import uuid
@@ -107,3 +108,16 @@ def chunk_queryset(source_qs, chunk_size):
 
         if nb_items < chunk_size:
             return
+
+
+def batch(iterable, size):
+    """
+    Yield lists of at most size items from the given iterable,
+    without consuming it entirely.
+    """
+    iterator = iter(iterable)
+    while True:
+        items = list(itertools.islice(iterator, size))
+        if not items:
+            return
+        yield items
@@ -301,6 +301,7 @@ def prepare_deliveries_and_inbox_items(recipient_list, type):
     of urls to persist in the activity in place of the initial recipient list.
     """
     from . import models
+    from . import utils as federation_utils
 
     local_recipients = set()
     remote_inbox_urls = set()
@@ -329,7 +330,10 @@ def prepare_deliveries_and_inbox_items(recipient_list, type):
                     remote_inbox_urls.add(actor.shared_inbox_url or actor.inbox_url)
             urls.append(r["target"].followers_url)
 
-    deliveries = [models.Delivery(inbox_url=url) for url in remote_inbox_urls]
+    deliveries = [
+        models.Delivery(inbox_url=url, host=federation_utils.get_domain(url))
+        for url in remote_inbox_urls
+    ]
     inbox_items = [
         models.InboxItem(actor=actor, type=type) for actor in local_recipients
     ]
@@ -25,14 +25,16 @@ def get_actor_data(actor_url):
         raise ValueError("Invalid actor payload: {}".format(response.text))
 
 
+def get_fetch_delta():
+    return datetime.timedelta(minutes=preferences.get("federation__actor_fetch_delay"))
+
+
 def get_actor(fid):
     try:
         actor = models.Actor.objects.get(fid=fid)
     except models.Actor.DoesNotExist:
         actor = None
-    fetch_delta = datetime.timedelta(
-        minutes=preferences.get("federation__actor_fetch_delay")
-    )
+    fetch_delta = get_fetch_delta()
     if actor and actor.last_fetch_date > timezone.now() - fetch_delta:
         # cache is hot, we can return as is
         return actor
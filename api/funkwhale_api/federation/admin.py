@@ -5,9 +5,9 @@ from . import tasks
 
 
 def redeliver_deliveries(modeladmin, request, queryset):
-    queryset.update(is_delivered=False)
-    for delivery in queryset:
-        tasks.deliver_to_remote.delay(delivery_id=delivery.pk)
+    queryset.update(is_delivered=False, attempts=0)
+    for host in queryset.order_by().values_list("host", flat=True).distinct():
+        tasks.schedule_host_delivery(host)
 
 
 redeliver_deliveries.short_description = "Redeliver"
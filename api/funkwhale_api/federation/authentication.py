@@ -1,3 +1,5 @@
+import copy
+
 import cryptography
 from django.contrib.auth.models import AnonymousUser
 from rest_framework import authentication, exceptions
@@ -16,8 +18,20 @@ class SignatureAuthentication(authentication.BaseAuthentication):
         except ValueError as e:
             raise exceptions.AuthenticationFailed(str(e))
 
+        actor_url = key_id.split("#")[0]
+        cached = keys.public_keys.get(key_id)
+        if cached:
+            try:
+                signing.verify_django(request, cached.public_key)
+            except cryptography.exceptions.InvalidSignature:
+                # the key may have been rotated, we check again without the cache
+                keys.public_keys.invalidate(actor_url)
+            else:
+                # the cached instance is shared between requests
+                return copy.copy(cached.actor)
+
         try:
-            actor = actors.get_actor(key_id.split("#")[0])
+            actor = actors.get_actor(actor_url)
         except Exception as e:
             raise exceptions.AuthenticationFailed(str(e))
 
@@ -25,10 +39,21 @@ class SignatureAuthentication(authentication.BaseAuthentication):
             raise exceptions.AuthenticationFailed("No public key found")
 
         try:
-            signing.verify_django(request, actor.public_key.encode("utf-8"))
+            public_key = keys.load_public_key(actor.public_key.encode("utf-8"))
+        except ValueError:
+            raise exceptions.AuthenticationFailed("Invalid public key")
+
+        try:
+            signing.verify_django(request, public_key)
         except cryptography.exceptions.InvalidSignature:
             raise exceptions.AuthenticationFailed("Invalid signature")
 
+        keys.public_keys.set(
+            key_id,
+            actor,
+            public_key,
+            expires=actor.last_fetch_date + actors.get_fetch_delta(),
+        )
         return actor
 
     def authenticate(self, request):
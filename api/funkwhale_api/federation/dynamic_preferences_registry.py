@@ -21,6 +21,36 @@ class MusicCacheDuration(types.IntPreference):
     field_kwargs = {"required": False}
 
 
+@global_preferences_registry.register
+class MusicCacheSize(types.IntPreference):
+    show_in_api = True
+    section = federation
+    name = "music_cache_size"
+    default = 0
+    verbose_name = "Music cache size"
+    help_text = (
+        "How much disk space, in megabytes, can be used to store federated "
+        "tracks locally? When this size is exceeded, the least recently "
+        "listened files are erased first. Set this to 0 to disable the limit."
+    )
+    field_kwargs = {"required": False}
+
+
+@global_preferences_registry.register
+class MusicCachePinListenings(types.IntPreference):
+    show_in_api = True
+    section = federation
+    name = "music_cache_pin_listenings"
+    default = 0
+    verbose_name = "Keep popular tracks in the music cache"
+    help_text = (
+        "Federated tracks listened at least this number of times during the "
+        "last 30 days are never erased from the cache. Set this to 0 to "
+        "disable pinning."
+    )
+    field_kwargs = {"required": False}
+
+
 @global_preferences_registry.register
 class Enabled(preferences.DefaultFromSettingMixin, types.BooleanPreference):
     section = federation
@@ -0,0 +1,236 @@
+"""
+Asynchronous delivery engine for outbound federation traffic.
+
+Celery workers block while a remote server is answering, so a slow instance
+keeps a whole worker process busy. The engine runs from the
+federation_worker management command instead, and sends activities from
+an asyncio event loop, with thousands of requests in flight over pooled
+connections.
+
+Deliveries are read from the same Delivery rows, and follow the same
+retry rules as the deliver_to_host celery task. Database queries and
+request signing happen in a thread, outside of the event loop.
+"""
+import asyncio
+import collections
+import datetime
+import logging
+
+import aiohttp
+import requests
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from funkwhale_api.common import session
+
+from . import models, signing, tasks
+
+logger = logging.getLogger(__name__)
+
+# pending deliveries are looked up in the database at this interval,
+# to retry failed deliveries once they are due
+RESCAN_INTERVAL = 30
+
+SignedRequest = collections.namedtuple(
+    "SignedRequest", ["delivery_id", "attempts", "url", "headers", "body"]
+)
+
+
+def sign_delivery(delivery, auth):
+    """
+    Build the signed POST request for the given delivery, and return it
+    as a SignedRequest that can be sent with any HTTP client.
+    """
+    request = requests.Request(
+        method="POST",
+        url=delivery.inbox_url,
+        json=delivery.activity.payload,
+        headers={
+            "Content-Type": "application/activity+json",
+            "User-Agent": session.get_user_agent(),
+        },
+    ).prepare()
+    auth(request)
+    return SignedRequest(
+        delivery_id=delivery.pk,
+        attempts=delivery.attempts,
+        url=request.url,
+        headers=dict(request.headers),
+        body=request.body,
+    )
+
+
+def get_pending_hosts(rescan=False):
+    """
+    Return the hosts that received new deliveries since last call. If
+    rescan is True, hosts with pending deliveries in database are
+    included as well.
+    """
+    connection = get_redis_connection("default")
+    hosts = set()
+    while True:
+        host = connection.spop(tasks.DELIVERY_HOSTS_KEY)
+        if host is None:
+            break
+        hosts.add(host.decode("utf-8") if isinstance(host, bytes) else host)
+    if rescan:
+        pending = models.Delivery.objects.filter(
+            is_delivered=False, attempts__lt=tasks.DELIVERY_MAX_ATTEMPTS
+        ).exclude(host=None)
+        hosts |= set(pending.order_by().values_list("host", flat=True).distinct())
+    return hosts
+
+
+def acquire_host(host):
+    # the lock is shared with deliver_to_host, to never deliver twice
+    lock_key = tasks.get_delivery_cache_key("lock", host)
+    return cache.add(lock_key, True, tasks.DELIVERY_LOCK_TIMEOUT)
+
+
+def release_host(host):
+    cache.delete(tasks.get_delivery_cache_key("lock", host))
+
+
+def get_signed_batch(host, cursor, auths):
+    """
+    Return the next batch of due deliveries for the given host, as signed
+    requests, with the cursor to use for the next call.
+    """
+    pending = tasks.get_pending_deliveries(host).filter(pk__gt=cursor)
+    batch = list(pending[: tasks.DELIVERY_BATCH_SIZE])
+    if not batch:
+        return [], None
+    due, _ = tasks.split_due_deliveries(batch, timezone.now())
+    signed = []
+    for delivery in due:
+        actor = delivery.activity.actor
+        if actor.pk not in auths:
+            auths[actor.pk] = signing.get_auth(actor.private_key, actor.private_key_id)
+        signed.append(sign_delivery(delivery, auths[actor.pk]))
+    return signed, batch[-1].pk
+
+
+def record_results(delivered, failed, date):
+    tasks.record_delivery_attempts(delivered, date, is_delivered=True)
+    tasks.record_delivery_attempts(failed, date, is_delivered=False)
+
+
+class HostUnreachable(Exception):
+    pass
+
+
+class DeliveryWorker(object):
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or settings.FEDERATION_WORKER_CONCURRENCY
+        self.running = {}
+        self.stopping = False
+        self.http = None
+        self.stats = collections.Counter()
+
+    def stop(self):
+        logger.info("Stopping, waiting for running deliveries to finish")
+        self.stopping = True
+
+    def get_http_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=settings.FEDERATION_DELIVERY_CONCURRENCY,
+            ssl=None if settings.EXTERNAL_REQUESTS_VERIFY_SSL else False,
+        )
+        # same timeout as deliver_to_host
+        timeout = aiohttp.ClientTimeout(total=5)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def run(self, poll_interval=1):
+        async with self.get_http_session() as http:
+            self.http = http
+            last_rescan = None
+            while not self.stopping:
+                now = timezone.now()
+                rescan = last_rescan is None or (
+                    now - last_rescan > datetime.timedelta(seconds=RESCAN_INTERVAL)
+                )
+                if rescan:
+                    last_rescan = now
+                hosts = await database_sync_to_async(get_pending_hosts)(rescan)
+                for host in hosts:
+                    if host not in self.running:
+                        self.running[host] = asyncio.ensure_future(
+                            self.deliver_to_host(host)
+                        )
+                await asyncio.sleep(poll_interval)
+            if self.running:
+                await asyncio.wait(list(self.running.values()))
+
+    async def deliver_to_host(self, host):
+        acquired = await database_sync_to_async(acquire_host)(host)
+        if not acquired:
+            # a celery task is delivering to this host, we'll try on next rescan
+            del self.running[host]
+            return
+        try:
+            await self.deliver_pending(host)
+        except Exception:
+            logger.exception("Error while delivering to %s", host)
+        finally:
+            await database_sync_to_async(release_host)(host)
+            del self.running[host]
+
+    async def deliver_pending(self, host):
+        auths = {}
+        cursor = 0
+        while not self.stopping:
+            signed, cursor = await database_sync_to_async(get_signed_batch)(
+                host, cursor, auths
+            )
+            if cursor is None:
+                return
+            now = timezone.now()
+            results = await asyncio.gather(
+                *[self.send(request) for request in signed], return_exceptions=True
+            )
+            delivered, failed = [], []
+            unreachable = False
+            for request, result in zip(signed, results):
+                if isinstance(result, HostUnreachable):
+                    unreachable = True
+                elif isinstance(result, Exception):
+                    logger.error(
+                        "Error while delivering to %s: %s", request.url, result
+                    )
+                if result is True:
+                    delivered.append(request.delivery_id)
+                else:
+                    failed.append(request.delivery_id)
+            await database_sync_to_async(record_results)(delivered, failed, now)
+            self.stats.update(delivered=len(delivered), failed=len(failed))
+            if unreachable:
+                # remaining deliveries are retried on next rescan
+                return
+
+    async def send(self, request):
+        """
+        Post the signed request. Return True on success, False on error,
+        and raise HostUnreachable if the connection cannot be established.
+        """
+        try:
+            async with self.http.post(
+                request.url, data=request.body, headers=request.headers
+            ) as response:
+                logger.debug("Remote answered with %s", response.status)
+                if response.status >= 400:
+                    logger.info(
+                        "Error while delivering to %s: HTTP %s",
+                        request.url,
+                        response.status,
+                    )
+                    return False
+                return True
+        except aiohttp.ClientConnectorError as e:
+            raise HostUnreachable(str(e))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info("Error while delivering to %s: %s", request.url, e)
+            return False
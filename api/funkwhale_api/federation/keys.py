@@ -1,11 +1,16 @@
+import collections
 import re
+import threading
 import urllib.parse
 
 from cryptography.hazmat.backends import default_backend as crypto_default_backend
 from cryptography.hazmat.primitives import serialization as crypto_serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
+from django.utils import timezone
 
 KEY_ID_REGEX = re.compile(r"keyId=\"(?P<id>.*)\"")
+# maximum number of public keys kept in memory, per process
+PUBLIC_KEYS_CACHE_SIZE = 1000
 
 
 def get_key_pair(size=2048):
@@ -42,3 +47,60 @@ def get_key_id_from_signature_header(header_string):
     if url.scheme not in ["http", "https"]:
         raise ValueError("Invalid shceme")
     return key_id
+
+
+def load_public_key(pem):
+    return crypto_serialization.load_pem_public_key(
+        pem, backend=crypto_default_backend()
+    )
+
+
+CachedPublicKey = collections.namedtuple(
+    "CachedPublicKey", ["actor_pk", "actor", "public_key", "expires"]
+)
+
+
+class PublicKeyCache(object):
+    """
+    Bounded LRU mapping key ids to the actor owning the key and the loaded
+    public key, so verifying the signature of requests coming from
+    a known actor requires neither a database query nor PEM parsing.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key_id):
+        with self.lock:
+            entry = self.entries.get(key_id)
+            if entry is None:
+                return None
+            if entry.expires <= timezone.now():
+                del self.entries[key_id]
+                return None
+            self.entries.move_to_end(key_id)
+            return entry
+
+    def set(self, key_id, actor, public_key, expires):
+        with self.lock:
+            self.entries[key_id] = CachedPublicKey(
+                actor_pk=actor.pk, actor=actor, public_key=public_key, expires=expires
+            )
+            self.entries.move_to_end(key_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, actor_fid):
+        with self.lock:
+            for key_id, entry in list(self.entries.items()):
+                if entry.actor.fid == actor_fid or key_id.split("#")[0] == actor_fid:
+                    del self.entries[key_id]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+public_keys = PublicKeyCache(PUBLIC_KEYS_CACHE_SIZE)
@@ -32,18 +32,30 @@ def get_library_data(library_url, actor):
     return serializer.validated_data
 
 
-def get_library_page(library, page_url, actor):
+def get_library_page(library, page_url, actor, etag=None):
+    """
+    Fetch and validate a page of the library. If an etag is given and the
+    page did not change since, return None. The ETag of the page,
+    if any, is included in the returned data.
+    """
     auth = signing.get_auth(actor.private_key, actor.private_key_id)
+    headers = {"Content-Type": "application/activity+json"}
+    if etag:
+        headers["If-None-Match"] = etag
     response = session.get_session().get(
         page_url,
         auth=auth,
         timeout=5,
         verify=settings.EXTERNAL_REQUESTS_VERIFY_SSL,
-        headers={"Content-Type": "application/activity+json"},
+        headers=headers,
     )
+    if response.status_code == 304:
+        return None
     serializer = serializers.CollectionPageSerializer(
         data=response.json(),
         context={"library": library, "item_serializer": serializers.UploadSerializer},
     )
     serializer.is_valid(raise_exception=True)
-    return serializer.validated_data
+    data = serializer.validated_data
+    data["etag"] = response.headers.get("ETag")
+    return data
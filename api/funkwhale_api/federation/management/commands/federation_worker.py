@@ -0,0 +1,56 @@
+import asyncio
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from funkwhale_api.federation import engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver federation activities to remote instances, using an "
+        "asynchronous engine that can send many requests concurrently. "
+        "Requires FEDERATION_DELIVERY_WORKER=true, so deliveries are not "
+        "sent by celery workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            action="store",
+            dest="concurrency",
+            type=int,
+            default=settings.FEDERATION_WORKER_CONCURRENCY,
+            help="Maximum number of requests in flight at the same time",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            action="store",
+            dest="poll_interval",
+            type=float,
+            default=1,
+            help="How often to check for new deliveries, in seconds",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.FEDERATION_DELIVERY_WORKER:
+            raise CommandError(
+                "FEDERATION_DELIVERY_WORKER is disabled, deliveries are sent "
+                "by celery workers"
+            )
+        worker = engine.DeliveryWorker(concurrency=options["concurrency"])
+        loop = asyncio.get_event_loop()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(sig, worker.stop)
+        self.stdout.write(
+            "Delivering activities with up to {} concurrent requests".format(
+                worker.concurrency
+            )
+        )
+        loop.run_until_complete(worker.run(poll_interval=options["poll_interval"]))
+        self.stdout.write(
+            "{} activities delivered, {} failed".format(
+                worker.stats["delivered"], worker.stats["failed"]
+            )
+        )
@@ -0,0 +1,32 @@
+# Generated by Django 2.0.8 on 2018-10-08 14:21
+
+import urllib.parse
+
+from django.db import migrations, models
+
+
+def populate_host(apps, schema_editor):
+    Delivery = apps.get_model("federation", "Delivery")
+    pending = Delivery.objects.filter(is_delivered=False, host=None)
+    for url in pending.values_list("inbox_url", flat=True).distinct():
+        pending.filter(inbox_url=url).update(host=urllib.parse.urlparse(url).netloc)
+
+
+def rewind(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("federation", "0012_auto_20180920_1803")]
+
+    operations = [
+        migrations.AddField(
+            model_name="delivery",
+            name="host",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=255, null=True
+            ),
+        ),
+        migrations.RunPython(populate_host, rewind),
+    ]
@@ -188,11 +188,18 @@ class Delivery(models.Model):
     last_attempt_date = models.DateTimeField(null=True, blank=True)
     attempts = models.PositiveIntegerField(default=0)
     inbox_url = models.URLField(max_length=500)
+    # deliveries are grouped by host, to send them over the same connection
+    host = models.CharField(max_length=255, null=True, blank=True, db_index=True)
 
     activity = models.ForeignKey(
         "Activity", related_name="deliveries", on_delete=models.CASCADE
     )
 
+    def save(self, **kwargs):
+        if not self.host:
+            self.host = federation_utils.get_domain(self.inbox_url)
+        return super().save(**kwargs)
+
 
 class Activity(models.Model):
     actor = models.ForeignKey(
@@ -9,7 +9,7 @@ from rest_framework import serializers
 from funkwhale_api.common import utils as funkwhale_utils
 from funkwhale_api.music import models as music_models
 
-from . import activity, models, utils
+from . import activity, keys, models, utils
 
 AP_CONTEXT = [
     "https://www.w3.org/ns/activitystreams",
@@ -132,7 +132,10 @@ class ActorSerializer(serializers.Serializer):
     def save(self, **kwargs):
         d = self.prepare_missing_fields()
         d.update(kwargs)
-        return models.Actor.objects.update_or_create(fid=d["fid"], defaults=d)[0]
+        actor = models.Actor.objects.update_or_create(fid=d["fid"], defaults=d)[0]
+        # the public key may have changed
+        keys.public_keys.invalidate(actor.fid)
+        return actor
 
     def validate_summary(self, value):
         if value:
@@ -833,6 +836,8 @@ class UploadSerializer(serializers.Serializer):
             "library": validated_data["library"],
             "from_activity": self.context.get("activity"),
             "import_status": "finished",
+            # remote uploads share a single import summary per library
+            "import_reference": "federation",
         }
         return music_models.Upload.objects.create(**data)
 
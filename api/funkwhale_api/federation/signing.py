@@ -1,8 +1,20 @@
+import base64
+import collections
 import datetime
+import email.utils
+import functools
+import hashlib
 import logging
+import threading
 import pytz
 
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+
 from django import forms
+from django.conf import settings
 from django.utils import timezone
 from django.utils.http import parse_http_date
 
@@ -15,6 +27,9 @@ logger = logging.getLogger(__name__)
 
 #  the request Date should be between now - 30s and now + 30s
 DATE_HEADER_VALID_FOR = 30
+# number of actors for which the loaded signing key is kept in memory
+AUTH_CACHE_SIZE = 256
+SIGNED_HEADERS = ["(request-target)", "user-agent", "host", "date", "content-type"]
 
 
 def verify_date(raw_date):
@@ -38,13 +53,45 @@ def verify_date(raw_date):
 
 
 def verify(request, public_key):
+    """
+    Verify the signature of the request, with a PEM-encoded public key
+    or a key already loaded with keys.load_public_key.
+    """
     verify_date(request.headers.get("Date"))
 
+    if not isinstance(public_key, (bytes, str)):
+        return verify_with_loaded_key(request, public_key)
     return requests_http_signature.HTTPSignatureAuth.verify(
         request, key_resolver=lambda **kwargs: public_key, use_auth_header=False
     )
 
 
+def parse_signature_header(header):
+    return {
+        part.split("=", 1)[0]: part.split("=", 1)[1].strip('"')
+        for part in header.split(",")
+        if "=" in part
+    }
+
+
+def verify_with_loaded_key(request, public_key):
+    """
+    Same as requests_http_signature verification, without parsing the public
+    key again. Raise cryptography.exceptions.InvalidSignature on failure.
+    """
+    sig_struct = parse_signature_header(request.headers["Signature"])
+    algorithm = sig_struct.get("algorithm", "rsa-sha256")
+    if algorithm not in ["rsa-sha256", "rsa-sha1"]:
+        raise forms.ValidationError("Unsupported algorithm {}".format(algorithm))
+    headers = sig_struct.get("headers", "date").split(" ")
+    signature = base64.b64decode(sig_struct["signature"])
+    string_to_sign = requests_http_signature.HTTPSignatureAuth.get_string_to_sign(
+        request, headers
+    )
+    hasher = hashes.SHA1() if algorithm == "rsa-sha1" else hashes.SHA256()
+    public_key.verify(signature, string_to_sign, padding.PKCS1v15(), hasher)
+
+
 def verify_django(django_request, public_key):
     """
     Given a django WSGI request, create an underlying requests.PreparedRequest
@@ -82,11 +129,82 @@ def verify_django(django_request, public_key):
     return verify(request, public_key)
 
 
+class SignatureAuth(requests.auth.AuthBase):
+    """
+    Sign requests in the Signature header, like requests_http_signature, but
+    with a private key that is parsed once, instead of on every request.
+
+    Signatures are deterministic, so when signature_cache_size is set,
+    the signatures of identical strings to sign (same target, headers, date
+    and body digest) are kept and reused.
+    """
+
+    algorithm = "rsa-sha256"
+
+    def __init__(self, private_key, key_id, headers, signature_cache_size=0):
+        self.key = serialization.load_pem_private_key(
+            private_key, password=None, backend=default_backend()
+        )
+        self.key_id = key_id
+        self.headers = headers
+        self.signature_cache_size = signature_cache_size
+        self.signatures = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if "Date" not in request.headers:
+            request.headers["Date"] = email.utils.formatdate(usegmt=True)
+        # the auth may be shared, self.headers must not be modified
+        headers = list(self.headers)
+        if request.body is not None:
+            body = request.body
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            if "Digest" not in request.headers:
+                digest = base64.b64encode(hashlib.sha256(body).digest()).decode()
+                request.headers["Digest"] = "SHA-256=" + digest
+            headers.append("digest")
+        string_to_sign = requests_http_signature.HTTPSignatureAuth.get_string_to_sign(
+            request, headers
+        )
+        signature = self.sign(string_to_sign)
+        request.headers["Signature"] = ",".join(
+            '{}="{}"'.format(k, v)
+            for k, v in [
+                ("keyId", self.key_id),
+                ("algorithm", self.algorithm),
+                ("headers", " ".join(headers)),
+                ("signature", signature),
+            ]
+        )
+        return request
+
+    def sign(self, string_to_sign):
+        if self.signature_cache_size:
+            with self.lock:
+                signature = self.signatures.get(string_to_sign)
+            if signature:
+                return signature
+        signature = base64.b64encode(
+            self.key.sign(string_to_sign, padding.PKCS1v15(), hashes.SHA256())
+        ).decode()
+        if self.signature_cache_size:
+            with self.lock:
+                self.signatures[string_to_sign] = signature
+                while len(self.signatures) > self.signature_cache_size:
+                    self.signatures.popitem(last=False)
+        return signature
+
+
+@functools.lru_cache(maxsize=AUTH_CACHE_SIZE)
 def get_auth(private_key, private_key_id):
-    return requests_http_signature.HTTPSignatureAuth(
-        use_auth_header=False,
-        headers=["(request-target)", "user-agent", "host", "date", "content-type"],
-        algorithm="rsa-sha256",
-        key=private_key.encode("utf-8"),
+    """
+    Return the auth object to sign requests with the given key. Auth objects
+    are cached, so the private key is only parsed once per actor.
+    """
+    return SignatureAuth(
+        private_key.encode("utf-8"),
         key_id=private_key_id,
+        headers=SIGNED_HEADERS,
+        signature_cache_size=settings.FEDERATION_SIGNATURE_CACHE_SIZE,
     )
@@ -1,15 +1,22 @@
+import concurrent.futures
 import datetime
 import logging
 import os
+import time
 
 from django.conf import settings
-from django.db.models import Q, F
+from django.core.cache import cache
+from django.db.models import Count, F, Q, Sum
 from django.utils import timezone
+from django_redis import get_redis_connection
 from dynamic_preferences.registries import global_preferences_registry
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError, RequestException
 
 from funkwhale_api.common import preferences
 from funkwhale_api.common import session
+from funkwhale_api.common import utils as common_utils
+from funkwhale_api.history import models as history_models
+from funkwhale_api.music import access as music_access
 from funkwhale_api.music import models as music_models
 from funkwhale_api.taskapp import celery
 
@@ -19,51 +26,245 @@ from . import routes
 logger = logging.getLogger(__name__)
 
 
+# number of files deleted from the cache in a single query
+EVICTION_BATCH_SIZE = 500
+# pinned tracks are selected based on their listenings over this period
+PIN_PERIOD = datetime.timedelta(days=30)
+# a cleaning run stops after this many seconds, to stay well below
+# CELERY_TASK_TIME_LIMIT, and is rescheduled to handle the remaining files
+CLEANING_TIME_BUDGET = 200
+CLEANING_RESCHEDULE_DELAY = 10
+
+
+def get_cached_uploads():
+    return (
+        music_models.Upload.objects.local(False)
+        .filter(audio_file__isnull=False)
+        .exclude(audio_file="")
+    )
+
+
+def get_pinned_tracks(min_listenings):
+    return (
+        history_models.Listening.objects.filter(
+            creation_date__gte=timezone.now() - PIN_PERIOD
+        )
+        .values("track")
+        .annotate(listenings=Count("id"))
+        .filter(listenings__gte=min_listenings)
+        .values("track")
+    )
+
+
+def compute_music_cache_size():
+    return get_cached_uploads().aggregate(total=Sum("size"))["total"] or 0
+
+
+def evict_uploads(uploads):
+    """
+    Remove the given uploads, a list of (pk, audio_file, size) tuples,
+    from the cache.
+    """
+    storage = music_models.Upload._meta.get_field("audio_file").storage
+    for i in range(0, len(uploads), EVICTION_BATCH_SIZE):
+        batch = uploads[i : i + EVICTION_BATCH_SIZE]
+        for _, path, _ in batch:
+            storage.delete(path)
+        music_models.Upload.objects.filter(pk__in=[pk for pk, _, _ in batch]).update(
+            audio_file=""
+        )
+    return len(uploads)
+
+
+def evict_expired_uploads(candidates, limit, deadline):
+    """
+    Evict uploads that were not accessed since the given limit, by batches,
+    until there is none left or the deadline is reached.
+
+    Return True if all expired uploads were evicted.
+    """
+    expired = (
+        candidates.filter(Q(accessed_date__lt=limit) | Q(accessed_date=None))
+        .order_by("id")
+        .values_list("pk", "audio_file", "size")
+    )
+    evicted = 0
+    done = False
+    while not done:
+        # evicted uploads leave the queryset, so we always take the first batch
+        batch = list(expired[:EVICTION_BATCH_SIZE])
+        evicted += evict_uploads(batch)
+        done = len(batch) < EVICTION_BATCH_SIZE
+        if time.monotonic() > deadline:
+            break
+    logger.info("Evicted %s expired files from the music cache", evicted)
+    return done
+
+
+def evict_least_recently_used(candidates, size, max_size, deadline):
+    """
+    Evict the least recently listened uploads, by batches, until the cache
+    size is below max_size or the deadline is reached.
+
+    Return True if the cache size is below max_size.
+    """
+    lru = candidates.order_by(
+        F("accessed_date").asc(nulls_first=True), "id"
+    ).values_list("pk", "audio_file", "size")
+    evicted = 0
+    while size > max_size:
+        batch = list(lru[:EVICTION_BATCH_SIZE])
+        if not batch:
+            break
+        to_evict = []
+        for upload in batch:
+            if size <= max_size:
+                break
+            to_evict.append(upload)
+            size -= upload[2] or 0
+        evicted += evict_uploads(to_evict)
+        if time.monotonic() > deadline:
+            break
+    logger.info("Evicted %s files to keep the music cache size", evicted)
+    return size <= max_size
+
+
 @celery.app.task(name="federation.clean_music_cache")
 def clean_music_cache():
+    """
+    Remove expired and least recently used files from the music cache,
+    then orphaned files.
+
+    Each step works by batches and the run stops once CLEANING_TIME_BUDGET
+    is spent, in which case another run is scheduled to finish the job.
+    """
+    deadline = time.monotonic() + CLEANING_TIME_BUDGET
     preferences = global_preferences_registry.manager()
     delay = preferences["federation__music_cache_duration"]
-    if delay < 1:
+    max_size = preferences["federation__music_cache_size"] * 1024 * 1024
+    min_listenings = preferences["federation__music_cache_pin_listenings"]
+    if delay < 1 and max_size < 1:
         return  # cache clearing disabled
-    limit = timezone.now() - datetime.timedelta(minutes=delay)
+    # ensure recently played files are not deleted
+    music_access.flush(music_models.Upload)
+
+    candidates = get_cached_uploads()
+    if min_listenings > 0:
+        candidates = candidates.exclude(track__in=get_pinned_tracks(min_listenings))
+
+    done = True
+    if delay > 0:
+        limit = timezone.now() - datetime.timedelta(minutes=delay)
+        done = evict_expired_uploads(candidates, limit, deadline)
+
+    if done and max_size > 0:
+        # computed from the database on each run, since uploads can leave
+        # the cache in many ways (e.g. deleted in cascade with their library)
+        size = compute_music_cache_size()
+        if size > max_size:
+            done = evict_least_recently_used(candidates, size, max_size, deadline)
+
+    if done:
+        # we also delete orphaned files, if any
+        clean_orphaned_files(deadline=deadline)
+        # the cursor is kept when the walk was interrupted
+        done = cache.get(ORPHANS_CURSOR_CACHE_KEY) is None
+
+    if not done:
+        logger.info("Music cache cleaning budget exhausted, rescheduling")
+        clean_music_cache.apply_async(countdown=CLEANING_RESCHEDULE_DELAY)
+
 
-    candidates = (
-        music_models.Upload.objects.filter(
-            Q(audio_file__isnull=False)
-            & (Q(accessed_date__lt=limit) | Q(accessed_date=None)),
-            # library__actor__user=None,
+# number of paths checked against the database in a single query
+ORPHANS_BATCH_SIZE = 1000
+ORPHANS_CURSOR_CACHE_KEY = "federation:music-cache:orphans-cursor"
+
+
+def clean_orphaned_files(root="federation_cache/tracks", deadline=None):
+    """
+    Delete files from the federation cache that are not referenced
+    by any upload.
+
+    Files are walked in a stable order and checked by batches, and the last
+    checked path is stored in the cache, so an interrupted run (e.g. because
+    of the task time limit) resumes where it stopped instead of starting over.
+    If a deadline (as returned by time.monotonic()) is given, the walk stops
+    after the first batch that ends past it.
+    """
+    storage = music_models.Upload._meta.get_field("audio_file").storage
+    cursor = cache.get(ORPHANS_CURSOR_CACHE_KEY)
+    deleted = 0
+    for batch in common_utils.batch(
+        iter_files(storage, root, start_after=cursor), ORPHANS_BATCH_SIZE
+    ):
+        existing = set(
+            music_models.Upload.objects.filter(audio_file__in=batch).values_list(
+                "audio_file", flat=True
+            )
         )
-        .local(False)
-        .exclude(audio_file="")
-        .only("audio_file", "id")
-        .order_by("id")
-    )
-    for upload in candidates:
-        upload.audio_file.delete()
+        for path in batch:
+            if path not in existing:
+                storage.delete(path)
+                deleted += 1
+        cache.set(ORPHANS_CURSOR_CACHE_KEY, batch[-1], None)
+        if deadline is not None and time.monotonic() > deadline:
+            logger.info("Deleted %s orphaned files from the music cache", deleted)
+            return deleted
+
+    # the whole tree was walked, next run will start from the beginning
+    cache.delete(ORPHANS_CURSOR_CACHE_KEY)
+    logger.info("Deleted %s orphaned files from the music cache", deleted)
+    return deleted
 
-    # we also delete orphaned files, if any
-    storage = models.LibraryTrack._meta.get_field("audio_file").storage
-    files = get_files(storage, "federation_cache/tracks")
-    existing = music_models.Upload.objects.filter(audio_file__in=files)
-    missing = set(files) - set(existing.values_list("audio_file", flat=True))
-    for m in missing:
-        storage.delete(m)
 
+def get_local_path(storage, path):
+    try:
+        return storage.path(path)
+    except NotImplementedError:
+        # not a filesystem storage
+        return
 
-def get_files(storage, *parts):
+
+def list_directory(storage, path):
     """
-    This is a recursive function that return all files available
-    in a given directory using django's storage.
+    Return a sorted list of (name, is_dir) tuples for the given
+    storage directory.
     """
-    if not parts:
-        raise ValueError("Missing path")
+    local_path = get_local_path(storage, path)
     try:
-        dirs, files = storage.listdir(os.path.join(*parts))
+        if local_path:
+            with os.scandir(local_path) as entries:
+                children = [(entry.name, entry.is_dir()) for entry in entries]
+        else:
+            dirs, files = storage.listdir(path)
+            children = [(d, True) for d in dirs] + [(f, False) for f in files]
     except FileNotFoundError:
         return []
-    for dir in dirs:
-        files += get_files(storage, *(list(parts) + [dir]))
-    return [os.path.join(parts[-1], path) for path in files]
+    return sorted(children)
+
+
+def iter_files(storage, path, start_after=None):
+    """
+    Yield the paths of all the files available under the given
+    directory, in a stable order. If start_after is provided, only files
+    that come after this path are returned, and directories that were
+    completely walked already are not listed again.
+
+    Directories are listed one at a time, using os.scandir for local storages
+    and storage.listdir for other storages, so memory usage is bounded by
+    the size of the largest directory.
+    """
+    parts = tuple(path.split("/"))
+    cursor = tuple(start_after.split("/")) if start_after else None
+    if cursor and cursor[: len(parts)] != parts and parts < cursor:
+        return
+    for name, is_dir in list_directory(storage, path):
+        child = parts + (name,)
+        child_path = "/".join(child)
+        if is_dir:
+            yield from iter_files(storage, child_path, start_after=start_after)
+        elif not cursor or child > cursor:
+            yield child_path
 
 
 @celery.app.task(name="federation.dispatch_inbox")
@@ -101,8 +302,8 @@ def dispatch_outbox(activity):
 
     deliveries = activity.deliveries.filter(is_delivered=False)
 
-    for id in deliveries.values_list("pk", flat=True):
-        deliver_to_remote.delay(delivery_id=id)
+    for host in deliveries.values_list("host", flat=True).distinct():
+        schedule_host_delivery(host)
 
 
 @celery.app.task(
@@ -147,3 +348,212 @@ def deliver_to_remote(delivery):
         delivery.attempts = F("attempts") + 1
         delivery.is_delivered = True
         delivery.save(update_fields=["last_attempt_date", "attempts", "is_delivered"])
+
+
+# number of deliveries loaded from the database at once by deliver_to_host
+DELIVERY_BATCH_SIZE = 100
+# a delivery is abandoned after this number of failed attempts
+DELIVERY_MAX_ATTEMPTS = 6
+# delay before the first retry of a failed delivery, doubled on each attempt
+DELIVERY_RETRY_DELAY = 30
+DELIVERY_LOCK_TIMEOUT = 60 * 10
+# hosts with new deliveries, when they are handled by the federation_worker
+# command instead of celery
+DELIVERY_HOSTS_KEY = "federation:delivery:hosts"
+
+
+def get_delivery_cache_key(name, host):
+    return "federation:delivery:{}:{}".format(name, host)
+
+
+def schedule_host_delivery(host, countdown=None):
+    """
+    Ensure a deliver_to_host task is queued for the given host. Activities
+    dispatched before this task runs are delivered together.
+
+    Delayed retries are tracked separately, so a pending retry never
+    postpones the delivery of new activities.
+    """
+    if settings.FEDERATION_DELIVERY_WORKER:
+        get_redis_connection("default").sadd(DELIVERY_HOSTS_KEY, host)
+        return
+    if countdown:
+        key = get_delivery_cache_key("retry", host)
+        if cache.add(key, True, DELIVERY_LOCK_TIMEOUT + countdown):
+            deliver_to_host.apply_async(
+                kwargs={"host": host, "retry": True}, countdown=countdown
+            )
+        return
+    key = get_delivery_cache_key("scheduled", host)
+    if cache.add(key, True, DELIVERY_LOCK_TIMEOUT):
+        deliver_to_host.apply_async(kwargs={"host": host}, countdown=countdown)
+
+
+def get_retry_delay(attempts):
+    return datetime.timedelta(seconds=DELIVERY_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def get_next_attempt_date(delivery):
+    if not delivery.attempts or not delivery.last_attempt_date:
+        return None
+    return delivery.last_attempt_date + get_retry_delay(delivery.attempts)
+
+
+def split_due_deliveries(deliveries, now):
+    """
+    Return the deliveries that can be attempted now, and the date of
+    the next attempt for the other ones, if any.
+    """
+    due = []
+    next_attempt_date = None
+    for delivery in deliveries:
+        date = get_next_attempt_date(delivery)
+        if date and date > now:
+            if next_attempt_date is None or date < next_attempt_date:
+                next_attempt_date = date
+            continue
+        due.append(delivery)
+    return due, next_attempt_date
+
+
+def get_pending_deliveries(host):
+    return (
+        models.Delivery.objects.filter(
+            host=host, is_delivered=False, attempts__lt=DELIVERY_MAX_ATTEMPTS
+        )
+        .select_related("activity__actor")
+        .order_by("pk")
+    )
+
+
+def send_delivery(delivery, auth):
+    """
+    Post the activity of the given delivery to the remote inbox. Return True
+    on success, False on error, and raise ConnectionError if the host
+    is unreachable.
+    """
+    try:
+        response = session.get_session().post(
+            auth=auth,
+            json=delivery.activity.payload,
+            url=delivery.inbox_url,
+            timeout=5,
+            verify=settings.EXTERNAL_REQUESTS_VERIFY_SSL,
+            headers={"Content-Type": "application/activity+json"},
+        )
+        logger.debug("Remote answered with %s", response.status_code)
+        response.raise_for_status()
+    except ConnectionError:
+        raise
+    except RequestException as e:
+        logger.info("Error while delivering to %s: %s", delivery.inbox_url, e)
+        return False
+    return True
+
+
+def record_delivery_attempts(pks, date, is_delivered):
+    if not pks:
+        return
+    updates = {"last_attempt_date": date, "attempts": F("attempts") + 1}
+    if is_delivered:
+        updates["is_delivered"] = True
+    models.Delivery.objects.filter(pk__in=pks).update(**updates)
+
+
+def deliver_pending(host):
+    """
+    Deliver the pending activities for the given host, in batches, with
+    at most FEDERATION_DELIVERY_CONCURRENCY requests in parallel.
+
+    Return a dictionary with the number of delivered and failed deliveries,
+    and the date of the next retry, if any.
+    """
+    result = {"delivered": 0, "failed": 0, "next_attempt_date": None}
+    auths = {}
+    cursor = 0
+
+    def postpone(date):
+        if result["next_attempt_date"] is None or date < result["next_attempt_date"]:
+            result["next_attempt_date"] = date
+
+    pending = get_pending_deliveries(host)
+    concurrency = settings.FEDERATION_DELIVERY_CONCURRENCY
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        while True:
+            batch = list(pending.filter(pk__gt=cursor)[:DELIVERY_BATCH_SIZE])
+            if not batch:
+                break
+            cursor = batch[-1].pk
+            now = timezone.now()
+            to_send, next_attempt_date = split_due_deliveries(batch, now)
+            if next_attempt_date:
+                postpone(next_attempt_date)
+            due = []
+            for delivery in to_send:
+                actor = delivery.activity.actor
+                if actor.pk not in auths:
+                    auths[actor.pk] = signing.get_auth(
+                        actor.private_key, actor.private_key_id
+                    )
+                future = pool.submit(send_delivery, delivery, auths[actor.pk])
+                due.append((delivery, future))
+
+            delivered, failed = [], []
+            unreachable = False
+            for delivery, future in due:
+                try:
+                    success = future.result()
+                except ConnectionError:
+                    success = False
+                    unreachable = True
+                if success:
+                    delivered.append(delivery.pk)
+                else:
+                    failed.append(delivery.pk)
+                    if delivery.attempts + 1 < DELIVERY_MAX_ATTEMPTS:
+                        postpone(now + get_retry_delay(delivery.attempts + 1))
+            record_delivery_attempts(delivered, now, is_delivered=True)
+            record_delivery_attempts(failed, now, is_delivered=False)
+            result["delivered"] += len(delivered)
+            result["failed"] += len(failed)
+            if unreachable:
+                # no need to hammer a host that is down, remaining deliveries
+                # will be sent on next run
+                postpone(now + datetime.timedelta(seconds=DELIVERY_RETRY_DELAY))
+                break
+
+    return result
+
+
+@celery.app.task(name="federation.deliver_to_host")
+def deliver_to_host(host, retry=False):
+    """
+    Deliver all the pending activities for the given remote host, reusing
+    the same connections, and update the deliveries in bulk.
+    """
+    if not preferences.get("federation__enabled"):
+        return
+
+    cache.delete(get_delivery_cache_key("retry" if retry else "scheduled", host))
+    lock_key = get_delivery_cache_key("lock", host)
+    if not cache.add(lock_key, True, DELIVERY_LOCK_TIMEOUT):
+        # another worker is delivering to this host, but it may already have
+        # loaded its last batch, so we try again later
+        schedule_host_delivery(host, countdown=DELIVERY_RETRY_DELAY)
+        return
+    try:
+        result = deliver_pending(host)
+    finally:
+        cache.delete(lock_key)
+
+    next_attempt_date = result.pop("next_attempt_date")
+    if next_attempt_date:
+        countdown = max(0, (next_attempt_date - timezone.now()).total_seconds())
+        schedule_host_delivery(host, countdown=int(countdown) + 1)
+    logger.info(
+        "Delivered %s activities to %s, %s failed",
+        result["delivered"],
+        host,
+        result["failed"],
+    )
+    return result
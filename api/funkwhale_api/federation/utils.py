@@ -1,5 +1,7 @@
 import unicodedata
 import re
+import urllib.parse
+
 from django.conf import settings
 
 from funkwhale_api.common import session
@@ -22,6 +24,10 @@ def full_url(path):
         return root + path
 
 
+def get_domain(url):
+    return urllib.parse.urlparse(url).netloc
+
+
 def clean_wsgi_headers(raw_headers):
     """
     Convert WSGI headers from CONTENT_TYPE to Content-Type notation
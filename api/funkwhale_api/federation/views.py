@@ -1,7 +1,12 @@
+import hashlib
+
 from django import forms
 from django.core import paginator
+from django.db.models import Count, Max
 from django.http import HttpResponse
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
 from rest_framework import exceptions, mixins, response, viewsets
 from rest_framework.decorators import detail_route, list_route
 
@@ -132,6 +137,35 @@ def has_library_access(request, library):
     return library.received_follows.filter(actor=actor, approved=True).exists()
 
 
+def get_library_validators(library, items, *extra):
+    """
+    Return the ETag and Last-Modified timestamp of a library collection or
+    page, computed from its uploads, so remote instances can send
+    conditional requests when rescanning the library.
+    """
+    stats = items.order_by().aggregate(
+        count=Count("id"),
+        last_created=Max("creation_date"),
+        last_modified=Max("modification_date"),
+    )
+    dates = [
+        d
+        for d in [library.creation_date, stats["last_created"], stats["last_modified"]]
+        if d
+    ]
+    last_modified = int(max(dates).timestamp())
+    parts = [
+        library.name,
+        library.description,
+        library.privacy_level,
+        stats["count"],
+        stats["last_created"],
+        stats["last_modified"],
+    ] + list(extra)
+    key = "|".join([str(part) for part in parts])
+    return quote_etag(hashlib.sha1(key.encode("utf-8")).hexdigest()), last_modified
+
+
 class MusicLibraryViewSet(
     FederationMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet
 ):
@@ -154,21 +188,29 @@ class MusicLibraryViewSet(
             "item_serializer": serializers.UploadSerializer,
         }
         page = request.GET.get("page")
+        page_size = preferences.get("federation__collection_page_size")
+        if page is not None and not has_library_access(request, lb):
+            # if actor is requesting a specific page, we ensure library is public
+            # or readable by the actor
+            raise exceptions.AuthenticationFailed(
+                "You do not have access to this library"
+            )
+        etag, last_modified = get_library_validators(lb, conf["items"], page, page_size)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            return not_modified
+
         if page is None:
             serializer = serializers.LibrarySerializer(lb)
             data = serializer.data
         else:
-            # if actor is requesting a specific page, we ensure library is public
-            # or readable by the actor
-            if not has_library_access(request, lb):
-                raise exceptions.AuthenticationFailed(
-                    "You do not have access to this library"
-                )
             try:
                 page_number = int(page)
             except Exception:
                 return response.Response({"page": ["Invalid page number"]}, status=400)
-            conf["page_size"] = preferences.get("federation__collection_page_size")
+            conf["page_size"] = page_size
             p = paginator.Paginator(conf["items"], conf["page_size"])
             try:
                 page = p.page(page_number)
@@ -178,7 +220,10 @@ class MusicLibraryViewSet(
             except paginator.EmptyPage:
                 return response.Response(status=404)
 
-        return response.Response(data)
+        r = response.Response(data)
+        r["ETag"] = etag
+        r["Last-Modified"] = http_date(last_modified)
+        return r
 
     @detail_route(methods=["get"])
     def followers(self, request, *args, **kwargs):
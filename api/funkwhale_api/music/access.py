@@ -0,0 +1,107 @@
+"""
+Write-behind buffering of the accessed_date of uploads and transcoded versions.
+
+Serving a file can happen several times per play (e.g. range requests), and
+updating the accessed_date synchronously results in many small UPDATE queries
+on hot tables. Instead, access times are recorded in a Redis hash, and flushed
+in bulk to the database by a periodic task.
+
+Cache cleaning only needs approximate recency data, so a delay of a few
+minutes is acceptable, and the buffer is flushed before each cleaning anyway.
+"""
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+FLUSH_BATCH_SIZE = 500
+
+
+def get_buffer_key(model):
+    return "music:accessed:{}".format(model._meta.model_name)
+
+
+def record_access(obj, date=None):
+    """
+    Record that the given object was accessed, the database will be
+    updated on next flush.
+    """
+    date = date or timezone.now()
+    try:
+        get_redis_connection("default").hset(
+            get_buffer_key(obj.__class__), obj.pk, date.timestamp()
+        )
+    except Exception:
+        # we don't want to lose the information if Redis is unavailable
+        logger.exception("Cannot buffer accessed date, updating database")
+        obj.__class__.objects.filter(pk=obj.pk).update(accessed_date=date)
+    obj.accessed_date = date
+
+
+def get_pending_accesses(model):
+    """
+    Atomically move the buffered access times for the given model out of
+    the way of new accesses, and return the temporary key holding them with
+    a {pk: datetime} dict.
+    """
+    key = get_buffer_key(model)
+    flushing_key = "{}:flushing".format(key)
+    connection = get_redis_connection("default")
+    if not connection.exists(flushing_key):
+        # a previous flush may have failed after the rename,
+        # in which case we retry with the same data first
+        if not connection.exists(key):
+            return None, {}
+        connection.rename(key, flushing_key)
+    data = connection.hgetall(flushing_key)
+    return (
+        flushing_key,
+        {
+            int(pk): datetime.datetime.fromtimestamp(
+                float(timestamp), tz=datetime.timezone.utc
+            )
+            for pk, timestamp in data.items()
+        },
+    )
+
+
+def flush(model):
+    """
+    Write the buffered access times of the given model to the database.
+    Return the number of updated rows.
+    """
+    flushing_key, dates = get_pending_accesses(model)
+    if not dates:
+        return 0
+    updated = 0
+    pks = sorted(dates)
+    for i in range(0, len(pks), FLUSH_BATCH_SIZE):
+        chunk = pks[i : i + FLUSH_BATCH_SIZE]
+        with transaction.atomic():
+            dates_case = Case(
+                *[When(pk=pk, then=Value(dates[pk])) for pk in chunk],
+                output_field=DateTimeField()
+            )
+            # the row may have been updated directly in the meantime
+            # (e.g. by prefetching), we never move the date backwards
+            updated += model.objects.filter(pk__in=chunk).update(
+                accessed_date=Greatest(F("accessed_date"), dates_case)
+            )
+    get_redis_connection("default").delete(flushing_key)
+    logger.info("Flushed %s accessed dates for %s", updated, model._meta.label)
+    return updated
+
+
+def flush_all():
+    return {
+        model._meta.label: flush(model)
+        for model in [models.Upload, models.UploadVersion]
+    }
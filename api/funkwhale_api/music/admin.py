@@ -80,7 +80,7 @@ class UploadAdmin(admin.ModelAdmin):
 
 def launch_scan(modeladmin, request, queryset):
     for library in queryset:
-        library.schedule_scan(actor=request.user.actor, force=True)
+        library.schedule_scan(actor=request.user.actor, force=True, full=True)
 
 
 launch_scan.short_description = "Launch scan"
@@ -0,0 +1,79 @@
+from dynamic_preferences import types
+from dynamic_preferences.registries import global_preferences_registry
+
+music = types.Section("music")
+
+
+@global_preferences_registry.register
+class TranscodingEnabled(types.BooleanPreference):
+    show_in_api = True
+    section = music
+    name = "transcoding_enabled"
+    verbose_name = "Transcoding enabled"
+    default = True
+    help_text = (
+        "Enable transcoding of audio files in formats requested by the client. "
+        "This is especially useful for devices that do not support formats "
+        "such as Flac or Ogg, or to reduce bandwidth usage, but the transcoding "
+        "process will increase the load on the server."
+    )
+
+
+@global_preferences_registry.register
+class TranscodingCacheSize(types.IntegerPreference):
+    show_in_api = True
+    section = music
+    name = "transcoding_cache_size"
+    verbose_name = "Transcoding cache size"
+    default = 1024 * 10
+    help_text = (
+        "How much disk space, in megabytes, can be used to store transcoded "
+        "versions of audio files? When this size is exceeded, the least "
+        "recently played versions are deleted and will be transcoded again "
+        "on the next listening. Set this to 0 to disable the limit."
+    )
+    field_kwargs = {"required": False}
+
+
+@global_preferences_registry.register
+class PrefetchCount(types.IntegerPreference):
+    show_in_api = True
+    section = music
+    name = "prefetch_count"
+    verbose_name = "Number of remote tracks to prefetch"
+    default = 3
+    help_text = (
+        "When a user plays a radio or a playlist, how many of the upcoming "
+        "federated tracks should be downloaded in the cache in advance? "
+        "Set this to 0 to disable prefetching."
+    )
+    field_kwargs = {"required": False}
+
+
+@global_preferences_registry.register
+class PrefetchMaxDownloadsPerUser(types.IntegerPreference):
+    show_in_api = True
+    section = music
+    name = "prefetch_max_downloads_per_user"
+    verbose_name = "Concurrent prefetch downloads per user"
+    default = 2
+    help_text = (
+        "How many federated tracks can be prefetched at the same time "
+        "for a single user."
+    )
+    field_kwargs = {"required": False}
+
+
+@global_preferences_registry.register
+class PrefetchHourlyBudget(types.IntegerPreference):
+    show_in_api = True
+    section = music
+    name = "prefetch_hourly_budget"
+    verbose_name = "Prefetch bandwidth budget"
+    default = 1024
+    help_text = (
+        "How much data, in megabytes, can be prefetched from other instances "
+        "every hour, for all users? Tracks played directly are not "
+        "accounted for."
+    )
+    field_kwargs = {"required": False}
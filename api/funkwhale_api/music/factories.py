@@ -95,6 +95,30 @@ class UploadFactory(factory.django.DjangoModelFactory):
         )
 
 
+@registry.register
+class UploadSessionFactory(factory.django.DjangoModelFactory):
+    library = factory.SubFactory(federation_factories.MusicLibraryFactory)
+    filename = "test.ogg"
+    size = 1024
+
+    class Meta:
+        model = "music.UploadSession"
+
+
+@registry.register
+class UploadVersionFactory(factory.django.DjangoModelFactory):
+    upload = factory.SubFactory(UploadFactory, bitrate=200000)
+    bitrate = 128000
+    size = 1024
+    mimetype = "audio/mpeg"
+    audio_file = factory.django.FileField(
+        from_path=os.path.join(SAMPLES_PATH, "test.mp3")
+    )
+
+    class Meta:
+        model = "music.UploadVersion"
+
+
 @registry.register
 class WorkFactory(factory.django.DjangoModelFactory):
     mbid = factory.Faker("uuid4")
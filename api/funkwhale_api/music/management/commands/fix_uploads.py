@@ -23,6 +23,7 @@ class Command(BaseCommand):
         self.fix_mimetypes(**options)
         self.fix_file_data(**options)
         self.fix_file_size(**options)
+        self.fix_checksums(**options)
 
     @transaction.atomic
     def fix_mimetypes(self, dry_run, **kwargs):
@@ -57,17 +58,16 @@ class Command(BaseCommand):
         )
         if dry_run:
             return
-        for i, upload in enumerate(matching.only("audio_file")):
+        for i, upload in enumerate(matching.only("audio_file", "source")):
             self.stdout.write(
                 "[bitrate/length] {}/{} fixing file #{}".format(i + 1, total, upload.pk)
             )
 
             try:
-                audio_file = upload.get_audio_file()
-                if audio_file:
-                    data = utils.get_audio_file_data(audio_file)
+                data = upload.get_audio_data()
+                if data:
                     upload.bitrate = data["bitrate"]
-                    upload.duration = data["length"]
+                    upload.duration = data["duration"]
                     upload.save(update_fields=["duration", "bitrate"])
                 else:
                     self.stderr.write("[bitrate/length] no file found")
@@ -95,3 +95,31 @@ class Command(BaseCommand):
                 self.stderr.write(
                     "[size] error with file #{}: {}".format(upload.pk, str(e))
                 )
+
+    def fix_checksums(self, dry_run, **kwargs):
+        self.stdout.write("Fixing missing checksums...")
+        matching = models.Upload.objects.filter(
+            checksum__isnull=True, audio_file__startswith="tracks/"
+        )
+        total = matching.count()
+        self.stdout.write(
+            "[checksum] {} entries found with missing values".format(total)
+        )
+        if dry_run:
+            return
+        for i, upload in enumerate(matching.only("audio_file")):
+            self.stdout.write(
+                "[checksum] {}/{} fixing file #{}".format(i + 1, total, upload.pk)
+            )
+
+            try:
+                upload.audio_file.open("rb")
+                try:
+                    upload.checksum = utils.get_file_checksum(upload.audio_file)
+                finally:
+                    upload.audio_file.close()
+                upload.save(update_fields=["checksum"])
+            except Exception as e:
+                self.stderr.write(
+                    "[checksum] error with file #{}: {}".format(upload.pk, str(e))
+                )
@@ -1,13 +1,60 @@
+import concurrent.futures
 import glob
 import os
+import time
 import urllib.parse
 
+from django import db
 from django.conf import settings
 from django.core.files import File
 from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 
-from funkwhale_api.music import models, tasks
+from funkwhale_api.common import utils as common_utils
+from funkwhale_api.music import metadata, models, rescan, tasks
+
+
+def probe_file(path):
+    """
+    Read the audio data of the given file. This runs in worker processes,
+    so it must not touch the database. Tags are only parsed once, when
+    the upload is processed.
+    """
+    try:
+        probe = metadata.AudioProbe(path)
+        data = probe.get_audio_data()
+        data["path"] = path
+        data["mimetype"] = probe.mimetype
+        return data
+    except Exception as e:
+        return {"path": path, "error": "{} {}".format(e.__class__.__name__, e)}
+
+
+class ThroughputReport(object):
+    def __init__(self, stdout, total):
+        self.stdout = stdout
+        self.total = total
+        self.start = time.monotonic()
+        self.files = 0
+        self.size = 0
+        self.errors = 0
+
+    def add(self, files=0, size=0, errors=0):
+        self.files += files
+        self.size += size
+        self.errors += errors
+
+    def write(self):
+        elapsed = max(time.monotonic() - self.start, 0.001)
+        self.stdout.write(
+            "{}/{} files, {:.1f} files/s, {:.1f} MB/s, {} errors".format(
+                self.files + self.errors,
+                self.total,
+                self.files / elapsed,
+                self.size / elapsed / 1024 / 1024,
+                self.errors,
+            )
+        )
 
 
 class Command(BaseCommand):
@@ -42,7 +89,11 @@ class Command(BaseCommand):
             action="store_true",
             dest="async_",
             default=False,
-            help="Will launch celery tasks for each file to import instead of doing it synchronously and block the CLI",
+            help=(
+                "Will launch celery tasks for each file (or each batch of files, "
+                "with --workers) to import instead of doing it synchronously and "
+                "block the CLI"
+            ),
         )
         parser.add_argument(
             "--exit",
@@ -111,6 +162,47 @@ class Command(BaseCommand):
                 "reference being generated for you."
             ),
         )
+        parser.add_argument(
+            "--rescan",
+            action="store_true",
+            dest="rescan",
+            default=False,
+            help=(
+                "Use this flag with --in-place to only import new and modified "
+                "files, update moved files and remove deleted files, using the "
+                "index built during previous in-place imports."
+            ),
+        )
+        parser.add_argument(
+            "--checksum",
+            action="store_true",
+            dest="checksum",
+            default=False,
+            help=(
+                "Store a checksum of in-place files in the index, to detect moves "
+                "across filesystems and modifications that preserve the size and "
+                "modification time. This requires reading each new file entirely."
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            action="store",
+            dest="workers",
+            type=int,
+            default=0,
+            help=(
+                "Read tags from files using this number of processes, and create "
+                "uploads in batches. Recommended for large imports."
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            action="store",
+            dest="batch_size",
+            type=int,
+            default=200,
+            help="When using --workers, how many uploads to create in a single query",
+        )
         parser.add_argument(
             "--noinput",
             "--no-input",
@@ -123,15 +215,7 @@ class Command(BaseCommand):
         glob_kwargs = {}
         matching = []
 
-        try:
-            library = models.Library.objects.select_related("actor__user").get(
-                uuid__startswith=options["library_id"]
-            )
-        except models.Library.DoesNotExist:
-            raise CommandError("Invalid library id")
-
-        if not library.actor.get_user():
-            raise CommandError("Library {} is not a local library".format(library.uuid))
+        library = self.get_library(options["library_id"])
 
         if options["recursive"]:
             glob_kwargs["recursive"] = True
@@ -178,6 +262,9 @@ class Command(BaseCommand):
                         "needs to be accessible by the webserver."
                         "Culprit: {}".format(p, m)
                     )
+        if options["rescan"]:
+            return self.rescan(matching, library, options)
+
         if not matching:
             raise CommandError("No file matching pattern, aborting")
 
@@ -251,6 +338,61 @@ class Command(BaseCommand):
             )
         )
 
+    def get_library(self, library_id):
+        try:
+            library = models.Library.objects.select_related("actor__user").get(
+                uuid__startswith=library_id
+            )
+        except models.Library.DoesNotExist:
+            raise CommandError("Invalid library id")
+
+        if not library.actor.get_user():
+            raise CommandError("Library {} is not a local library".format(library.uuid))
+        return library
+
+    def rescan(self, matching, library, options):
+        if not options["in_place"]:
+            raise CommandError("Rescanning is only supported with --in-place")
+        checksum = options["checksum"]
+        indexed = rescan.bootstrap_index(library, checksum=checksum)
+        if indexed:
+            self.stdout.write("- {} previously imported files indexed".format(indexed))
+
+        changes = rescan.scan(matching, library, checksum=checksum)
+        self.stdout.write("Rescan summary:")
+        self.stdout.write("- {} unchanged files".format(changes.unchanged))
+        self.stdout.write("- {} new files".format(len(changes.new)))
+        self.stdout.write("- {} modified files".format(len(changes.modified)))
+        self.stdout.write("- {} moved files".format(len(changes.moved)))
+        self.stdout.write("- {} deleted files".format(len(changes.deleted)))
+        if not any([changes.new, changes.modified, changes.moved, changes.deleted]):
+            self.stdout.write("Nothing to update, exiting")
+            return
+
+        if options["interactive"]:
+            message = (
+                "Are you sure you want to do this?\n\n"
+                "Type 'yes' to continue, or 'no' to cancel: "
+            )
+            if input("".join(message)) != "yes":
+                raise CommandError("Rescan cancelled.")
+
+        rescan.apply_moves(changes.moved)
+        rescan.apply_deletions(changes.deleted)
+        errors = self.dispatch_imports(rescan.reset_modified(changes.modified), options)
+        if changes.new:
+            reference = options["reference"] or "cli-{}".format(
+                timezone.now().isoformat()
+            )
+            errors += self.do_import(
+                changes.new, library=library, reference=reference, options=options
+            )
+        if len(errors) > 0:
+            self.stderr.write("{} tracks could not be imported:".format(len(errors)))
+
+            for path, error in errors:
+                self.stderr.write("- {}: {}".format(path, error))
+
     def filter_matching(self, matching, library):
         sources = ["file://{}".format(p) for p in matching]
         # we skip reimport for path that are already found
@@ -267,6 +409,8 @@ class Command(BaseCommand):
         return result
 
     def do_import(self, paths, library, reference, options):
+        if options.get("workers"):
+            return self.do_batch_import(paths, library, reference, options)
         message = "{i}/{total} Importing {path}..."
         if options["async_"]:
             message = "{i}/{total} Launching import for {path}..."
@@ -286,6 +430,7 @@ class Command(BaseCommand):
                     options["in_place"],
                     options["outbox"],
                     options["broadcast"],
+                    checksum=options["checksum"],
                 )
             except Exception as e:
                 if options["exit_on_failure"]:
@@ -297,18 +442,94 @@ class Command(BaseCommand):
                 errors.append((path, "{} {}".format(e.__class__.__name__, e)))
         return errors
 
-    def create_upload(
-        self,
-        path,
-        reference,
-        library,
-        async_,
-        replace,
-        in_place,
-        dispatch_outbox,
-        broadcast,
+    def do_batch_import(self, paths, library, reference, options):
+        errors = []
+        report = ThroughputReport(self.stdout, total=len(paths))
+        # database connections must not be shared with the worker processes
+        db.connections.close_all()
+        with concurrent.futures.ProcessPoolExecutor(options["workers"]) as pool:
+            probes = pool.map(probe_file, paths, chunksize=16)
+            for batch in common_utils.batch(probes, options["batch_size"]):
+                uploads = []
+                for data in batch:
+                    error = data.get("error")
+                    if not error:
+                        try:
+                            uploads.append(
+                                self.build_upload(data, reference, library, options)
+                            )
+                        except Exception as e:
+                            error = "{} {}".format(e.__class__.__name__, e)
+                    if error:
+                        if options["exit_on_failure"]:
+                            raise CommandError(
+                                "Error while importing {}: {}".format(
+                                    data["path"], error
+                                )
+                            )
+                        self.stderr.write(
+                            "Error while importing {}: {}".format(data["path"], error)
+                        )
+                        errors.append((data["path"], error))
+                        report.add(errors=1)
+
+                uploads = models.Upload.objects.bulk_create(uploads)
+                models.record_bulk_import_status_change(uploads, created=True)
+                if options["in_place"]:
+                    rescan.index_uploads(uploads, checksum=options["checksum"])
+                import_errors = self.dispatch_imports(uploads, options)
+                errors += import_errors
+                report.add(
+                    files=len(uploads) - len(import_errors),
+                    size=sum([u.size or 0 for u in uploads]),
+                    errors=len(import_errors),
+                )
+                report.write()
+        return errors
+
+    def build_upload(self, data, reference, library, options):
+        upload = self.get_upload(
+            data["path"],
+            reference,
+            library,
+            options["replace"],
+            options["in_place"],
+            options["outbox"],
+            options["broadcast"],
+        )
+        upload.size = data["size"]
+        upload.duration = data.get("duration")
+        upload.bitrate = data.get("bitrate")
+        upload.mimetype = data.get("mimetype")
+        upload.set_default_values()
+        return upload
+
+    def dispatch_imports(self, uploads, options):
+        errors = []
+        if options["async_"]:
+            if uploads:
+                tasks.process_uploads_batch.delay(upload_ids=[u.pk for u in uploads])
+            return errors
+
+        for upload in uploads:
+            path = upload.source.replace("file://", "", 1)
+            try:
+                tasks.process_upload(upload_id=upload.pk)
+                upload.refresh_from_db(fields=["import_status", "import_details"])
+                if upload.import_status == "errored":
+                    # e.g. invalid or missing tags
+                    raise CommandError(upload.import_details.get("error_code"))
+            except Exception as e:
+                if options["exit_on_failure"]:
+                    raise
+                error = "{} {}".format(e.__class__.__name__, e)
+                self.stderr.write("Error while importing {}: {}".format(path, error))
+                errors.append((path, error))
+        return errors
+
+    def get_upload(
+        self, path, reference, library, replace, in_place, dispatch_outbox, broadcast
     ):
-        import_handler = tasks.process_upload.delay if async_ else tasks.process_upload
         upload = models.Upload(library=library, import_reference=reference)
         upload.source = "file://" + path
         upload.import_metadata = {
@@ -323,8 +544,27 @@ class Command(BaseCommand):
         if not in_place:
             name = os.path.basename(path)
             with open(path, "rb") as f:
-                upload.audio_file.save(name, File(f), save=False)
+                upload.store_audio_file(name, File(f))
+        return upload
 
+    def create_upload(
+        self,
+        path,
+        reference,
+        library,
+        async_,
+        replace,
+        in_place,
+        dispatch_outbox,
+        broadcast,
+        checksum=False,
+    ):
+        import_handler = tasks.process_upload.delay if async_ else tasks.process_upload
+        upload = self.get_upload(
+            path, reference, library, replace, in_place, dispatch_outbox, broadcast
+        )
         upload.save()
+        if in_place:
+            rescan.index_uploads([upload], checksum=checksum)
 
         import_handler(upload_id=upload.pk)
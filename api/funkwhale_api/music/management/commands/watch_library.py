@@ -0,0 +1,315 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.utils import timezone
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from watchdog.observers.polling import PollingObserver
+
+from funkwhale_api.common import utils as common_utils
+from funkwhale_api.music import rescan, utils
+
+from . import import_files
+
+logger = logging.getLogger(__name__)
+
+
+class ChangesCollector(FileSystemEventHandler):
+    """
+    Collect filesystem events, and only release changed paths once their
+    directory has been quiet for a while, to avoid importing files that
+    are still being copied.
+    """
+
+    def __init__(self, extensions=None):
+        self.extensions = extensions or [
+            ext for ext, _ in utils.AUDIO_EXTENSIONS_AND_MIMETYPE
+        ]
+        self.lock = threading.Lock()
+        self.changed = set()
+        self.deleted = set()
+        self.moved = {}
+        self.directories = {}
+
+    def is_audio_file(self, path):
+        return os.path.splitext(path)[1][1:].lower() in self.extensions
+
+    def touch(self, path):
+        self.directories[os.path.dirname(path)] = time.monotonic()
+
+    def on_created(self, event):
+        self.on_modified(event)
+
+    def on_modified(self, event):
+        if event.is_directory or not self.is_audio_file(event.src_path):
+            return
+        with self.lock:
+            self.deleted.discard(event.src_path)
+            self.changed.add(event.src_path)
+            self.touch(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory or not self.is_audio_file(event.src_path):
+            return
+        with self.lock:
+            self.changed.discard(event.src_path)
+            self.deleted.add(event.src_path)
+            self.touch(event.src_path)
+
+    def on_moved(self, event):
+        with self.lock:
+            if event.is_directory:
+                self.move_directory(event.src_path, event.dest_path)
+            elif self.is_audio_file(event.src_path):
+                self.changed.discard(event.src_path)
+                self.moved[event.src_path] = event.dest_path
+                self.touch(event.src_path)
+            elif self.is_audio_file(event.dest_path):
+                # e.g. a temporary file renamed at the end of a copy
+                self.changed.add(event.dest_path)
+            self.touch(event.dest_path)
+
+    def move_directory(self, src, dest):
+        """
+        Record the move of a whole directory, and update the pending changes
+        of the files it contains to their new location.
+        """
+        prefix = src.rstrip(os.sep) + os.sep
+
+        def remap(path):
+            if path == src:
+                return dest
+            if path.startswith(prefix):
+                return os.path.join(dest, path[len(prefix) :])
+            return path
+
+        self.changed = set([remap(p) for p in self.changed])
+        self.moved = {s: remap(d) for s, d in self.moved.items()}
+        self.directories = {remap(d): last for d, last in self.directories.items()}
+        self.moved[src] = dest
+        self.touch(src)
+        self.touch(dest)
+
+    def pop_ready(self, debounce):
+        """
+        Return the changes in directories that did not receive any event during
+        the last debounce seconds, as a (changed, moved, deleted) tuple.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for d, last in list(self.directories.items()):
+                if now - last >= debounce:
+                    del self.directories[d]
+
+            def is_ready(path):
+                # a move is only ready once both its directories are quiet,
+                # which may happen in different calls
+                return os.path.dirname(path) not in self.directories
+
+            changed = sorted([p for p in self.changed if is_ready(p)])
+            deleted = sorted([p for p in self.deleted if is_ready(p)])
+            moved = {
+                src: dest
+                for src, dest in self.moved.items()
+                if is_ready(src) and is_ready(dest)
+            }
+            self.changed -= set(changed)
+            self.deleted -= set(deleted)
+            for src in moved:
+                del self.moved[src]
+        return changed, moved, deleted
+
+
+class Command(import_files.Command):
+    help = (
+        "Watch directories and continuously import new or modified audio files "
+        "into a library"
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--debounce",
+            action="store",
+            dest="debounce",
+            type=float,
+            default=10,
+            help=(
+                "How many seconds to wait after the last change in a directory "
+                "before importing its files"
+            ),
+        )
+        parser.add_argument(
+            "--polling",
+            action="store_true",
+            dest="polling",
+            default=False,
+            help=(
+                "Check the directories for changes at regular intervals, instead "
+                "of relying on inotify. Use this for network filesystems."
+            ),
+        )
+        parser.add_argument(
+            "--polling-interval",
+            action="store",
+            dest="polling_interval",
+            type=float,
+            default=60,
+            help="When using --polling, interval between checks, in seconds",
+        )
+
+    def handle(self, *args, **options):
+        library = self.get_library(options["library_id"])
+        music_path = settings.MUSIC_DIRECTORY_PATH
+        for path in options["path"]:
+            if not os.path.isdir(path):
+                raise CommandError("{} is not a directory".format(path))
+            if options["in_place"] and (
+                not music_path or not path.startswith(music_path)
+            ):
+                raise CommandError(
+                    "Importing in-place only works if importing "
+                    "from {} (MUSIC_DIRECTORY_PATH)".format(
+                        settings.MUSIC_DIRECTORY_PATH
+                    )
+                )
+        options["interactive"] = False
+
+        collector = ChangesCollector()
+        if options["polling"]:
+            observer = PollingObserver(timeout=options["polling_interval"])
+        else:
+            observer = Observer()
+        for path in options["path"]:
+            observer.schedule(collector, path, recursive=options["recursive"])
+        observer.start()
+        self.stdout.write(
+            "Watching {} for changes, press Ctrl+C to stop".format(
+                ", ".join(options["path"])
+            )
+        )
+        try:
+            while True:
+                time.sleep(1)
+                changed, moved, deleted = collector.pop_ready(options["debounce"])
+                if not (changed or moved or deleted):
+                    continue
+                try:
+                    self.handle_changes(library, changed, moved, deleted, options)
+                except Exception:
+                    # e.g. a file deleted before we could process it, the
+                    # watcher must keep running
+                    logger.exception("Error while handling changes")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            observer.stop()
+            observer.join()
+
+    def handle_changes(self, library, changed, moved, deleted, options):
+        moved = self.expand_moves(library, moved)
+        if options["in_place"]:
+            changed += self.handle_moves(library, moved)
+            self.handle_deletions(library, deleted)
+        else:
+            # copied files are not affected by moves on disk, but the destination
+            # may be a new file to import
+            changed += list(moved.values())
+
+        changed = [p for p in sorted(set(changed)) if os.path.isfile(p)]
+        for batch in common_utils.batch(changed, options["batch_size"]):
+            self.import_batch(library, batch, options)
+
+    def expand_moves(self, library, moved):
+        """
+        Replace the moves of directories by the moves of the files they contain,
+        indexed or not.
+        """
+        files = {}
+        for src, dest in moved.items():
+            if not os.path.isdir(dest):
+                files[src] = dest
+                continue
+            prefix = src.rstrip(os.sep) + os.sep
+            indexed = library.indexed_files.filter(path__startswith=prefix)
+            for path in indexed.values_list("path", flat=True):
+                files[path] = os.path.join(dest, path[len(prefix) :])
+            # files that were not indexed are imported as new files
+            for root, _, names in os.walk(dest):
+                for name in names:
+                    extension = os.path.splitext(name)[1].lower()
+                    if not utils.get_type_from_ext(extension):
+                        continue
+                    path = os.path.join(root, name)
+                    src_path = os.path.join(src, os.path.relpath(path, dest))
+                    files.setdefault(src_path, path)
+        return files
+
+    def handle_moves(self, library, moved):
+        """
+        Re-point the uploads of moved files, and return the destination
+        paths that are unknown and should be imported.
+        """
+        entries = library.indexed_files.filter(path__in=list(moved.keys()))
+        known = []
+        for entry in entries:
+            path = moved[entry.path]
+            try:
+                fingerprint = rescan.get_fingerprint(path)
+            except FileNotFoundError:
+                continue
+            known.append((entry, path, fingerprint))
+        rescan.apply_moves(known)
+        if known:
+            self.stdout.write("{} moved files updated".format(len(known)))
+        known_paths = set([path for _, path, _ in known])
+        return [p for p in moved.values() if p not in known_paths]
+
+    def handle_deletions(self, library, deleted):
+        entries = [
+            entry
+            for entry in library.indexed_files.filter(path__in=deleted)
+            if not os.path.exists(entry.path)
+        ]
+        rescan.apply_deletions(entries)
+        if entries:
+            self.stdout.write("{} deleted files removed".format(len(entries)))
+
+    def import_batch(self, library, paths, options):
+        errors = []
+        modified = []
+        if options["in_place"]:
+            for entry in library.indexed_files.filter(path__in=paths):
+                fingerprint = rescan.get_fingerprint(entry.path)
+                if rescan.is_modified(entry, fingerprint):
+                    modified.append((entry, fingerprint))
+            errors += self.dispatch_imports(rescan.reset_modified(modified), options)
+
+        sources = ["file://{}".format(p) for p in paths]
+        existing = set(
+            [
+                s.replace("file://", "", 1)
+                for s in library.uploads.filter(source__in=sources).values_list(
+                    "source", flat=True
+                )
+            ]
+        )
+        new = [p for p in paths if p not in existing]
+        if new:
+            reference = options["reference"] or "cli-watch-{}".format(
+                timezone.now().isoformat()
+            )
+            errors += self.do_import(
+                new, library=library, reference=reference, options=options
+            )
+        self.stdout.write(
+            "{} new files imported, {} modified files imported again".format(
+                len(new), len(modified)
+            )
+        )
+        for path, error in errors:
+            self.stderr.write("- {}: {}".format(path, error))
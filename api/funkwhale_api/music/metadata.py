@@ -1,4 +1,6 @@
 import datetime
+import os
+
 import mutagen
 import pendulum
 from django import forms
@@ -301,3 +303,55 @@ class Metadata(object):
         for p in pictures:
             if p["type"] == ptype:
                 return p
+
+
+MIMETYPES = {
+    # Opus files are stored as audio/ogg, the container type the player
+    # and the transcoding logic know about
+    "OggOpus": "audio/ogg",
+    "OggVorbis": "audio/ogg",
+    "OggTheora": "audio/ogg",
+    "MP3": "audio/mpeg",
+    "FLAC": "audio/x-flac",
+}
+
+
+def get_size(f):
+    if isinstance(f, str):
+        return os.path.getsize(f)
+    try:
+        # django files
+        return f.size
+    except AttributeError:
+        position = f.tell()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(position)
+        return size
+
+
+class AudioProbe(Metadata):
+    """
+    Parse an audio file once, and expose its tags and pictures, as well as
+    its mimetype, duration, bitrate and size, so the file does not need to be
+    opened and parsed again for each information.
+    """
+
+    def __init__(self, f, size=None):
+        super().__init__(f)
+        self.size = size if size is not None else get_size(f)
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.get_file_type(self._file)]
+
+    @property
+    def duration(self):
+        return int(self._file.info.length)
+
+    @property
+    def bitrate(self):
+        return getattr(self._file.info, "bitrate", 0)
+
+    def get_audio_data(self):
+        return {"duration": self.duration, "bitrate": self.bitrate, "size": self.size}
@@ -0,0 +1,54 @@
+# Generated by Django 2.0.8 on 2018-10-02 13:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import funkwhale_api.music.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0032_track_file_to_upload")]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadVersion",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("mimetype", models.CharField(max_length=50)),
+                ("bitrate", models.PositiveIntegerField()),
+                ("size", models.IntegerField(default=0)),
+                (
+                    "audio_file",
+                    models.FileField(
+                        max_length=255,
+                        upload_to=funkwhale_api.music.models.get_version_file_path,
+                    ),
+                ),
+                (
+                    "creation_date",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("accessed_date", models.DateTimeField(blank=True, null=True)),
+                (
+                    "upload",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="versions",
+                        to="music.Upload",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="uploadversion", unique_together={("upload", "mimetype", "bitrate")}
+        ),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 2.0.8 on 2018-10-05 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_availabilities(apps, schema_editor):
+    Upload = apps.get_model("music", "Upload")
+    TrackAvailability = apps.get_model("music", "TrackAvailability")
+    rows = (
+        Upload.objects.filter(import_status="finished", track__isnull=False)
+        .values("track_id", "library_id", "library__privacy_level")
+        .annotate(actor_id=models.F("library__actor_id"))
+        .distinct()
+        .order_by()
+    )
+    TrackAvailability.objects.bulk_create(
+        [
+            TrackAvailability(
+                track_id=row["track_id"],
+                library_id=row["library_id"],
+                privacy_level=row["library__privacy_level"],
+                actor_id=row["actor_id"],
+            )
+            for row in rows.iterator()
+            if row["library_id"]
+        ],
+        batch_size=1000,
+    )
+
+
+def rewind(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("federation", "0012_auto_20180920_1803"),
+        ("music", "0033_uploadversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrackAvailability",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "privacy_level",
+                    models.CharField(
+                        choices=[
+                            ("me", "Only me"),
+                            ("instance", "Everyone on my instance, and my followers"),
+                            ("everyone", "Everyone, including people on other instances"),
+                        ],
+                        db_index=True,
+                        max_length=25,
+                    ),
+                ),
+                (
+                    "actor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="track_availabilities",
+                        to="federation.Actor",
+                    ),
+                ),
+                (
+                    "library",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="track_availabilities",
+                        to="music.Library",
+                    ),
+                ),
+                (
+                    "track",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="availabilities",
+                        to="music.Track",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="trackavailability", unique_together={("track", "library")}
+        ),
+        migrations.AlterIndexTogether(
+            name="trackavailability", index_together={("library", "track")}
+        ),
+        migrations.RunPython(populate_availabilities, rewind),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.0.8 on 2018-10-06 14:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0034_trackavailability")]
+
+    operations = [
+        migrations.CreateModel(
+            name="IndexedFile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(db_index=True, max_length=500)),
+                ("size", models.BigIntegerField()),
+                ("mtime", models.FloatField()),
+                ("inode", models.BigIntegerField(db_index=True)),
+                (
+                    "checksum",
+                    models.CharField(
+                        blank=True, db_index=True, max_length=64, null=True
+                    ),
+                ),
+                (
+                    "modification_date",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "library",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="indexed_files",
+                        to="music.Library",
+                    ),
+                ),
+                (
+                    "upload",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="indexed_file",
+                        to="music.Upload",
+                    ),
+                ),
+            ],
+        )
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2018-10-07 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0035_indexedfile")]
+
+    operations = [
+        migrations.AddField(
+            model_name="upload",
+            name="checksum",
+            field=models.CharField(
+                blank=True, db_index=True, max_length=100, null=True
+            ),
+        )
+    ]
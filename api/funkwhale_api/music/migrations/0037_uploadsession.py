@@ -0,0 +1,70 @@
+# Generated by Django 2.0.8 on 2018-10-07 16:45
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import funkwhale_api.music.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0036_upload_checksum")]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadSession",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "uuid",
+                    models.UUIDField(db_index=True, default=uuid.uuid4, unique=True),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                ("size", models.BigIntegerField()),
+                ("received", models.BigIntegerField(default=0)),
+                ("source", models.CharField(blank=True, max_length=500, null=True)),
+                (
+                    "import_reference",
+                    models.CharField(
+                        default=funkwhale_api.music.models.get_import_reference,
+                        max_length=50,
+                    ),
+                ),
+                (
+                    "import_metadata",
+                    django.contrib.postgres.fields.jsonb.JSONField(
+                        default=funkwhale_api.music.models.empty_dict,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        max_length=50000,
+                    ),
+                ),
+                (
+                    "creation_date",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "modification_date",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "library",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_sessions",
+                        to="music.Library",
+                    ),
+                ),
+            ],
+        )
+    ]
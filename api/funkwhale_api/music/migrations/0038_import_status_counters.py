@@ -0,0 +1,100 @@
+# Generated by Django 2.0.8 on 2018-10-08 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+STATUSES = ["pending", "finished", "errored", "skipped"]
+
+
+def get_counts(queryset, group_by, field):
+    annotations = {
+        "{}_count".format(status): models.Count(
+            "id", filter=models.Q(**{field: status})
+        )
+        for status in STATUSES
+    }
+    return queryset.values(*group_by).order_by().annotate(**annotations)
+
+
+def populate_counters(apps, schema_editor):
+    ImportBatch = apps.get_model("music", "ImportBatch")
+    ImportJob = apps.get_model("music", "ImportJob")
+    Upload = apps.get_model("music", "Upload")
+    UploadImportSummary = apps.get_model("music", "UploadImportSummary")
+
+    for row in get_counts(ImportJob.objects.all(), ["batch_id"], "status"):
+        batch_id = row.pop("batch_id")
+        ImportBatch.objects.filter(pk=batch_id).update(**row)
+
+    uploads = Upload.objects.exclude(library=None)
+    summaries = [
+        UploadImportSummary(**row)
+        for row in get_counts(
+            uploads, ["library_id", "import_reference"], "import_status"
+        )
+    ]
+    UploadImportSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+def rewind(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0037_uploadsession")]
+
+    operations = [
+        migrations.AddField(
+            model_name="importbatch",
+            name="errored_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importbatch",
+            name="finished_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importbatch",
+            name="pending_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importbatch",
+            name="skipped_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="UploadImportSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("import_reference", models.CharField(max_length=50)),
+                ("pending_count", models.IntegerField(default=0)),
+                ("finished_count", models.IntegerField(default=0)),
+                ("errored_count", models.IntegerField(default=0)),
+                ("skipped_count", models.IntegerField(default=0)),
+                (
+                    "library",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_summaries",
+                        to="music.Library",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="uploadimportsummary",
+            unique_together={("library", "import_reference")},
+        ),
+        migrations.RunPython(populate_counters, rewind),
+    ]
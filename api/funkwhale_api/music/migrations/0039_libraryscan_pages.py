@@ -0,0 +1,21 @@
+# Generated by Django 2.0.8 on 2018-10-08 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0038_import_status_counters")]
+
+    operations = [
+        migrations.AddField(
+            model_name="libraryscan",
+            name="processed_pages",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="libraryscan",
+            name="total_pages",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
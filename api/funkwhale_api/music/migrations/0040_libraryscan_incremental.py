@@ -0,0 +1,39 @@
+# Generated by Django 2.0.8 on 2018-10-08 11:37
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0039_libraryscan_pages")]
+
+    operations = [
+        migrations.AddField(
+            model_name="libraryscan",
+            name="last_creation_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="libraryscan",
+            name="last_fid",
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name="libraryscan",
+            name="page_etags",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True, default=dict
+            ),
+        ),
+        migrations.AddField(
+            model_name="libraryscan",
+            name="since",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="libraryscan",
+            name="since_fid",
+            field=models.URLField(blank=True, max_length=500, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.0.8 on 2018-10-09 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("music", "0040_libraryscan_incremental")]
+
+    operations = [
+        migrations.AddField(
+            model_name="uploadsession",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("receiving", "Receiving"),
+                    ("finalizing", "Finalizing"),
+                    ("finished", "Finished"),
+                    ("errored", "Errored"),
+                ],
+                default="receiving",
+                max_length=25,
+            ),
+        ),
+        migrations.AddField(
+            model_name="uploadsession",
+            name="upload",
+            field=models.OneToOneField(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="upload_session",
+                to="music.Upload",
+            ),
+        ),
+    ]
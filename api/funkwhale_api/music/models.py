@@ -1,4 +1,6 @@
+import collections
 import datetime
+import hashlib
 import logging
 import mimetypes
 import os
@@ -9,9 +11,11 @@ import markdown
 import pendulum
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
+from django.core.cache import cache
+from django.core.files import File
 from django.core.files.base import ContentFile
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.urls import reverse
@@ -19,7 +23,6 @@ from django.utils import timezone
 from taggit.managers import TaggableManager
 
 from versatileimagefield.fields import VersatileImageField
-from versatileimagefield.image_warmer import VersatileImageFieldWarmer
 
 from funkwhale_api import musicbrainz
 from funkwhale_api.common import fields
@@ -387,21 +390,17 @@ class TrackQuerySet(models.QuerySet):
         return self.select_related().select_related("album__artist", "artist")
 
     def annotate_playable_by_actor(self, actor):
-        files = (
-            Upload.objects.playable_by(actor)
-            .filter(track=models.OuterRef("id"))
-            .order_by("id")
-            .values("id")[:1]
+        availabilities = TrackAvailability.objects.playable_by(actor).filter(
+            track=models.OuterRef("id")
         )
-        subquery = models.Subquery(files)
-        return self.annotate(is_playable_by_actor=subquery)
+        return self.annotate(is_playable_by_actor=models.Exists(availabilities))
 
     def playable_by(self, actor, include=True):
-        files = Upload.objects.playable_by(actor, include)
+        tracks = TrackAvailability.objects.playable_by(actor).values("track")
         if include:
-            return self.filter(uploads__in=files)
+            return self.filter(pk__in=tracks)
         else:
-            return self.exclude(uploads__in=files)
+            return self.exclude(pk__in=tracks)
 
     def annotate_duration(self):
         first_upload = Upload.objects.filter(track=models.OuterRef("pk")).order_by("pk")
@@ -554,11 +553,11 @@ class Track(APIModelMixin):
 
 class UploadQuerySet(models.QuerySet):
     def playable_by(self, actor, include=True):
-        libraries = Library.objects.viewable_by(actor)
+        libraries = Library.objects.viewable_ids(actor)
 
         if include:
-            return self.filter(library__in=libraries, import_status="finished")
-        return self.exclude(library__in=libraries, import_status="finished")
+            return self.filter(library_id__in=libraries, import_status="finished")
+        return self.exclude(library_id__in=libraries, import_status="finished")
 
     def local(self, include=True):
         return self.exclude(library__actor__user__isnull=include)
@@ -608,6 +607,8 @@ class Upload(models.Model):
     bitrate = models.IntegerField(null=True, blank=True)
     acoustid_track_id = models.UUIDField(null=True, blank=True)
     mimetype = models.CharField(null=True, blank=True, max_length=200)
+    # sha256 of the audio file, used to store identical files only once
+    checksum = models.CharField(max_length=100, null=True, blank=True, db_index=True)
     library = models.ForeignKey(
         "library",
         null=True,
@@ -643,7 +644,11 @@ class Upload(models.Model):
 
     objects = UploadQuerySet.as_manager()
 
-    def download_audio_from_remote(self, user):
+    def get_remote_audio_response(self, user):
+        """
+        Open a streamed request to the remote audio file, signed
+        with the user's actor key if possible.
+        """
         from funkwhale_api.common import session
         from funkwhale_api.federation import signing
 
@@ -652,7 +657,7 @@ class Upload(models.Model):
         else:
             auth = None
 
-        remote_response = session.get_session().get(
+        return session.get_session().get(
             self.source,
             auth=auth,
             stream=True,
@@ -660,17 +665,22 @@ class Upload(models.Model):
             headers={"Content-Type": "application/octet-stream"},
             verify=settings.EXTERNAL_REQUESTS_VERIFY_SSL,
         )
+
+    def get_remote_audio_filename(self):
+        extension = utils.get_ext_from_type(self.mimetype)
+        title = " - ".join(
+            [self.track.title, self.track.album.title, self.track.artist.name]
+        )
+        return "{}.{}".format(title, extension)
+
+    def download_audio_from_remote(self, user):
+        remote_response = self.get_remote_audio_response(user)
         with remote_response as r:
             remote_response.raise_for_status()
-            extension = utils.get_ext_from_type(self.mimetype)
-            title = " - ".join(
-                [self.track.title, self.track.album.title, self.track.artist.name]
-            )
-            filename = "{}.{}".format(title, extension)
             tmp_file = tempfile.TemporaryFile()
-            for chunk in r.iter_content(chunk_size=512):
+            for chunk in r.iter_content(chunk_size=64 * 1024):
                 tmp_file.write(chunk)
-            self.audio_file.save(filename, tmp_file, save=False)
+            self.audio_file.save(self.get_remote_audio_filename(), tmp_file, save=False)
             self.save(update_fields=["audio_file"])
 
     def get_federation_id(self):
@@ -704,29 +714,111 @@ class Upload(models.Model):
         if self.source.startswith("file://"):
             return open(self.source.replace("file://", "", 1), "rb")
 
-    def get_audio_data(self):
+    def get_audio_file_path(self):
+        if self.audio_file:
+            return self.audio_file.path
+        if self.source.startswith("file://"):
+            return self.source.replace("file://", "", 1)
+
+    def get_probe(self):
+        """
+        Open and parse the audio file, and return a probe giving access to
+        its tags and audio properties. Raise a ValueError if the file is not
+        a supported audio file.
+        """
         audio_file = self.get_audio_file()
         if not audio_file:
             return
-        audio_data = utils.get_audio_file_data(audio_file)
-        if not audio_data:
+        return metadata.AudioProbe(audio_file, size=self.get_file_size())
+
+    def get_audio_data(self, probe=None):
+        try:
+            probe = probe or self.get_probe()
+        except ValueError:
+            return
+        if not probe:
             return
-        return {
-            "duration": int(audio_data["length"]),
-            "bitrate": audio_data["bitrate"],
-            "size": self.get_file_size(),
-        }
+        return probe.get_audio_data()
 
-    def save(self, **kwargs):
+    def update_audio_data(self):
+        data = self.get_audio_data()
+        if not data:
+            return
+        self.duration = data["duration"]
+        self.size = data["size"]
+        self.bitrate = data["bitrate"]
+        self.save(update_fields=["bitrate", "duration", "size"])
+
+    def set_probed_values(self):
+        """
+        Set the mimetype and missing audio properties of the upload
+        by parsing its audio file.
+        """
+        try:
+            probe = self.get_probe()
+        except ValueError:
+            # not a supported audio file, we rely on libmagic
+            self.mimetype = utils.guess_mimetype(self.audio_file)
+            return
+        self.mimetype = probe.mimetype
+        self.size = self.size or probe.size
+        self.duration = self.duration or probe.duration
+        self.bitrate = self.bitrate or probe.bitrate
+
+    def set_default_values(self):
+        """
+        Populate computed fields, this is called on save, and must be called
+        manually when creating uploads in bulk.
+        """
         if not self.mimetype:
             if self.audio_file:
-                self.mimetype = utils.guess_mimetype(self.audio_file)
+                self.set_probed_values()
             elif self.source and self.source.startswith("file://"):
                 self.mimetype = mimetypes.guess_type(self.source)[0]
         if not self.size and self.audio_file:
             self.size = self.audio_file.size
         if not self.pk and not self.fid and self.library.actor.get_user():
             self.fid = self.get_federation_id()
+
+    def get_identical_audio_file(self):
+        """
+        Return the name of a stored audio file with the same checksum as
+        this upload, if any. Only files of local uploads are reused, since
+        files in the federation cache can be deleted at any time.
+        """
+        if not self.checksum:
+            return
+        candidates = (
+            Upload.objects.filter(
+                checksum=self.checksum, audio_file__startswith="tracks/"
+            )
+            .exclude(pk=self.pk)
+            .values_list("audio_file", flat=True)
+        )
+        for name in candidates[:3]:
+            if self.audio_file.storage.exists(name):
+                return name
+
+    def store_audio_file(self, name, content):
+        """
+        Use the given content as the audio file of this upload. If the same
+        content was already stored for another local upload, the existing file
+        is referenced instead of writing a second copy.
+        """
+        self.checksum = utils.get_file_checksum(content)
+        if self.library.actor.get_user():
+            existing = self.get_identical_audio_file()
+            if existing:
+                self.audio_file = existing
+                return
+        self.audio_file.save(name, content, save=False)
+
+    def save(self, **kwargs):
+        # probing is cheaper before the file is written to the storage
+        self.set_default_values()
+        if self.audio_file and not self.audio_file._committed:
+            # e.g. a file sent through the API, not written to the storage yet
+            self.store_audio_file(self.audio_file.name, self.audio_file.file)
         return super().save(**kwargs)
 
     def get_metadata(self):
@@ -739,6 +831,225 @@ class Upload(models.Model):
     def listen_url(self):
         return self.track.listen_url + "?upload={}".format(self.uuid)
 
+    def get_transcoded_version(self, format, max_bitrate=None):
+        """
+        Return the version of this upload matching the given format and
+        bitrate, transcoding it if it does not exist yet.
+        """
+        mimetype = utils.TRANSCODING_FORMATS[format]["mimetype"]
+        bitrate = utils.get_transcoding_bitrate(max_bitrate, self.bitrate)
+        existing = self.versions.filter(mimetype=mimetype, bitrate=bitrate).first()
+        if existing:
+            return existing
+
+        return self.create_transcoded_version(format, bitrate)
+
+    def create_transcoded_version(self, format, bitrate):
+        path = self.get_audio_file_path()
+        if not path:
+            raise ValueError("Cannot transcode an upload without audio file")
+        mimetype = utils.TRANSCODING_FORMATS[format]["mimetype"]
+        with utils.transcode_file(path, format, bitrate) as f:
+            version = self.versions.model(
+                upload=self, mimetype=mimetype, bitrate=bitrate
+            )
+            version.audio_file.save(
+                "{}.{}".format(self.uuid, format), File(f), save=False
+            )
+            version.size = version.audio_file.size
+            version.save()
+        return version
+
+
+class IndexedFile(models.Model):
+    """
+    Last known state of the file of an in-place upload, used to detect
+    changes on disk without reading the files again.
+    """
+
+    upload = models.OneToOneField(
+        Upload, related_name="indexed_file", on_delete=models.CASCADE
+    )
+    library = models.ForeignKey(
+        "library", related_name="indexed_files", on_delete=models.CASCADE
+    )
+    path = models.CharField(max_length=500, db_index=True)
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    inode = models.BigIntegerField(db_index=True)
+    checksum = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    modification_date = models.DateTimeField(default=timezone.now)
+
+
+UPLOAD_SESSION_STATUS_CHOICES = (
+    ("receiving", "Receiving"),
+    ("finalizing", "Finalizing"),
+    ("finished", "Finished"),
+    ("errored", "Errored"),
+)
+
+
+class UploadSession(models.Model):
+    """
+    An audio file being uploaded in several chunks through the API. Chunks
+    are written to the storage as they are received, and assembled in an
+    Upload by a background task once the whole file was sent.
+    """
+
+    uuid = models.UUIDField(unique=True, db_index=True, default=uuid.uuid4)
+    library = models.ForeignKey(
+        "library", related_name="upload_sessions", on_delete=models.CASCADE
+    )
+    filename = models.CharField(max_length=255)
+    # declared size of the file, in bytes
+    size = models.BigIntegerField()
+    # number of contiguous bytes received so far
+    received = models.BigIntegerField(default=0)
+    source = models.CharField(null=True, blank=True, max_length=500)
+    import_reference = models.CharField(max_length=50, default=get_import_reference)
+    import_metadata = JSONField(
+        default=empty_dict, max_length=50000, encoder=DjangoJSONEncoder
+    )
+    status = models.CharField(
+        default="receiving", choices=UPLOAD_SESSION_STATUS_CHOICES, max_length=25
+    )
+    # the resulting upload, once the session is finished
+    upload = models.OneToOneField(
+        Upload,
+        related_name="upload_session",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+    )
+    creation_date = models.DateTimeField(default=timezone.now)
+    modification_date = models.DateTimeField(default=timezone.now)
+
+    @property
+    def storage(self):
+        return Upload._meta.get_field("audio_file").storage
+
+    def get_chunks_path(self):
+        return "upload_sessions/{}".format(self.uuid)
+
+    def get_chunk_names(self):
+        try:
+            _, files = self.storage.listdir(self.get_chunks_path())
+        except FileNotFoundError:
+            return []
+        # chunks are named after their zero-padded offset
+        return [os.path.join(self.get_chunks_path(), f) for f in sorted(files)]
+
+    def add_chunk(self, content):
+        name = os.path.join(self.get_chunks_path(), "{:015d}".format(self.received))
+        self.storage.save(name, content)
+        self.received += content.size
+        self.modification_date = timezone.now()
+        self.save(update_fields=["received", "modification_date"])
+
+    def delete_chunks(self):
+        for name in self.get_chunk_names():
+            self.storage.delete(name)
+
+    def copy_chunks(self, f, sha):
+        for chunk_name in self.get_chunk_names():
+            with self.storage.open(chunk_name, "rb") as chunk:
+                for block in chunk.chunks():
+                    sha.update(block)
+                    f.write(block)
+
+    def assemble_chunks(self, name):
+        """
+        Write the chunks, in order, to the file with the given name in the
+        storage, and return the final name of the file and its sha256 checksum.
+
+        On a filesystem storage, chunks are appended directly to the final
+        file. Other storages cannot append to files, so chunks are assembled
+        in a temporary file first, which is then saved in the storage.
+        """
+        sha = hashlib.sha256()
+        try:
+            path = self.storage.path(name)
+        except NotImplementedError:
+            with tempfile.NamedTemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as f:
+                self.copy_chunks(f, sha)
+                f.seek(0)
+                name = self.storage.save(name, File(f))
+            return name, sha.hexdigest()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # the name is reserved by creating the file, which is then appended to
+        with open(path, "xb") as f:
+            self.copy_chunks(f, sha)
+        if self.storage.file_permissions_mode is not None:
+            os.chmod(path, self.storage.file_permissions_mode)
+        return name, sha.hexdigest()
+
+    def create_upload(self):
+        """
+        Assemble the chunks directly in the audio file of a new upload, and
+        mark the session as finished. The file is written in blocks, to
+        avoid loading it in memory, and is checksummed along the way.
+        """
+        upload = Upload(
+            library=self.library,
+            source=self.source or "upload://{}".format(self.filename),
+            import_reference=self.import_reference,
+            import_metadata=self.import_metadata,
+        )
+        field = upload.audio_file.field
+        name = self.storage.get_available_name(
+            field.generate_filename(upload, self.filename), max_length=field.max_length
+        )
+        try:
+            name, upload.checksum = self.assemble_chunks(name)
+        except Exception:
+            self.storage.delete(name)
+            raise
+        existing = upload.get_identical_audio_file()
+        if existing:
+            # the same content was already uploaded, we only reference it
+            self.storage.delete(name)
+            name = existing
+        upload.audio_file = name
+        upload.save()
+        self.upload = upload
+        self.status = "finished"
+        self.modification_date = timezone.now()
+        self.save(update_fields=["upload", "status", "modification_date"])
+        self.delete_chunks()
+        return upload
+
+
+def get_version_file_path(instance, filename):
+    return common_utils.ChunkedPath("transcoded")(instance, filename)
+
+
+class UploadVersion(models.Model):
+    """
+    A transcoded rendition of an upload, stored alongside the original file
+    so we don't have to transcode it again on subsequent listenings.
+    """
+
+    upload = models.ForeignKey(
+        Upload, related_name="versions", on_delete=models.CASCADE
+    )
+    mimetype = models.CharField(max_length=50)
+    bitrate = models.PositiveIntegerField()
+    size = models.IntegerField(default=0)
+    audio_file = models.FileField(upload_to=get_version_file_path, max_length=255)
+    creation_date = models.DateTimeField(default=timezone.now)
+    accessed_date = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ("upload", "mimetype", "bitrate")
+
+    @property
+    def filename(self):
+        return "{}.{}".format(
+            self.upload.track.full_name,
+            utils.TRANSCODING_MIMETYPE_TO_EXTENSION[self.mimetype],
+        )
+
 
 IMPORT_STATUS_CHOICES = (
     ("pending", "Pending"),
@@ -747,6 +1058,29 @@ IMPORT_STATUS_CHOICES = (
     ("skipped", "Skipped"),
 )
 
+STATUS_COUNTERS = ["{}_count".format(status) for status, _ in IMPORT_STATUS_CHOICES]
+
+
+def update_status_counters(queryset, old_status, new_status, count=1):
+    """
+    Move count objects from old_status to new_status in the status counters
+    of the given queryset. Use None as old_status for new objects and as
+    new_status for deleted ones.
+
+    The update relies on F() expressions, so concurrent changes
+    are never lost.
+    """
+    if old_status == new_status or not count:
+        return 0
+    updates = {}
+    if old_status:
+        field = "{}_count".format(old_status)
+        updates[field] = models.F(field) - count
+    if new_status:
+        field = "{}_count".format(new_status)
+        updates[field] = models.F(field) + count
+    return queryset.update(**updates)
+
 
 class ImportBatch(models.Model):
     uuid = models.UUIDField(unique=True, db_index=True, default=uuid.uuid4)
@@ -783,6 +1117,11 @@ class ImportBatch(models.Model):
         blank=True,
         on_delete=models.CASCADE,
     )
+    # number of jobs in each status, kept up to date when jobs are saved
+    pending_count = models.IntegerField(default=0)
+    finished_count = models.IntegerField(default=0)
+    errored_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)
 
     class Meta:
         ordering = ["-creation_date"]
@@ -790,9 +1129,17 @@ class ImportBatch(models.Model):
     def __str__(self):
         return str(self.pk)
 
+    def compute_status(self):
+        if self.errored_count > 0:
+            return "errored"
+        if self.pending_count > 0:
+            return "pending"
+        return "finished"
+
     def update_status(self):
         old_status = self.status
-        self.status = utils.compute_status(self.jobs.all())
+        self.refresh_from_db(fields=STATUS_COUNTERS)
+        self.status = self.compute_status()
         if self.status == old_status:
             return
         self.save(update_fields=["status"])
@@ -877,6 +1224,60 @@ class LibraryQuerySet(models.QuerySet):
             | models.Q(pk__in=followed_libraries)
         )
 
+    def viewable_ids(self, actor):
+        """
+        Same as viewable_by, but return a cached list of library ids,
+        to avoid embedding the full subquery in playability checks.
+        """
+        key = get_viewable_libraries_cache_key(actor)
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.viewable_by(actor).values_list("pk", flat=True))
+            cache.set(key, ids, VIEWABLE_LIBRARIES_CACHE_TIMEOUT)
+        return ids
+
+
+VIEWABLE_LIBRARIES_CACHE_TIMEOUT = 60 * 60
+VIEWABLE_LIBRARIES_GENERATION_KEY = "music:viewable-libraries:generation"
+
+
+def get_viewable_libraries_generation():
+    generation = cache.get(VIEWABLE_LIBRARIES_GENERATION_KEY)
+    if generation is None:
+        cache.add(VIEWABLE_LIBRARIES_GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = cache.get(VIEWABLE_LIBRARIES_GENERATION_KEY)
+    return generation
+
+
+def get_viewable_libraries_cache_key(actor):
+    # cached ids are namespaced by generation, so a change affecting every
+    # actor (e.g. a new public library) only requires a new generation
+    return "music:viewable-libraries:{}:{}".format(
+        get_viewable_libraries_generation(), actor.pk if actor else "anonymous"
+    )
+
+
+def invalidate_viewable_libraries(actor=None):
+    """
+    Discard the cached viewable libraries of the given actor,
+    or of all actors if no actor is given.
+
+    The cache is invalidated immediately, and again once the current
+    transaction is committed, since concurrent requests may have cached
+    stale data in the meantime.
+    """
+    clear_viewable_libraries(actor)
+    common_utils.on_commit(clear_viewable_libraries, actor)
+
+
+def clear_viewable_libraries(actor=None):
+    if actor:
+        cache.delete(get_viewable_libraries_cache_key(actor))
+    else:
+        # we use a random value instead of a counter, in case the key
+        # is evicted from the cache
+        cache.set(VIEWABLE_LIBRARIES_GENERATION_KEY, uuid.uuid4().hex, None)
+
 
 class Library(federation_models.FederationMixin):
     uuid = models.UUIDField(unique=True, db_index=True, default=uuid.uuid4)
@@ -912,7 +1313,12 @@ class Library(federation_models.FederationMixin):
             return True
         return False
 
-    def schedule_scan(self, actor, force=False):
+    def schedule_scan(self, actor, force=False, full=False):
+        """
+        Schedule a scan of the library. Unless full is True, the scan is
+        incremental and stops at the first page that was already fetched
+        during the previous successful scan.
+        """
         latest_scan = (
             self.scans.exclude(status="errored").order_by("-creation_date").first()
         )
@@ -925,7 +1331,22 @@ class Library(federation_models.FederationMixin):
         ):
             return
 
-        scan = self.scans.create(total_files=self.uploads_count, actor=actor)
+        kwargs = {}
+        previous_scan = (
+            self.scans.filter(status="finished")
+            .exclude(last_creation_date=None)
+            .order_by("-creation_date")
+            .first()
+        )
+        if previous_scan and not full:
+            kwargs = {
+                "since": previous_scan.last_creation_date,
+                "since_fid": previous_scan.last_fid,
+                "last_creation_date": previous_scan.last_creation_date,
+                "last_fid": previous_scan.last_fid,
+                "page_etags": previous_scan.page_etags,
+            }
+        scan = self.scans.create(total_files=self.uploads_count, actor=actor, **kwargs)
         from . import tasks
 
         common_utils.on_commit(tasks.start_library_scan.delay, library_scan_id=scan.pk)
@@ -940,6 +1361,78 @@ SCAN_STATUS = [
 ]
 
 
+class UploadImportSummary(models.Model):
+    """
+    Number of uploads in each import status for a given import reference,
+    so the progress of an import can be displayed without counting uploads.
+    """
+
+    library = models.ForeignKey(
+        Library, related_name="import_summaries", on_delete=models.CASCADE
+    )
+    import_reference = models.CharField(max_length=50)
+    pending_count = models.IntegerField(default=0)
+    finished_count = models.IntegerField(default=0)
+    errored_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("library", "import_reference")
+
+    def get_counts(self):
+        return {
+            status: getattr(self, "{}_count".format(status))
+            for status, _ in TRACK_FILE_IMPORT_STATUS_CHOICES
+        }
+
+
+def record_import_status_change(
+    library_id, import_reference, old_status, new_status, count=1
+):
+    """
+    Update the import summary of the given reference when count uploads
+    move from old_status to new_status.
+    """
+    if not library_id or old_status == new_status:
+        return
+    if old_status is None:
+        UploadImportSummary.objects.get_or_create(
+            library_id=library_id, import_reference=import_reference
+        )
+    update_status_counters(
+        UploadImportSummary.objects.filter(
+            library_id=library_id, import_reference=import_reference
+        ),
+        old_status,
+        new_status,
+        count=count,
+    )
+
+
+def record_bulk_import_status_change(uploads, created=False):
+    """
+    Update the import summaries after uploads were created or updated
+    in bulk, since this bypasses the post_save signal.
+    """
+    changes = collections.Counter(
+        [
+            (
+                u.library_id,
+                u.import_reference,
+                None if created else u._old_status,
+                u.import_status,
+            )
+            for u in uploads
+        ]
+    )
+    for (library_id, reference, old_status, new_status), count in changes.items():
+        record_import_status_change(
+            library_id, reference, old_status, new_status, count=count
+        )
+    for upload in uploads:
+        upload._old_status = upload.import_status
+
+
 class LibraryScan(models.Model):
     actor = models.ForeignKey(
         "federation.Actor", null=True, blank=True, on_delete=models.CASCADE
@@ -948,16 +1441,192 @@ class LibraryScan(models.Model):
     total_files = models.PositiveIntegerField(default=0)
     processed_files = models.PositiveIntegerField(default=0)
     errored_files = models.PositiveIntegerField(default=0)
+    # only known when pages can be scanned concurrently
+    total_pages = models.PositiveIntegerField(default=0)
+    processed_pages = models.PositiveIntegerField(default=0)
     status = models.CharField(default="pending", max_length=25)
     creation_date = models.DateTimeField(default=timezone.now)
     modification_date = models.DateTimeField(null=True, blank=True)
+    # newest upload of the previous scan, for incremental scans
+    since = models.DateTimeField(null=True, blank=True)
+    since_fid = models.URLField(max_length=500, null=True, blank=True)
+    # newest upload seen so far, the next scan will start from here
+    last_creation_date = models.DateTimeField(null=True, blank=True)
+    last_fid = models.URLField(max_length=500, null=True, blank=True)
+    # {page_url: etag}, sent back in conditional requests on next scan
+    page_etags = JSONField(default=dict, blank=True)
+
+    @property
+    def is_incremental(self):
+        return self.since is not None
+
+
+class TrackAvailabilityQuerySet(models.QuerySet):
+    def playable_by(self, actor):
+        if actor is None:
+            return self.filter(privacy_level="everyone")
+        return self.filter(library_id__in=Library.objects.viewable_ids(actor))
+
+
+class TrackAvailability(models.Model):
+    """
+    Denormalized table listing the libraries where a track is available,
+    i.e. where the track has at least one finished upload.
+
+    It is maintained incrementally when uploads and libraries are updated,
+    and used to check if a track is playable by an actor without scanning
+    the uploads table.
+    """
+
+    track = models.ForeignKey(
+        Track, related_name="availabilities", on_delete=models.CASCADE
+    )
+    library = models.ForeignKey(
+        Library, related_name="track_availabilities", on_delete=models.CASCADE
+    )
+    privacy_level = models.CharField(
+        choices=LIBRARY_PRIVACY_LEVEL_CHOICES, max_length=25, db_index=True
+    )
+    actor = models.ForeignKey(
+        "federation.Actor",
+        related_name="track_availabilities",
+        on_delete=models.CASCADE,
+    )
+
+    objects = TrackAvailabilityQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ("track", "library")
+        index_together = [("library", "track")]
+
+
+def update_track_availability(track_id, library_id):
+    """
+    Create or delete the availability of the given track in the given
+    library, depending on its uploads.
+    """
+    if not track_id or not library_id:
+        return
+    available = Upload.objects.filter(
+        track_id=track_id, library_id=library_id, import_status="finished"
+    ).exists()
+    if not available:
+        TrackAvailability.objects.filter(
+            track_id=track_id, library_id=library_id
+        ).delete()
+        return
+    library = Library.objects.filter(pk=library_id).only("actor", "privacy_level")
+    library = library.first()
+    if not library:
+        return
+    TrackAvailability.objects.get_or_create(
+        track_id=track_id,
+        library_id=library_id,
+        defaults={"privacy_level": library.privacy_level, "actor_id": library.actor_id},
+    )
+
+
+def rebuild_track_availabilities(libraries=None):
+    """
+    Recompute the availabilities of all tracks, or only of tracks in the
+    given libraries queryset. Used after bulk updates that bypass signals.
+    """
+    availabilities = TrackAvailability.objects.all()
+    uploads = Upload.objects.filter(import_status="finished", track__isnull=False)
+    if libraries is not None:
+        availabilities = availabilities.filter(library__in=libraries)
+        uploads = uploads.filter(library__in=libraries)
+    rows = (
+        uploads.values("track_id", "library_id", "library__privacy_level")
+        .annotate(actor_id=models.F("library__actor_id"))
+        .distinct()
+        .order_by()
+    )
+    with transaction.atomic():
+        availabilities.delete()
+        TrackAvailability.objects.bulk_create(
+            [
+                TrackAvailability(
+                    track_id=row["track_id"],
+                    library_id=row["library_id"],
+                    privacy_level=row["library__privacy_level"],
+                    actor_id=row["actor_id"],
+                )
+                for row in rows.iterator()
+            ],
+            batch_size=1000,
+        )
+
+
+def get_old_status(instance, attr, created, **kwargs):
+    """
+    Return the status the instance had in database before the save, or None
+    if it was just created. Return False if the status was not changed.
+    """
+    update_fields = kwargs.get("update_fields", []) or []
+    if update_fields and attr not in update_fields:
+        return False
+    new_status = getattr(instance, attr)
+    old_status = None if created else instance._old_status
+    instance._old_status = new_status
+    if old_status == new_status:
+        return False
+    return old_status
+
+
+@receiver(models.signals.post_init, sender=ImportJob)
+def track_import_job_status(sender, instance, **kwargs):
+    # we don't want to trigger a query if the field was deferred
+    instance._old_status = instance.__dict__.get("status")
 
 
 @receiver(post_save, sender=ImportJob)
-def update_batch_status(sender, instance, **kwargs):
+def update_batch_status(sender, instance, created, **kwargs):
+    old_status = get_old_status(instance, "status", created, **kwargs)
+    if old_status is False:
+        return
+    update_status_counters(
+        ImportBatch.objects.filter(pk=instance.batch_id), old_status, instance.status
+    )
     instance.batch.update_status()
 
 
+@receiver(models.signals.post_delete, sender=ImportJob)
+def update_batch_counters_on_job_delete(sender, instance, **kwargs):
+    update_status_counters(
+        ImportBatch.objects.filter(pk=instance.batch_id), instance._old_status, None
+    )
+
+
+@receiver(models.signals.post_init, sender=Upload)
+def track_upload_import_status(sender, instance, **kwargs):
+    instance._old_status = instance.__dict__.get("import_status")
+    instance._old_availability = (
+        instance.__dict__.get("track_id"),
+        instance.__dict__.get("library_id"),
+    )
+
+
+@receiver(post_save, sender=Upload)
+def update_import_summary_on_upload_save(sender, instance, created, **kwargs):
+    old_status = get_old_status(instance, "import_status", created, **kwargs)
+    if old_status is False:
+        return
+    record_import_status_change(
+        instance.library_id,
+        instance.import_reference,
+        old_status,
+        instance.import_status,
+    )
+
+
+@receiver(models.signals.post_delete, sender=Upload)
+def update_import_summary_on_upload_delete(sender, instance, **kwargs):
+    record_import_status_change(
+        instance.library_id, instance.import_reference, instance._old_status, None
+    )
+
+
 @receiver(post_save, sender=ImportBatch)
 def update_request_status(sender, instance, created, **kwargs):
     update_fields = kwargs.get("update_fields", []) or []
@@ -981,11 +1650,88 @@ def update_request_status(sender, instance, created, **kwargs):
         return instance.import_request.save(update_fields=["status"])
 
 
+def is_visible_to_other_actors(library):
+    # public libraries, remote ones included, are viewable by every actor,
+    # and instance libraries by the actors of the same domain. Private
+    # libraries only become viewable through follows, which invalidate
+    # the cache of the follower
+    return library.privacy_level in ["everyone", "instance"]
+
+
+@receiver(models.signals.post_init, sender=Library)
+def track_library_privacy_level(sender, instance, **kwargs):
+    instance._old_privacy_level = instance.__dict__.get("privacy_level")
+
+
+@receiver(post_save, sender=Library)
+def invalidate_viewable_libraries_on_library_save(sender, instance, created, **kwargs):
+    update_fields = kwargs.get("update_fields", []) or []
+    if not created and update_fields and "privacy_level" not in update_fields:
+        return
+    privacy_level_changed = (
+        not created and instance._old_privacy_level != instance.privacy_level
+    )
+    instance._old_privacy_level = instance.privacy_level
+    if privacy_level_changed or (created and is_visible_to_other_actors(instance)):
+        invalidate_viewable_libraries()
+    else:
+        invalidate_viewable_libraries(instance.actor)
+
+
+@receiver(post_save, sender=Library)
+def update_track_availabilities_privacy(sender, instance, created, **kwargs):
+    update_fields = kwargs.get("update_fields", []) or []
+    if created or (update_fields and "privacy_level" not in update_fields):
+        return
+    instance.track_availabilities.exclude(privacy_level=instance.privacy_level).update(
+        privacy_level=instance.privacy_level
+    )
+
+
+@receiver(post_save, sender=Upload)
+def update_track_availability_on_upload_save(sender, instance, created, **kwargs):
+    update_fields = kwargs.get("update_fields", []) or []
+    if update_fields and not {"import_status", "track", "library"} & set(update_fields):
+        return
+    old = instance._old_availability
+    new = (instance.track_id, instance.library_id)
+    instance._old_availability = new
+    update_track_availability(*new)
+    if not created and old != new:
+        # the upload moved to another track or library
+        update_track_availability(*old)
+
+
+@receiver(models.signals.post_delete, sender=Upload)
+def update_track_availability_on_upload_delete(sender, instance, **kwargs):
+    update_track_availability(instance.track_id, instance.library_id)
+
+
+@receiver(models.signals.post_delete, sender=Library)
+def invalidate_viewable_libraries_on_library_delete(sender, instance, **kwargs):
+    if is_visible_to_other_actors(instance):
+        invalidate_viewable_libraries()
+    else:
+        # followers may still have the id in cache, which is harmless
+        invalidate_viewable_libraries(instance.actor)
+
+
+@receiver(post_save, sender=federation_models.LibraryFollow)
+@receiver(models.signals.post_delete, sender=federation_models.LibraryFollow)
+def invalidate_viewable_libraries_on_follow_change(sender, instance, **kwargs):
+    update_fields = kwargs.get("update_fields", []) or []
+    if update_fields and "approved" not in update_fields:
+        return
+    invalidate_viewable_libraries(instance.actor)
+
+
 @receiver(models.signals.post_save, sender=Album)
 def warm_album_covers(sender, instance, **kwargs):
     if not instance.cover:
         return
-    album_covers_warmer = VersatileImageFieldWarmer(
-        instance_or_queryset=instance, rendition_key_set="square", image_attr="cover"
-    )
-    num_created, failed_to_create = album_covers_warmer.warm()
+    update_fields = kwargs.get("update_fields", []) or []
+    if update_fields and "cover" not in update_fields:
+        return
+    from . import tasks
+
+    tasks.schedule_album_covers_warming([instance.pk])
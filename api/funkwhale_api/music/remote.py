@@ -0,0 +1,309 @@
+"""
+Serve remote uploads to listeners while they are being downloaded into
+the federation cache.
+
+The first request for a remote upload that is not cached yet starts the
+download in a background thread, which writes the file to a partial file
+under MEDIA_ROOT. This request, and any concurrent request for the same
+upload (including range requests), then stream the bytes from this partial
+file as soon as they are written, instead of waiting for the whole download
+to complete.
+
+Once the download is over, the file is stored in the federation cache
+as usual and subsequent requests are served from there. If the download
+fails, responses following the partial file are aborted, so clients do not
+keep a truncated file.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db import connection
+from django import http
+
+from funkwhale_api.common import streaming
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+# how often readers check for new bytes in the partial file, the interval
+# doubles while no new bytes arrive, up to MAX_POLL_INTERVAL
+POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2
+# readers give up if no new bytes arrive during this delay, in seconds
+READ_TIMEOUT = 30
+# the download state is refreshed regularly, and discarded after this delay
+# if the download thread died without cleaning up
+STATE_TIMEOUT = 60 * 5
+# the outcome of a download is kept for this delay, so readers can tell
+# whether the partial file they follow is complete
+FINAL_STATE_TIMEOUT = 60
+
+
+class IncompleteDownload(Exception):
+    pass
+
+
+def get_cache_key(upload):
+    return "music:remote-download:{}".format(upload.pk)
+
+
+def get_partial_path(upload):
+    return os.path.join(
+        settings.MEDIA_ROOT,
+        "federation_cache",
+        "partial",
+        "{}.part".format(upload.uuid),
+    )
+
+
+class RemoteDownload(threading.Thread):
+    """
+    Consume a streamed remote response into a partial file, and store
+    the result in the federation cache when the download is over.
+    """
+
+    def __init__(self, upload, response, path, size):
+        super().__init__(daemon=True)
+        self.upload = upload
+        self.response = response
+        self.path = path
+        self.size = size
+        self.key = get_cache_key(upload)
+        self.status = "downloading"
+
+    def set_state(self, status):
+        cache.set(
+            self.key,
+            {"status": status, "size": self.size, "path": self.path},
+            STATE_TIMEOUT,
+        )
+
+    def run(self):
+        self.status = "errored"
+        try:
+            self.download()
+            self.store()
+            self.status = "finished"
+        except Exception:
+            logger.exception("Error while downloading upload %s", self.upload.pk)
+        finally:
+            # readers will stop following the partial file, and new requests
+            # will go through the regular path
+            cache.set(
+                self.key,
+                {"status": self.status, "size": self.size},
+                FINAL_STATE_TIMEOUT,
+            )
+            # readers that are still streaming hold an open file descriptor,
+            # so we can safely remove the partial file
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            if threading.current_thread() is self:
+                connection.close()
+
+    def download(self):
+        written = 0
+        with self.response as r, open(self.path, "ab") as f:
+            for i, chunk in enumerate(r.iter_content(chunk_size=CHUNK_SIZE)):
+                f.write(chunk)
+                f.flush()
+                written += len(chunk)
+                if i % 16 == 0:
+                    # refresh the state so it does not expire during long downloads
+                    self.set_state("downloading")
+        if self.size and written != self.size:
+            # e.g. the remote closed the connection early, we don't want
+            # to cache a truncated file
+            raise IncompleteDownload(
+                "Received {} bytes instead of {}".format(written, self.size)
+            )
+
+    def store(self):
+        upload = self.upload
+        with open(self.path, "rb") as f:
+            upload.audio_file.save(
+                upload.get_remote_audio_filename(), File(f), save=False
+            )
+        upload.save(update_fields=["audio_file"])
+        upload.update_audio_data()
+
+
+def claim_download(upload):
+    """
+    Mark the given upload as being downloaded, and return False if a download
+    is already in progress. Listeners requesting the upload meanwhile wait
+    for the download to start, and stream it from the partial file.
+    """
+    return cache.add(get_cache_key(upload), {"status": "starting"}, STATE_TIMEOUT)
+
+
+def open_download(upload, user):
+    """
+    Open the remote response of a download claimed with claim_download, and
+    return the RemoteDownload to run. The claim is released on errors.
+    """
+    key = get_cache_key(upload)
+    path = get_partial_path(upload)
+    try:
+        response = upload.get_remote_audio_response(user)
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "wb").close()
+    except Exception:
+        cache.delete(key)
+        raise
+
+    size = int(response.headers.get("Content-Length") or 0) or upload.size or None
+    download = RemoteDownload(upload, response, path, size)
+    download.set_state("downloading")
+    return download
+
+
+def prepare_download(upload, user):
+    """
+    Claim the download of the given upload and open the remote response.
+    Return the RemoteDownload to run, or None if a download is already
+    in progress.
+    """
+    if not claim_download(upload):
+        return
+    return open_download(upload, user)
+
+
+def start_download(upload, user):
+    """
+    Try to start the download of the given upload in a background thread.
+    Return the download state, or None if a download is already in progress.
+    """
+    download = prepare_download(upload, user)
+    if not download:
+        return
+    download.start()
+    return {"status": "downloading", "size": download.size, "path": download.path}
+
+
+def wait_for_download(upload):
+    """
+    Return the state of the download in progress for this upload, waiting
+    for the download to actually start if needed.
+    """
+    key = get_cache_key(upload)
+    waited = 0
+    while waited < READ_TIMEOUT:
+        state = cache.get(key)
+        if not state or state["status"] != "starting":
+            return state
+        time.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+
+
+def follow_file(file, key, start, end=None):
+    """
+    Yield the bytes of a file that is still being written, from start to end
+    (inclusive), until the download is over.
+
+    Raise IncompleteDownload if the download failed before end was reached:
+    the Content-Length is already sent, so the connection must be aborted
+    instead of ending the response normally.
+    """
+    file.seek(start)
+    position = start
+    waited = 0
+    interval = POLL_INTERVAL
+    try:
+        while end is None or position <= end:
+            size = CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - position + 1)
+            data = file.read(size)
+            if data:
+                position += len(data)
+                waited = 0
+                interval = POLL_INTERVAL
+                yield data
+                continue
+            state = cache.get(key)
+            status = state["status"] if state else None
+            if status != "downloading":
+                # the download is over, we read what's left and stop there
+                data = file.read(size)
+                if data:
+                    position += len(data)
+                    yield data
+                    continue
+                if status == "errored" or end is not None:
+                    raise IncompleteDownload(
+                        "Download of {} stopped at byte {}".format(file.name, position)
+                    )
+                return
+            if waited >= READ_TIMEOUT:
+                raise IncompleteDownload("Timeout while streaming {}".format(file.name))
+            time.sleep(interval)
+            waited += interval
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+    finally:
+        file.close()
+
+
+def get_response(request, file, key, size, content_type=None):
+    byte_range = None
+    if size and request is not None:
+        try:
+            byte_range = streaming.parse_range_header(
+                request.META.get("HTTP_RANGE"), size
+            )
+        except streaming.UnsatisfiableRange:
+            file.close()
+            response = http.HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{}".format(size)
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        response = http.StreamingHttpResponse(
+            follow_file(file, key, start, end), status=206
+        )
+        response["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+        response["Content-Length"] = end - start + 1
+    elif size:
+        response = http.StreamingHttpResponse(follow_file(file, key, 0, size - 1))
+        response["Content-Length"] = size
+    else:
+        # we don't know the final size, so we cannot honor range requests
+        response = http.StreamingHttpResponse(follow_file(file, key, 0))
+    if size:
+        response["Accept-Ranges"] = "bytes"
+    if content_type:
+        response["Content-Type"] = content_type
+    return response
+
+
+def stream_upload(upload, user, request=None):
+    """
+    Return a response streaming the given remote upload while it is
+    downloaded in the federation cache.
+
+    Return None if the upload is not being downloaded anymore (e.g. it
+    was cached in the meantime), in which case the caller should serve
+    it through the regular path.
+    """
+    state = start_download(upload, user) or wait_for_download(upload)
+    if not state or not state.get("path"):
+        return
+    try:
+        file = open(state["path"], "rb")
+    except FileNotFoundError:
+        # the download finished or failed in the meantime
+        return
+    return get_response(
+        request,
+        file,
+        get_cache_key(upload),
+        state["size"],
+        content_type=upload.mimetype,
+    )
@@ -0,0 +1,237 @@
+"""
+Incremental rescan of in-place libraries.
+
+The state of each in-place file (size, modification time, inode and optionally
+a checksum) is stored in an IndexedFile. A rescan only needs to stat the
+files on disk and compare the result with the index to know which files
+are new, modified, moved or deleted.
+"""
+import collections
+import hashlib
+import os
+
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    CharField,
+    DateTimeField,
+    FloatField,
+    Value,
+    When,
+)
+from django.utils import timezone
+
+from funkwhale_api.common import utils as common_utils
+
+from . import models
+
+Changes = collections.namedtuple(
+    "Changes", ["new", "modified", "moved", "deleted", "unchanged"]
+)
+
+
+def compute_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_fingerprint(path, checksum=False):
+    stat = os.stat(path)
+    return {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "inode": stat.st_ino,
+        "checksum": compute_checksum(path) if checksum else None,
+    }
+
+
+def get_upload_path(upload):
+    return upload.source.replace("file://", "", 1)
+
+
+def build_indexed_file(upload, fingerprint=None, checksum=False):
+    path = get_upload_path(upload)
+    fingerprint = fingerprint or get_fingerprint(path, checksum=checksum)
+    return models.IndexedFile(
+        upload=upload, library_id=upload.library_id, path=path, **fingerprint
+    )
+
+
+def index_uploads(uploads, checksum=False):
+    """
+    Create the index entries of the given in-place uploads, skipping files
+    that are not on disk anymore.
+    """
+    entries = []
+    for upload in uploads:
+        try:
+            entries.append(build_indexed_file(upload, checksum=checksum))
+        except FileNotFoundError:
+            continue
+    return models.IndexedFile.objects.bulk_create(entries)
+
+
+def bootstrap_index(library, checksum=False):
+    """
+    Index the in-place uploads that were imported before the index existed.
+    """
+    uploads = library.uploads.filter(
+        source__startswith="file://", indexed_file=None
+    ).only("pk", "source", "library_id")
+    created = 0
+    for chunk in common_utils.chunk_queryset(uploads, 1000):
+        created += len(index_uploads(chunk, checksum=checksum))
+    return created
+
+
+def is_modified(entry, fingerprint):
+    if entry.size != fingerprint["size"] or entry.mtime != fingerprint["mtime"]:
+        return True
+    return bool(
+        entry.checksum
+        and fingerprint["checksum"]
+        and entry.checksum != fingerprint["checksum"]
+    )
+
+
+def scan(paths, library, checksum=False):
+    """
+    Compare the given paths with the index of the library, and return
+    the changes. Files that are indexed but not in the given paths are
+    only considered deleted if they are not on disk anymore.
+    """
+    index = {
+        entry.path: entry
+        for entry in library.indexed_files.only(
+            "pk", "upload_id", "path", "size", "mtime", "inode", "checksum"
+        ).iterator()
+    }
+    new = []
+    modified = []
+    unchanged = 0
+    for path in paths:
+        entry = index.pop(path, None)
+        if entry is None:
+            new.append((path, get_fingerprint(path, checksum=checksum)))
+            continue
+        fingerprint = get_fingerprint(path, checksum=checksum and bool(entry.checksum))
+        if is_modified(entry, fingerprint):
+            modified.append((entry, fingerprint))
+        else:
+            unchanged += 1
+
+    # remaining entries were not found during the scan
+    missing = [entry for entry in index.values() if not os.path.exists(entry.path)]
+    by_inode = {(e.inode, e.size): e for e in missing}
+    by_checksum = {e.checksum: e for e in missing if e.checksum}
+    moved = []
+    really_new = []
+    for path, fingerprint in new:
+        entry = by_inode.pop((fingerprint["inode"], fingerprint["size"]), None)
+        if entry is None and fingerprint["checksum"]:
+            # the file was copied to another filesystem, its inode changed
+            entry = by_checksum.pop(fingerprint["checksum"], None)
+        if entry is None:
+            really_new.append(path)
+        else:
+            moved.append((entry, path, fingerprint))
+    moved_pks = set([entry.pk for entry, _, _ in moved])
+    deleted = [entry for entry in missing if entry.pk not in moved_pks]
+    return Changes(
+        new=really_new,
+        modified=modified,
+        moved=moved,
+        deleted=deleted,
+        unchanged=unchanged,
+    )
+
+
+def apply_fingerprint(entry, fingerprint, path=None):
+    for key, value in fingerprint.items():
+        if key == "checksum" and not value:
+            continue
+        setattr(entry, key, value)
+    entry.path = path or entry.path
+    entry.modification_date = timezone.now()
+
+
+def update_entry(entry, fingerprint, path=None):
+    apply_fingerprint(entry, fingerprint, path=path)
+    entry.save()
+
+
+def apply_moves(moved):
+    for entry, path, fingerprint in moved:
+        models.Upload.objects.filter(pk=entry.upload_id).update(
+            source="file://{}".format(path)
+        )
+        update_entry(entry, fingerprint, path=path)
+
+
+def apply_deletions(deleted):
+    pks = [entry.upload_id for entry in deleted]
+    for chunk in common_utils.batch(pks, 1000):
+        models.Upload.objects.filter(pk__in=chunk).delete()
+
+
+def update_entries(entries):
+    """
+    Save the fingerprints of the given index entries with a single
+    UPDATE query.
+    """
+
+    def case(field, output_field):
+        return Case(
+            *[When(pk=e.pk, then=Value(getattr(e, field))) for e in entries],
+            output_field=output_field
+        )
+
+    models.IndexedFile.objects.filter(pk__in=[e.pk for e in entries]).update(
+        size=case("size", BigIntegerField()),
+        mtime=case("mtime", FloatField()),
+        inode=case("inode", BigIntegerField()),
+        checksum=case("checksum", CharField()),
+        modification_date=case("modification_date", DateTimeField()),
+    )
+
+
+def reset_modified(modified):
+    """
+    Update the index of the modified files and mark their uploads as pending,
+    so they can be processed again. Files are handled by batches, with a
+    fixed number of queries per batch. Return the pending uploads.
+    """
+    pending = []
+    for chunk in common_utils.batch(modified, 1000):
+        entries = []
+        for entry, fingerprint in chunk:
+            apply_fingerprint(entry, fingerprint)
+            entries.append(entry)
+        update_entries(entries)
+
+        upload_ids = [entry.upload_id for entry in entries]
+        uploads = models.Upload.objects.in_bulk(upload_ids)
+        uploads = [uploads[pk] for pk in upload_ids if pk in uploads]
+        models.Upload.objects.filter(pk__in=upload_ids).update(
+            import_status="pending",
+            size=None,
+            duration=None,
+            bitrate=None,
+            mimetype=None,
+        )
+        for upload in uploads:
+            upload.import_status = "pending"
+            upload.size = None
+            upload.duration = None
+            upload.bitrate = None
+            upload.mimetype = None
+
+        # the bulk update bypasses the post_save signal
+        models.record_bulk_import_status_change(uploads)
+        for track_id, library_id in set([(u.track_id, u.library_id) for u in uploads]):
+            models.update_track_availability(track_id, library_id)
+        pending += uploads
+    return pending
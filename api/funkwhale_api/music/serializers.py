@@ -1,4 +1,5 @@
 from django.db import transaction
+from django.db.models import Count, Sum
 from rest_framework import serializers
 from taggit.models import Tag
 from versatileimagefield.serializers import VersatileImageFieldSerializer
@@ -306,13 +307,66 @@ class UploadForOwnerSerializer(UploadSerializer):
         return super().validate(validated_data)
 
     def validate_upload_quota(self, f):
-        quota_status = self.context["user"].get_quota_status()
-        if (f.size / 1000 / 1000) > quota_status["remaining"]:
-            raise serializers.ValidationError("upload_quota_reached")
-
+        validate_upload_quota(self.context["user"], f.size)
         return f
 
 
+def validate_upload_quota(user, size):
+    """
+    Ensure the user has enough quota left for a file of the given size,
+    including the space reserved by the chunked uploads in progress.
+    """
+    quota_status = user.get_quota_status()
+    reserved = models.UploadSession.objects.filter(
+        library__actor=user.actor, status__in=["receiving", "finalizing"]
+    ).aggregate(total=Sum("size"))["total"]
+    remaining = quota_status["remaining"] - (reserved or 0) / 1000 / 1000
+    if (size / 1000 / 1000) > remaining:
+        raise serializers.ValidationError("upload_quota_reached")
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    library = common_serializers.RelatedField(
+        "uuid",
+        LibraryForOwnerSerializer(),
+        required=True,
+        filters=lambda context: {"actor": context["user"].actor},
+    )
+    offset = serializers.IntegerField(source="received", read_only=True)
+    upload = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.UploadSession
+        fields = [
+            "uuid",
+            "library",
+            "filename",
+            "size",
+            "offset",
+            "source",
+            "import_reference",
+            "import_metadata",
+            "status",
+            "upload",
+            "creation_date",
+            "modification_date",
+        ]
+        read_only_fields = ["uuid", "status", "creation_date", "modification_date"]
+
+    def get_upload(self, o):
+        if o.upload_id:
+            return UploadForOwnerSerializer(o.upload).data
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be greater than 0")
+        return value
+
+    def validate(self, validated_data):
+        validate_upload_quota(self.context["user"], validated_data["size"])
+        return super().validate(validated_data)
+
+
 class UploadActionSerializer(common_serializers.ActionSerializer):
     actions = [
         common_serializers.Action("delete", allow_all=True),
@@ -339,6 +393,19 @@ class UploadActionSerializer(common_serializers.ActionSerializer):
     def handle_relaunch_import(self, objects):
         qs = objects.exclude(import_status="finished")
         pks = list(qs.values_list("id", flat=True))
+        changes = (
+            qs.values("library_id", "import_reference", "import_status")
+            .order_by()
+            .annotate(count=Count("id"))
+        )
+        for row in changes:
+            models.record_import_status_change(
+                row["library_id"],
+                row["import_reference"],
+                row["import_status"],
+                "pending",
+                count=row["count"],
+            )
         qs.update(import_status="pending")
         for pk in pks:
             common_utils.on_commit(tasks.process_upload.delay, upload_id=pk)
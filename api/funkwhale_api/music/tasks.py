@@ -1,28 +1,39 @@
 import collections
+import datetime
+import itertools
 import logging
 import os
+import urllib.parse
 
+from django.core.cache import cache
 from django.utils import timezone
-from django.db import transaction
-from django.db.models import F, Q
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
 from django.dispatch import receiver
+from django_redis import get_redis_connection
 
 from musicbrainzngs import ResponseError
 from requests.exceptions import RequestException
 
-from funkwhale_api.common import channels
+from funkwhale_api.common import channels, images, preferences
+from funkwhale_api.common import utils as common_utils
 from funkwhale_api.federation import routes
 from funkwhale_api.federation import library as lb
 from funkwhale_api.taskapp import celery
+from funkwhale_api.users import models as users_models
 
+from . import access
 from . import lyrics as lyrics_utils
 from . import models
-from . import metadata
+from . import remote
 from . import signals
 from . import serializers
 
 logger = logging.getLogger(__name__)
 
+# number of pages of a remote library scanned at the same time
+SCAN_CONCURRENCY = 4
+
 
 def update_album_cover(album, source=None, cover_data=None, replace=False):
     if album.cover and not replace:
@@ -87,11 +98,32 @@ def start_library_scan(library_scan):
         library_scan.status = "errored"
         library_scan.save(update_fields=["status", "modification_date"])
         raise
+    page_urls = None
+    if not library_scan.is_incremental:
+        # incremental scans stop at the first known page, so they have to
+        # fetch pages one after the other
+        page_urls = get_page_urls(data)
     library_scan.modification_date = timezone.now()
     library_scan.status = "scanning"
     library_scan.total_files = data["totalItems"]
-    library_scan.save(update_fields=["status", "modification_date", "total_files"])
-    scan_library_page.delay(library_scan_id=library_scan.pk, page_url=data["first"])
+    library_scan.total_pages = len(page_urls or [])
+    library_scan.save(
+        update_fields=["status", "modification_date", "total_files", "total_pages"]
+    )
+    if not page_urls:
+        # we can only follow the next links, one page at a time
+        scan_library_page.delay(library_scan_id=library_scan.pk, page_url=data["first"])
+        return
+
+    # each task scans the page N, then the page N + SCAN_CONCURRENCY,
+    # so at most SCAN_CONCURRENCY pages are fetched at the same time
+    for i, page_url in enumerate(page_urls[:SCAN_CONCURRENCY]):
+        scan_library_page.delay(
+            library_scan_id=library_scan.pk,
+            page_url=page_url,
+            page=i + 1,
+            concurrency=SCAN_CONCURRENCY,
+        )
 
 
 @celery.app.task(
@@ -104,28 +136,457 @@ def start_library_scan(library_scan):
     models.LibraryScan.objects.select_related().filter(status="scanning"),
     "library_scan",
 )
-def scan_library_page(library_scan, page_url):
-    data = lb.get_library_page(library_scan.library, page_url, library_scan.actor)
+def scan_library_page(library_scan, page_url, page=None, concurrency=None):
+    etag = None
+    if library_scan.is_incremental:
+        etag = library_scan.page_etags.get(page_url)
+    data = lb.get_library_page(
+        library_scan.library, page_url, library_scan.actor, etag=etag
+    )
+    scans = models.LibraryScan.objects.filter(pk=library_scan.pk)
+    if data is None:
+        # the page did not change since previous scan, nor did the older ones
+        scans.update(
+            processed_pages=F("processed_pages") + 1,
+            modification_date=timezone.now(),
+            status="finished",
+        )
+        return
+
+    items = [item.validated_data for item in data["items"]]
+    known = create_remote_uploads(
+        library_scan.library,
+        items,
+        import_reference="library-scan-{}".format(library_scan.pk),
+    )
+
+    # counters are updated once per page, with F() expressions since
+    # several pages may be scanned at the same time
+    scans.update(
+        processed_files=F("processed_files") + known,
+        errored_files=F("errored_files") + len(items) - known,
+        processed_pages=F("processed_pages") + 1,
+        modification_date=timezone.now(),
+    )
+    record_scanned_page(library_scan, page_url, data["etag"], items)
+
+    if page is None:
+        next_page = data.get("next")
+        fetch_next = next_page and next_page != page_url
+        if library_scan.is_incremental and is_known_page(
+            items, library_scan.since, library_scan.since_fid
+        ):
+            fetch_next = False
+        if fetch_next:
+            scan_library_page.delay(library_scan_id=library_scan.pk, page_url=next_page)
+        else:
+            scans.update(status="finished")
+        return
+
+    next_number = page + concurrency
+    if next_number <= library_scan.total_pages:
+        scan_library_page.delay(
+            library_scan_id=library_scan.pk,
+            page_url=common_utils.set_query_parameter(page_url, page=next_number),
+            page=next_number,
+            concurrency=concurrency,
+        )
+    scans.filter(processed_pages__gte=F("total_pages")).update(status="finished")
+
+
+def record_scanned_page(library_scan, page_url, etag, items):
+    """
+    Remember the newest upload and the ETag of the page, so the next scan
+    can skip what it already knows.
+    """
+    scans = models.LibraryScan.objects.filter(pk=library_scan.pk)
+    if items:
+        newest = max(items, key=lambda item: item["published"])
+        scans.filter(
+            Q(last_creation_date=None) | Q(last_creation_date__lt=newest["published"])
+        ).update(last_creation_date=newest["published"], last_fid=newest["id"])
+    if not etag:
+        return
+    with transaction.atomic():
+        # pages of a full scan are recorded concurrently
+        scan = scans.select_for_update().only("pk", "page_etags").get()
+        scan.page_etags[page_url] = etag
+        scan.save(update_fields=["page_etags"])
+
+
+def is_known_page(items, since, since_fid):
+    """
+    Library pages are sorted from the newest upload to the oldest. Return True
+    if the following pages only contain uploads seen during previous scan.
+    """
+    if since_fid and since_fid in [item["id"] for item in items]:
+        return True
+    return bool(items) and all([item["published"] <= since for item in items])
+
+
+def get_page_number(url):
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    try:
+        return int(query["page"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+def get_page_urls(collection):
+    """
+    Return the URLs of all the pages of a paginated collection, if they can
+    be deduced from its first and last pages, or None.
+    """
+    first = collection.get("first")
+    last = collection.get("last")
+    if not first or not last or get_page_number(first) != 1:
+        return None
+    last_number = get_page_number(last)
+    if last_number is None or last_number < 1:
+        return None
+    if common_utils.set_query_parameter(first, page=last_number) != last:
+        # the pages do not share the same URL
+        return None
+    return [
+        common_utils.set_query_parameter(first, page=i)
+        for i in range(1, last_number + 1)
+    ]
+
+
+def create_remote_uploads(library, items, import_reference):
+    """
+    Create the uploads of a remote library from validated
+    federation.serializers.UploadSerializer data, skipping the ones that
+    already exist. Artists, albums and tracks are shared between items, and
+    new tracks and uploads are inserted in bulk. Return the number of items
+    that are now known, existing or created.
+    """
+    by_fid = collections.OrderedDict([(item["id"], item) for item in items])
+    existing = set(
+        models.Upload.objects.filter(fid__in=list(by_fid.keys())).values_list(
+            "fid", flat=True
+        )
+    )
+    memo = {}
     uploads = []
+    for fid, item in by_fid.items():
+        if fid in existing:
+            continue
+        snapshot = dict(memo)
+        try:
+            with transaction.atomic():
+                track = resolve_track_from_import_metadata(
+                    federation_audio_track_to_metadata(item["track"]), memo=memo
+                )
+        except Exception:
+            memo.clear()
+            memo.update(snapshot)
+            logger.exception("Error while creating remote upload %s", fid)
+            continue
+        uploads.append(
+            models.Upload(
+                fid=fid,
+                mimetype=item["url"]["mediaType"],
+                source=item["url"]["href"],
+                creation_date=item["published"],
+                modification_date=item.get("updated"),
+                track=track,
+                duration=item["duration"],
+                size=item["size"],
+                bitrate=item["bitrate"],
+                library=library,
+                import_status="finished",
+                import_reference=import_reference,
+            )
+        )
 
-    for item_serializer in data["items"]:
-        upload = item_serializer.save(library=library_scan.library)
-        uploads.append(upload)
+    new_tracks = []
+    for upload in uploads:
+        if not upload.track.pk and upload.track not in new_tracks:
+            upload.track.fid = upload.track.get_federation_id()
+            new_tracks.append(upload.track)
+    created = dict(zip([id(t) for t in new_tracks], create_tracks(new_tracks)))
+    for upload in uploads:
+        # refresh the foreign key now that new tracks have a primary key
+        upload.track = created.get(id(upload.track), upload.track)
 
-    library_scan.processed_files = F("processed_files") + len(uploads)
-    library_scan.modification_date = timezone.now()
-    update_fields = ["modification_date", "processed_files"]
+    try:
+        with transaction.atomic():
+            models.Upload.objects.bulk_create(uploads)
+    except IntegrityError:
+        # some uploads were created concurrently, e.g. by an activity
+        # received during the scan, we fallback to one insert per upload
+        # (post_save handles availability and counters in this case)
+        created = []
+        for upload in uploads:
+            upload.pk = None
+            try:
+                with transaction.atomic():
+                    upload.save()
+            except IntegrityError:
+                continue
+            created.append(upload)
+        return len(existing) + len(created)
+
+    # the bulk insert bypasses the post_save signal
+    models.record_bulk_import_status_change(uploads, created=True)
+    for track_id in set([upload.track_id for upload in uploads]):
+        models.update_track_availability(track_id, library.pk)
+    return len(existing) + len(uploads)
+
+
+@celery.app.task(name="music.flush_accessed_dates")
+def flush_accessed_dates():
+    return access.flush_all()
+
+
+@celery.app.task(name="music.clean_transcoding_cache")
+def clean_transcoding_cache():
+    max_size = preferences.get("music__transcoding_cache_size")
+    if not max_size or max_size < 1:
+        return  # cache size limit disabled
+    # ensure we evict versions based on up-to-date data
+    access.flush(models.UploadVersion)
+    max_size = max_size * 1024 * 1024
+    versions = models.UploadVersion.objects.all()
+    total = versions.aggregate(total=Sum("size"))["total"] or 0
+    if total <= max_size:
+        return
 
-    next_page = data.get("next")
-    fetch_next = next_page and next_page != page_url
+    # we evict the least recently played versions first
+    candidates = versions.order_by(
+        F("accessed_date").asc(nulls_first=True), "creation_date"
+    ).values_list("pk", "size")
+    to_delete = []
+    for pk, size in candidates.iterator():
+        if total <= max_size:
+            break
+        to_delete.append(pk)
+        total -= size
 
-    if not fetch_next:
-        update_fields.append("status")
-        library_scan.status = "finished"
-    library_scan.save(update_fields=update_fields)
+    logger.info("Deleting %s transcoded versions from cache", len(to_delete))
+    for version in models.UploadVersion.objects.filter(pk__in=to_delete):
+        version.audio_file.delete(save=False)
+        version.delete()
 
-    if fetch_next:
-        scan_library_page.delay(library_scan_id=library_scan.pk, page_url=next_page)
+
+UPLOAD_SESSIONS_MAX_AGE = datetime.timedelta(days=1)
+
+
+@celery.app.task(name="music.clean_upload_sessions")
+def clean_upload_sessions():
+    """
+    Delete the chunked uploads that were abandoned by the client.
+    """
+    limit = timezone.now() - UPLOAD_SESSIONS_MAX_AGE
+    sessions = models.UploadSession.objects.filter(modification_date__lt=limit)
+    count = 0
+    for session in sessions:
+        session.delete_chunks()
+        session.delete()
+        count += 1
+    logger.info("Deleted %s abandoned upload sessions", count)
+    return count
+
+
+@celery.app.task(name="music.finalize_upload_session")
+@celery.require_instance(
+    models.UploadSession.objects.filter(status="finalizing").select_related(
+        "library__actor"
+    ),
+    "upload_session",
+)
+def finalize_upload_session(upload_session):
+    """
+    Assemble the chunks of a complete upload session in a new upload,
+    and import it.
+    """
+    try:
+        upload = upload_session.create_upload()
+    except Exception:
+        logger.exception("Cannot assemble upload session %s", upload_session.uuid)
+        upload_session.status = "errored"
+        upload_session.save(update_fields=["status"])
+        return
+    process_upload.delay(upload_id=upload.pk)
+
+
+COVERS_PENDING_KEY = "music:covers:pending"
+COVERS_SCHEDULED_KEY = "music:covers:scheduled"
+COVERS_BATCH_SIZE = 50
+# albums saved during this delay, e.g. during an import, share the same task
+COVERS_DELAY = 10
+
+
+def schedule_album_covers_warming(album_ids):
+    """
+    Queue the covers of the given albums for renditions generation.
+    """
+    try:
+        get_redis_connection("default").sadd(COVERS_PENDING_KEY, *album_ids)
+    except Exception:
+        # renditions can still be created with the create_image_variations script
+        logger.exception("Cannot queue album covers for warming")
+        return
+    if cache.add(COVERS_SCHEDULED_KEY, True, COVERS_DELAY * 6):
+        common_utils.on_commit(warm_album_covers.apply_async, countdown=COVERS_DELAY)
+
+
+def pop_pending_album_covers(connection, count):
+    """
+    Remove up to count albums from the pending ones and return their ids.
+    SPOP is atomic, so concurrent tasks never process the same albums.
+    """
+    # our version of redis-py cannot pop several members at once
+    pipeline = connection.pipeline()
+    for _ in range(count):
+        pipeline.spop(COVERS_PENDING_KEY)
+    return [int(i) for i in pipeline.execute() if i is not None]
+
+
+@celery.app.task(name="music.warm_album_covers")
+def warm_album_covers():
+    connection = get_redis_connection("default")
+    # albums saved from now on will be handled by another task
+    cache.delete(COVERS_SCHEDULED_KEY)
+    total_created = 0
+    total_failed = 0
+    while True:
+        ids = pop_pending_album_covers(connection, COVERS_BATCH_SIZE)
+        if not ids:
+            break
+        created, failed = images.warm(
+            models.Album.objects.filter(pk__in=ids), "cover", "square"
+        )
+        total_created += created
+        total_failed += failed
+        logger.info(
+            "Warmed %s album covers, %s renditions created, %s failed, %s remaining",
+            len(ids),
+            created,
+            failed,
+            connection.scard(COVERS_PENDING_KEY),
+        )
+    return {"created": total_created, "failed": total_failed}
+
+
+# in case a prefetch task dies without releasing its slot
+PREFETCH_SLOT_TIMEOUT = 60 * 10
+
+
+def get_prefetch_slots_key(user_id):
+    return "music:prefetch:slots:{}".format(user_id)
+
+
+def acquire_prefetch_slot(user_id):
+    key = get_prefetch_slots_key(user_id)
+    max_downloads = preferences.get("music__prefetch_max_downloads_per_user")
+    cache.add(key, 0, PREFETCH_SLOT_TIMEOUT)
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        # the key expired in the meantime
+        return False
+    if current > max_downloads:
+        cache.decr(key)
+        return False
+    return True
+
+
+def release_prefetch_slot(user_id):
+    try:
+        cache.decr(get_prefetch_slots_key(user_id))
+    except ValueError:
+        pass
+
+
+def consume_prefetch_budget(size):
+    """
+    Account the given amount of bytes in the current hour budget, and return
+    False if the budget is exhausted.
+    """
+    budget = preferences.get("music__prefetch_hourly_budget") * 1024 * 1024
+    key = "music:prefetch:budget:{}".format(timezone.now().strftime("%Y%m%d%H"))
+    cache.add(key, 0, 3600)
+    try:
+        consumed = cache.incr(key, size)
+    except ValueError:
+        return False
+    if consumed > budget:
+        cache.decr(key, size)
+        return False
+    return True
+
+
+def get_upload_to_prefetch(track_id, actor):
+    upload = (
+        models.Upload.objects.filter(track_id=track_id)
+        .playable_by(actor)
+        .order_by(F("audio_file").desc(nulls_last=True))
+        .first()
+    )
+    if not upload or upload.audio_file:
+        # nothing to play, or already in cache
+        return
+    if not upload.source or not upload.source.startswith(("http://", "https://")):
+        return
+    return upload
+
+
+@celery.app.task(name="music.prefetch_tracks")
+@celery.require_instance(users_models.User.objects.select_related("actor"), "user")
+def prefetch_tracks(user, track_ids):
+    """
+    Warm the federation cache for the upcoming tracks of a user's queue,
+    within the per-user and global limits.
+    """
+    count = preferences.get("music__prefetch_count")
+    if count < 1 or not user.actor:
+        return
+    for track_id in track_ids[:count]:
+        upload = get_upload_to_prefetch(track_id, user.actor)
+        if not upload:
+            continue
+        if not upload.size:
+            # the download cannot be accounted in the budget
+            logger.debug("[Prefetch] Unknown size for upload %s", upload.pk)
+            continue
+        if not acquire_prefetch_slot(user.pk):
+            logger.debug("[Prefetch] Max concurrent downloads for user %s", user.pk)
+            return
+        if not consume_prefetch_budget(upload.size):
+            release_prefetch_slot(user.pk)
+            logger.info("[Prefetch] Hourly budget exhausted")
+            return
+        prefetch_upload.delay(upload_id=upload.pk, user_id=user.pk)
+
+
+@celery.app.task(name="music.prefetch_upload")
+def prefetch_upload(upload_id, user_id):
+    try:
+        user = users_models.User.objects.select_related("actor").get(pk=user_id)
+        with transaction.atomic():
+            # same lock as the listen endpoint, only held to claim the download
+            upload = (
+                models.Upload.objects.select_for_update()
+                .select_related("track__album__artist", "track__artist")
+                .get(pk=upload_id)
+            )
+            if upload.audio_file or not remote.claim_download(upload):
+                # already cached, or being downloaded for a listener
+                return
+        # the download is shared with the listen endpoint: listeners
+        # requesting the upload meanwhile stream it from the partial file
+        download = remote.open_download(upload, user=user)
+        download.run()
+        if download.status != "finished":
+            return
+        # the file was not played yet, but we don't want it to be
+        # evicted from the cache right away
+        upload.accessed_date = timezone.now()
+        upload.save(update_fields=["accessed_date"])
+    finally:
+        release_prefetch_slot(user_id)
 
 
 def getter(data, *keys, default=None):
@@ -166,6 +627,74 @@ def fail_import(upload, error_code):
         )
 
 
+def get_upload_metadata(upload, probe):
+    """
+    Return the metadata to use when importing the given upload, merging
+    user provided data and the tags of the file itself.
+    """
+    import_metadata = upload.import_metadata or {}
+    additional_data = {}
+    if not probe:
+        # we can only rely on user proveded data
+        final_metadata = import_metadata
+    else:
+        # we use user provided data and data from the file itself
+        file_metadata = probe.all()
+        final_metadata = collections.ChainMap(
+            additional_data, import_metadata, file_metadata
+        )
+        additional_data["cover_data"] = probe.get_picture("cover_front")
+    additional_data["upload_source"] = upload.source
+    return final_metadata
+
+
+def set_audio_data(upload, probe=None):
+    if upload.duration and upload.bitrate and upload.size:
+        # audio data was already extracted, e.g. on upload
+        # or by import_files --workers
+        return
+    audio_data = upload.get_audio_data(probe=probe)
+    if audio_data:
+        upload.duration = audio_data["duration"]
+        upload.size = audio_data["size"]
+        upload.bitrate = audio_data["bitrate"]
+
+
+def mark_as_duplicate(upload, duplicates):
+    upload.import_status = "skipped"
+    upload.import_details = {
+        "code": "already_imported_in_owned_libraries",
+        "duplicates": list(duplicates),
+    }
+    upload.import_date = timezone.now()
+    upload.save(
+        update_fields=["import_details", "import_status", "import_date", "track"]
+    )
+
+
+def notify_import(upload, old_status):
+    import_metadata = upload.import_metadata or {}
+    broadcast = getter(
+        import_metadata, "funkwhale", "config", "broadcast", default=True
+    )
+    if broadcast:
+        signals.upload_import_status_updated.send(
+            old_status=old_status,
+            new_status=upload.import_status,
+            upload=upload,
+            sender=None,
+        )
+    if upload.import_status != "finished":
+        return
+    dispatch_outbox = getter(
+        import_metadata, "funkwhale", "config", "dispatch_outbox", default=True
+    )
+    if dispatch_outbox:
+        routes.outbox.dispatch(
+            {"type": "Create", "object": {"type": "Audio"}}, context={"upload": upload}
+        )
+
+
 @celery.app.task(name="music.process_upload")
 @celery.require_instance(
     models.Upload.objects.filter(import_status="pending").select_related(
@@ -174,23 +703,11 @@ def fail_import(upload, error_code):
     "upload",
 )
 def process_upload(upload):
-    import_metadata = upload.import_metadata or {}
     old_status = upload.import_status
-    audio_file = upload.get_audio_file()
     try:
-        additional_data = {}
-        if not audio_file:
-            # we can only rely on user proveded data
-            final_metadata = import_metadata
-        else:
-            # we use user provided data and data from the file itself
-            m = metadata.Metadata(audio_file)
-            file_metadata = m.all()
-            final_metadata = collections.ChainMap(
-                additional_data, import_metadata, file_metadata
-            )
-            additional_data["cover_data"] = m.get_picture("cover_front")
-        additional_data["upload_source"] = upload.source
+        # the file is parsed only once, for both tags and audio data
+        probe = upload.get_probe()
+        final_metadata = get_upload_metadata(upload, probe)
         track = get_track_from_import_metadata(final_metadata)
     except UploadImportError as e:
         return fail_import(upload, e.code)
@@ -204,15 +721,7 @@ def process_upload(upload):
     upload.track = track
 
     if owned_duplicates:
-        upload.import_status = "skipped"
-        upload.import_details = {
-            "code": "already_imported_in_owned_libraries",
-            "duplicates": list(owned_duplicates),
-        }
-        upload.import_date = timezone.now()
-        upload.save(
-            update_fields=["import_details", "import_status", "import_date", "track"]
-        )
+        mark_as_duplicate(upload, owned_duplicates)
         signals.upload_import_status_updated.send(
             old_status=old_status,
             new_status=upload.import_status,
@@ -222,11 +731,7 @@ def process_upload(upload):
         return
 
     # all is good, let's finalize the import
-    audio_data = upload.get_audio_data()
-    if audio_data:
-        upload.duration = audio_data["duration"]
-        upload.size = audio_data["size"]
-        upload.bitrate = audio_data["bitrate"]
+    set_audio_data(upload, probe)
     upload.import_status = "finished"
     upload.import_date = timezone.now()
     upload.save(
@@ -239,23 +744,187 @@ def process_upload(upload):
             "bitrate",
         ]
     )
-    broadcast = getter(
-        import_metadata, "funkwhale", "config", "broadcast", default=True
+    notify_import(upload, old_status)
+
+
+@celery.app.task(name="music.process_uploads_batch")
+def process_uploads_batch(upload_ids):
+    """
+    Import several pending uploads at once. Uploads sharing the same
+    import reference (usually, files from the same album or directory) are
+    processed together, so artists and albums are only resolved once and
+    the results are written in bulk.
+    """
+    uploads = (
+        models.Upload.objects.filter(pk__in=upload_ids, import_status="pending")
+        .select_related("library__actor__user")
+        .order_by("import_reference", "pk")
     )
-    if broadcast:
-        signals.upload_import_status_updated.send(
-            old_status=old_status,
-            new_status=upload.import_status,
-            upload=upload,
-            sender=None,
+    results = collections.Counter()
+    for reference, group in itertools.groupby(
+        uploads, key=lambda u: u.import_reference
+    ):
+        results.update(import_uploads_group(list(group)))
+    return dict(results)
+
+
+def resolve_uploads_tracks(uploads):
+    """
+    Resolve the track of each upload, sharing artists and albums between
+    uploads, and creating missing tracks in bulk. Return the uploads
+    that were resolved successfully.
+    """
+    memo = {}
+    resolved = []
+    for upload, final_metadata in uploads:
+        snapshot = dict(memo)
+        try:
+            with transaction.atomic():
+                upload.track = resolve_track_from_import_metadata(
+                    final_metadata, memo=memo
+                )
+        except Exception as e:
+            # objects created in the rolled back savepoint must not be reused
+            memo.clear()
+            memo.update(snapshot)
+            if not isinstance(e, UploadImportError):
+                logger.exception("Error while importing upload %s", upload.pk)
+            fail_import(upload, getattr(e, "code", "unknown_error"))
+            continue
+        resolved.append(upload)
+
+    new_tracks = []
+    for upload in resolved:
+        if not upload.track.pk and upload.track not in new_tracks:
+            upload.track.fid = upload.track.get_federation_id()
+            new_tracks.append(upload.track)
+    created = dict(zip([id(t) for t in new_tracks], create_tracks(new_tracks)))
+    for upload in resolved:
+        # refresh the foreign key now that new tracks have a primary key
+        upload.track = created.get(id(upload.track), upload.track)
+    return resolved
+
+
+def create_tracks(tracks):
+    """
+    Insert the given unsaved tracks in bulk. If another import created some
+    of them in the meantime, fallback to one insert per track, reusing the
+    existing ones. Return the saved tracks, in the same order.
+    """
+    try:
+        with transaction.atomic():
+            return models.Track.objects.bulk_create(tracks)
+    except IntegrityError:
+        pass
+    return [get_or_create_track(track) for track in tracks]
+
+
+def get_or_create_track(track):
+    query = Q(fid=track.fid)
+    if track.mbid:
+        query |= Q(mbid=track.mbid)
+    existing = models.Track.objects.filter(query).first()
+    if existing:
+        return existing
+    try:
+        with transaction.atomic():
+            track.save()
+    except IntegrityError:
+        return models.Track.objects.filter(query).first()
+    return track
+
+
+def get_batch_duplicates(uploads):
+    """
+    Return a {upload: [duplicates uuids]} dict for the uploads whose track is
+    already owned by the same actor, either before the import or because of
+    an upload earlier in the batch.
+    """
+    existing = models.Upload.objects.filter(
+        track__in=set([u.track_id for u in uploads]),
+        library__actor__in=set([u.library.actor_id for u in uploads]),
+    ).exclude(pk__in=[u.pk for u in uploads])
+    owned = collections.defaultdict(list)
+    for track_id, actor_id, uuid in existing.values_list(
+        "track_id", "library__actor_id", "uuid"
+    ):
+        owned[(track_id, actor_id)].append(uuid)
+
+    duplicates = {}
+    for upload in uploads:
+        key = (upload.track_id, upload.library.actor_id)
+        if owned[key]:
+            duplicates[upload] = list(owned[key])
+        else:
+            owned[key].append(upload.uuid)
+    return duplicates
+
+
+def finalize_uploads(uploads):
+    """
+    Mark the given uploads as finished with a single UPDATE query.
+    """
+    if not uploads:
+        return
+    now = timezone.now()
+
+    def case(field, output_field):
+        return Case(
+            *[When(pk=u.pk, then=Value(getattr(u, field))) for u in uploads],
+            output_field=output_field
         )
-    dispatch_outbox = getter(
-        import_metadata, "funkwhale", "config", "dispatch_outbox", default=True
+
+    models.Upload.objects.filter(pk__in=[u.pk for u in uploads]).update(
+        import_status="finished",
+        import_date=now,
+        track_id=case("track_id", IntegerField()),
+        size=case("size", IntegerField()),
+        duration=case("duration", IntegerField()),
+        bitrate=case("bitrate", IntegerField()),
     )
-    if dispatch_outbox:
-        routes.outbox.dispatch(
-            {"type": "Create", "object": {"type": "Audio"}}, context={"upload": upload}
-        )
+    for upload in uploads:
+        upload.import_status = "finished"
+        upload.import_date = now
+
+    # the bulk update bypasses the post_save signal
+    models.record_bulk_import_status_change(uploads)
+    for track_id, library_id in set([(u.track_id, u.library_id) for u in uploads]):
+        models.update_track_availability(track_id, library_id)
+
+
+def import_uploads_group(uploads):
+    with_metadata = []
+    probes = {}
+    for upload in uploads:
+        try:
+            probes[upload.pk] = upload.get_probe()
+            with_metadata.append(
+                (upload, get_upload_metadata(upload, probes[upload.pk]))
+            )
+        except Exception:
+            logger.exception("Cannot read metadata of upload %s", upload.pk)
+            fail_import(upload, "unknown_error")
+
+    with transaction.atomic():
+        resolved = resolve_uploads_tracks(with_metadata)
+        duplicates = get_batch_duplicates(resolved)
+        finished = []
+        for upload in resolved:
+            if upload in duplicates:
+                mark_as_duplicate(upload, duplicates[upload])
+                continue
+            set_audio_data(upload, probes[upload.pk])
+            finished.append(upload)
+        finalize_uploads(finished)
+
+    for upload in resolved:
+        notify_import(upload, old_status="pending")
+
+    return {
+        "finished": len(finished),
+        "skipped": len(duplicates),
+        "errored": len(uploads) - len(resolved),
+    }
 
 
 def federation_audio_track_to_metadata(payload):
@@ -363,8 +1032,37 @@ def sort_candidates(candidates, important_fields):
     return [c for c, s in reversed(sorted(candidates_with_scores, key=lambda v: v[1]))]
 
 
+def get_memoized_candidate_or_create(memo, key, model, query, defaults):
+    """
+    Like get_best_candidate_or_create, but reuse the object found previously
+    for the same key, if a memo dict is provided.
+    """
+    if memo is not None and key in memo:
+        return memo[key]
+    obj = get_best_candidate_or_create(
+        model, query, defaults=defaults, sort_fields=["mbid", "fid"]
+    )[0]
+    if memo is not None:
+        memo[key] = obj
+    return obj
+
+
 @transaction.atomic
 def get_track_from_import_metadata(data):
+    track = resolve_track_from_import_metadata(data)
+    if not track.pk:
+        track.save()
+    return track
+
+
+def resolve_track_from_import_metadata(data, memo=None):
+    """
+    Like get_track_from_import_metadata, but return an unsaved track if no
+    matching track exists yet, so the caller can create tracks in bulk.
+
+    When importing several uploads, a memo dict can be shared between calls
+    to avoid looking up the same artists and albums again.
+    """
     track_uuid = getter(data, "funkwhale", "track", "uuid")
 
     if track_uuid:
@@ -424,9 +1122,13 @@ def get_track_from_import_metadata(data):
     if data.get("artist_fdate"):
         defaults["creation_date"] = data.get("artist_fdate")
 
-    artist = get_best_candidate_or_create(
-        models.Artist, query, defaults=defaults, sort_fields=["mbid", "fid"]
-    )[0]
+    artist = get_memoized_candidate_or_create(
+        memo,
+        ("artist", artist_name.lower(), artist_mbid, artist_fid),
+        models.Artist,
+        query,
+        defaults,
+    )
 
     album_artist_name = data.get("album_artist") or artist_name
     if album_artist_name == artist_name:
@@ -448,9 +1150,13 @@ def get_track_from_import_metadata(data):
         if data.get("album_artist_fdate"):
             defaults["creation_date"] = data.get("album_artist_fdate")
 
-        album_artist = get_best_candidate_or_create(
-            models.Artist, query, defaults=defaults, sort_fields=["mbid", "fid"]
-        )[0]
+        album_artist = get_memoized_candidate_or_create(
+            memo,
+            ("artist", album_artist_name.lower(), album_artist_mbid, album_artist_fid),
+            models.Artist,
+            query,
+            defaults,
+        )
 
     # get / create album
     album_title = data["album"]
@@ -471,9 +1177,13 @@ def get_track_from_import_metadata(data):
     if data.get("album_fdate"):
         defaults["creation_date"] = data.get("album_fdate")
 
-    album = get_best_candidate_or_create(
-        models.Album, query, defaults=defaults, sort_fields=["mbid", "fid"]
-    )[0]
+    album = get_memoized_candidate_or_create(
+        memo,
+        ("album", album_title.lower(), album_artist.pk, album_mbid, album_fid),
+        models.Album,
+        query,
+        defaults,
+    )
     if not album.cover:
         update_album_cover(
             album, source=data.get("upload_source"), cover_data=data.get("cover_data")
@@ -499,10 +1209,13 @@ def get_track_from_import_metadata(data):
     if data.get("fdate"):
         defaults["creation_date"] = data.get("fdate")
 
-    track = get_best_candidate_or_create(
-        models.Track, query, defaults=defaults, sort_fields=["mbid", "fid"]
-    )[0]
-
+    key = ("track", track_title.lower(), artist.pk, album.pk, track_mbid, track_fid)
+    if memo is not None and key in memo:
+        return memo[key]
+    candidates = sort_candidates(models.Track.objects.filter(query), ["mbid", "fid"])
+    track = candidates[0] if candidates else models.Track(**defaults)
+    if memo is not None:
+        memo[key] = track
     return track
 
 
@@ -1,5 +1,8 @@
+import hashlib
 import mimetypes
+import tempfile
 
+import ffmpeg
 import magic
 import mutagen
 
@@ -49,6 +52,54 @@ def get_type_from_ext(extension):
     return EXTENSION_TO_MIMETYPE.get(extension)
 
 
+# formats we can transcode to, with the corresponding ffmpeg muxer and codec,
+# and the mimetype of the resulting files. Those mimetypes are only used for
+# transcoded versions, and not to detect the type of imported files
+TRANSCODING_FORMATS = {
+    "mp3": {"format": "mp3", "acodec": "libmp3lame", "mimetype": "audio/mpeg"},
+    "ogg": {"format": "ogg", "acodec": "libvorbis", "mimetype": "audio/ogg"},
+    "opus": {"format": "opus", "acodec": "libopus", "mimetype": "audio/opus"},
+}
+TRANSCODING_MIMETYPE_TO_EXTENSION = {
+    conf["mimetype"]: ext for ext, conf in TRANSCODING_FORMATS.items()
+}
+# we only produce renditions at those bitrates, to keep the number of
+# cached versions per upload bounded
+TRANSCODING_BITRATES = [64000, 96000, 128000, 192000, 256000, 320000]
+
+
+def get_transcoding_bitrate(max_bitrate=None, original_bitrate=None):
+    """
+    Return the highest supported bitrate that is lower or equal to both
+    the requested and original bitrate.
+    """
+    limits = [b for b in [max_bitrate, original_bitrate] if b]
+    limit = min(limits) if limits else TRANSCODING_BITRATES[-1]
+    candidates = [b for b in TRANSCODING_BITRATES if b <= limit]
+    if not candidates:
+        return TRANSCODING_BITRATES[0]
+    return candidates[-1]
+
+
+def transcode_file(input_path, output_format, bitrate):
+    """
+    Transcode the file at input_path using ffmpeg, and return an open
+    temporary file containing the result.
+    """
+    conf = TRANSCODING_FORMATS[output_format]
+    output = tempfile.NamedTemporaryFile(suffix=".{}".format(output_format))
+    stream = ffmpeg.input(input_path).output(
+        output.name,
+        format=conf["format"],
+        acodec=conf["acodec"],
+        vn=None,
+        **{"b:a": str(bitrate)}
+    )
+    stream.run(overwrite_output=True)
+    output.seek(0)
+    return output
+
+
 def get_audio_file_data(f):
     data = mutagen.File(f)
     if not data:
@@ -60,6 +111,21 @@ def get_audio_file_data(f):
     return d
 
 
+def get_file_checksum(f):
+    """
+    Return the sha256 checksum of the given file, read by chunks. The checksum
+    computed while receiving uploaded files is reused when available.
+    """
+    checksum = getattr(f, "checksum", None)
+    if checksum:
+        return checksum
+    sha = hashlib.sha256()
+    for chunk in f.chunks():
+        sha.update(chunk)
+    f.seek(0)
+    return sha.hexdigest()
+
+
 def get_actor_from_request(request):
     actor = None
     if hasattr(request, "actor"):
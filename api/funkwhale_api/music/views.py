@@ -1,7 +1,11 @@
 import logging
+import os
+import re
+import tempfile
 import urllib
 
 from django.conf import settings
+from django.core.files import File
 from django.db import transaction
 from django.db.models import Count, Prefetch, Sum, F, Q
 from django.db.models.functions import Length
@@ -17,11 +21,13 @@ from taggit.models import Tag
 
 from funkwhale_api.common import utils as common_utils
 from funkwhale_api.common import permissions as common_permissions
+from funkwhale_api.common import preferences
+from funkwhale_api.common import streaming
 from funkwhale_api.federation.authentication import SignatureAuthentication
 from funkwhale_api.federation import api_serializers as federation_api_serializers
 from funkwhale_api.federation import routes
 
-from . import filters, models, serializers, tasks, utils
+from . import access, filters, models, remote, serializers, tasks, utils
 
 logger = logging.getLogger(__name__)
 
@@ -267,18 +273,77 @@ def get_file_path(audio_file):
         return path.encode("utf-8")
 
 
-def handle_serve(upload, user):
+def should_transcode(upload, format, max_bitrate=None):
+    if not preferences.get("music__transcoding_enabled"):
+        return False
+    if format is None and max_bitrate is None:
+        return False
+    if format is not None and format not in utils.TRANSCODING_FORMATS:
+        # unsupported format, we serve the original file
+        return False
+    if not upload.mimetype:
+        # we cannot compare formats, so we don't transcode
+        return False
+
+    format_need_transcoding = (
+        format is not None
+        and upload.mimetype != utils.TRANSCODING_FORMATS[format]["mimetype"]
+    )
+    bitrate_need_transcoding = bool(
+        max_bitrate and upload.bitrate and upload.bitrate > max_bitrate
+    )
+    return format_need_transcoding or bitrate_need_transcoding
+
+
+def get_transcoding_format(upload, format=None):
+    if format:
+        return format
+    # only the bitrate was requested, we try to keep the original format
+    extension = utils.get_ext_from_type(upload.mimetype)
+    if extension in utils.TRANSCODING_FORMATS:
+        return extension
+    return "mp3"
+
+
+def get_transcoded_version(upload, format, max_bitrate=None):
+    with transaction.atomic():
+        # same as for remote files, we lock the upload to ensure concurrent
+        # requests for the same rendition do not transcode the file twice
+        upload = upload.__class__.objects.select_for_update().get(pk=upload.pk)
+        version = upload.get_transcoded_version(format, max_bitrate=max_bitrate)
+    access.record_access(version)
+    return version
+
+
+def open_file(audio_file):
+    """
+    Given a storage file or an in-place path, return an open file
+    and its size, for serving without a reverse proxy.
+    """
+    try:
+        return audio_file.storage.open(audio_file.name, "rb"), audio_file.size
+    except AttributeError:
+        # a path was given
+        return open(audio_file, "rb"), os.path.getsize(audio_file)
+
+
+def handle_serve(upload, user, format=None, max_bitrate=None, request=None):
     f = upload
-    # we update the accessed_date
-    f.accessed_date = timezone.now()
-    f.save(update_fields=["accessed_date"])
+    # the accessed_date is written to the database later, in bulk
+    access.record_access(f)
 
     if f.audio_file:
-        file_path = get_file_path(f.audio_file)
+        audio_file = f.audio_file
 
     elif f.source and (
         f.source.startswith("http://") or f.source.startswith("https://")
     ):
+        if not should_transcode(f, format, max_bitrate=max_bitrate):
+            # we forward the bytes to the client while the file is downloaded
+            # in the cache, instead of waiting for the whole download
+            response = remote.stream_upload(f, user=user, request=request)
+            if response:
+                return set_attachment_headers(response, f.filename, f.mimetype)
         # we need to populate from cache
         with transaction.atomic():
             # why the transaction/select_for_update?
@@ -287,29 +352,44 @@ def handle_serve(upload, user):
             # thus resulting in multiple downloads from the remote
             qs = f.__class__.objects.select_for_update()
             f = qs.get(pk=f.pk)
-            f.download_audio_from_remote(user=user)
-        data = f.get_audio_data()
-        if data:
-            f.duration = data["duration"]
-            f.size = data["size"]
-            f.bitrate = data["bitrate"]
-            f.save(update_fields=["bitrate", "duration", "size"])
-        file_path = get_file_path(f.audio_file)
+            if not f.audio_file:
+                # the file may have been cached by a concurrent request
+                f.download_audio_from_remote(user=user)
+        f.update_audio_data()
+        audio_file = f.audio_file
     elif f.source and f.source.startswith("file://"):
-        file_path = get_file_path(f.source.replace("file://", "", 1))
+        audio_file = f.source.replace("file://", "", 1)
     mt = f.mimetype
-    if mt:
-        response = Response(content_type=mt)
-    else:
-        response = Response()
     filename = f.filename
-    mapping = {"nginx": "X-Accel-Redirect", "apache2": "X-Sendfile"}
-    file_header = mapping[settings.REVERSE_PROXY_TYPE]
-    response[file_header] = file_path
+
+    if should_transcode(f, format, max_bitrate=max_bitrate):
+        version = get_transcoded_version(
+            f, get_transcoding_format(f, format), max_bitrate=max_bitrate
+        )
+        audio_file = version.audio_file
+        mt = version.mimetype
+        filename = version.filename
+
+    if settings.REVERSE_PROXY_TYPE == "none":
+        # no reverse proxy to offload the transfer, we stream the file ourselves
+        file_obj, size = open_file(audio_file)
+        response = streaming.serve_file(request, file_obj, size, content_type=mt)
+    else:
+        if mt:
+            response = Response(content_type=mt)
+        else:
+            response = Response()
+        mapping = {"nginx": "X-Accel-Redirect", "apache2": "X-Sendfile"}
+        file_header = mapping[settings.REVERSE_PROXY_TYPE]
+        response[file_header] = get_file_path(audio_file)
+    return set_attachment_headers(response, filename, mt)
+
+
+def set_attachment_headers(response, filename, mimetype=None):
     filename = "filename*=UTF-8''{}".format(urllib.parse.quote(filename))
     response["Content-Disposition"] = "attachment; {}".format(filename)
-    if mt:
-        response["Content-Type"] = mt
+    if mimetype:
+        response["Content-Type"] = mimetype
 
     return response
 
@@ -337,7 +417,21 @@ class ListenViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         if not upload:
             return Response(status=404)
 
-        return handle_serve(upload, user=request.user)
+        format = request.GET.get("to")
+        max_bitrate = request.GET.get("max_bitrate")
+        try:
+            # bitrate is given in kbps
+            max_bitrate = int(max_bitrate) * 1000 if max_bitrate else None
+        except ValueError:
+            max_bitrate = None
+
+        return handle_serve(
+            upload,
+            user=request.user,
+            format=format,
+            max_bitrate=max_bitrate,
+            request=request,
+        )
 
 
 class UploadViewSet(
@@ -381,6 +475,24 @@ class UploadViewSet(
         result = serializer.save()
         return Response(result, status=200)
 
+    @list_route(methods=["get"], url_path="import-summary")
+    def import_summary(self, request, *args, **kwargs):
+        """
+        Number of uploads in each import status for the given import
+        reference, across all the libraries of the user.
+        """
+        import_reference = request.GET.get("import_reference")
+        if not import_reference:
+            return Response(
+                {"import_reference": ["This field is required."]}, status=400
+            )
+        statuses = [status for status, _ in models.TRACK_FILE_IMPORT_STATUS_CHOICES]
+        aggregates = {status: Sum("{}_count".format(status)) for status in statuses}
+        counts = models.UploadImportSummary.objects.filter(
+            library__actor=request.user.actor, import_reference=import_reference
+        ).aggregate(**aggregates)
+        return Response({status: counts[status] or 0 for status in statuses})
+
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context["user"] = self.request.user
@@ -399,6 +511,125 @@ class UploadViewSet(
         instance.delete()
 
 
+CONTENT_RANGE_REGEX = re.compile(r"^bytes (?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+)$")
+MAX_CHUNK_SIZE = 50 * 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def read_chunk(stream, length):
+    """
+    Read at most length bytes from the request body, spooling them
+    to disk instead of keeping large chunks in memory.
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    remaining = length
+    while remaining > 0:
+        data = stream.read(min(remaining, READ_BLOCK_SIZE))
+        if not data:
+            break
+        f.write(data)
+        remaining -= len(data)
+    content = File(f)
+    content.size = f.tell()
+    f.seek(0)
+    return content
+
+
+class UploadSessionViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin,
+    viewsets.GenericViewSet,
+):
+    """
+    Resumable upload of large audio files, in several requests:
+
+    - POST /api/v1/uploads/sessions/ with the library, filename and size
+      of the file creates a session, if the user has enough quota left
+    - PUT /api/v1/uploads/sessions/<uuid>/ with a Content-Range header sends
+      the next chunk of the file
+    - GET /api/v1/uploads/sessions/<uuid>/ returns the offset of the next chunk
+      to send, to resume an interrupted upload
+    - POST /api/v1/uploads/sessions/<uuid>/finalize/ creates and imports
+      the upload in the background once the whole file was sent. The
+      session status is "finished" and references the upload when done
+    """
+
+    lookup_field = "uuid"
+    queryset = models.UploadSession.objects.all().select_related("library")
+    serializer_class = serializers.UploadSessionSerializer
+    permission_classes = [
+        permissions.IsAuthenticated,
+        common_permissions.OwnerPermission,
+    ]
+    owner_field = "library.actor.user"
+    owner_checks = ["read", "write"]
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action in ["update", "finalize"]:
+            # concurrent requests on the same session are processed one by one
+            qs = qs.select_for_update()
+        return qs.filter(library__actor=self.request.user.actor)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["user"] = self.request.user
+        return context
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.status not in ["receiving", "errored"]:
+            return Response({"detail": "The session is already finalized"}, status=409)
+        match = CONTENT_RANGE_REGEX.match(request.META.get("HTTP_CONTENT_RANGE", ""))
+        if not match:
+            return Response(
+                {"detail": "Missing or invalid Content-Range header"}, status=400
+            )
+        start, end, total = [int(v) for v in match.group("start", "end", "total")]
+        if total != session.size or end < start or end >= total:
+            return Response({"detail": "Invalid Content-Range header"}, status=400)
+        if start != session.received:
+            # e.g. a chunk sent again after a connection drop
+            return Response(
+                {"detail": "Unexpected chunk offset", "offset": session.received},
+                status=409,
+            )
+        length = end - start + 1
+        if length > MAX_CHUNK_SIZE:
+            return Response(
+                {"detail": "Chunks cannot exceed {} bytes".format(MAX_CHUNK_SIZE)},
+                status=413,
+            )
+        content = read_chunk(request.stream, length) if request.stream else None
+        if not content or content.size != length:
+            return Response({"detail": "Incomplete chunk"}, status=400)
+        session.add_chunk(content)
+        return Response(self.get_serializer(session).data)
+
+    @detail_route(methods=["post"])
+    def finalize(self, request, *args, **kwargs):
+        session = self.get_object()
+        if session.received < session.size:
+            return Response(
+                {"detail": "The file is incomplete", "offset": session.received},
+                status=400,
+            )
+        if session.status not in ["receiving", "errored"]:
+            return Response({"detail": "The session is already finalized"}, status=409)
+        session.status = "finalizing"
+        session.modification_date = timezone.now()
+        session.save(update_fields=["status", "modification_date"])
+        common_utils.on_commit(
+            tasks.finalize_upload_session.delay, upload_session_id=session.pk
+        )
+        return Response(self.get_serializer(session).data, status=202)
+
+    def perform_destroy(self, instance):
+        instance.delete_chunks()
+        instance.delete()
+
+
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all().order_by("name")
     serializer_class = serializers.TagSerializer
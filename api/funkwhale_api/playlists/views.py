@@ -5,7 +5,9 @@ from rest_framework.decorators import detail_route
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 
-from funkwhale_api.common import fields, permissions
+from funkwhale_api.common import fields, permissions, preferences
+from funkwhale_api.common import utils as common_utils
+from funkwhale_api.music import tasks as music_tasks
 from funkwhale_api.music import utils as music_utils
 from . import filters, models, serializers
 
@@ -44,6 +46,22 @@ class PlaylistViewSet(
         )
         serializer = serializers.PlaylistTrackSerializer(plts, many=True)
         data = {"count": len(plts), "results": serializer.data}
+        if request.GET.get("prefetch") == "true" and request.user.is_authenticated:
+            # the playlist is about to be played from the given position:
+            # the current track is fetched by the listen endpoint, we warm
+            # the cache for the ones after it
+            try:
+                position = max(int(request.GET.get("position", 0)), 0)
+            except ValueError:
+                position = 0
+            count = preferences.get("music__prefetch_count")
+            upcoming = plts[position + 1 : position + 1 + count]
+            if upcoming:
+                common_utils.on_commit(
+                    music_tasks.prefetch_tracks.delay,
+                    user_id=request.user.pk,
+                    track_ids=[plt.track_id for plt in upcoming],
+                )
         return Response(data, status=200)
 
     @detail_route(methods=["post"])
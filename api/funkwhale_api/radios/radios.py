@@ -1,5 +1,6 @@
 import random
 
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db.models import Count
 from rest_framework import serializers
@@ -11,6 +12,9 @@ from funkwhale_api.users.models import User
 from . import filters, models
 from .registries import registry
 
+# how long the tracks picked in advance for a session are remembered
+UPCOMING_CACHE_TIMEOUT = 3600
+
 
 class SimpleRadio(object):
     def clean(self, instance):
@@ -76,6 +80,37 @@ class SessionRadio(SimpleRadio):
                 self.session.add(choice)
         return picked_choices
 
+    def get_upcoming_cache_key(self):
+        return "radios:upcoming:{}".format(self.session.pk)
+
+    def pick_next(self, upcoming_count=0, **kwargs):
+        """
+        Pick the next track of the session, as well as up to upcoming_count
+        tracks that should follow it, so their files can be fetched
+        beforehand. Those upcoming tracks are remembered and served,
+        in order, on the next calls.
+
+        Returns the picked track and the ids of the upcoming tracks.
+        """
+        choices = self.get_choices(**kwargs)
+        key = self.get_upcoming_cache_key()
+        upcoming = cache.get(key) or []
+        # upcoming tracks may have been played or become unplayable meanwhile
+        available = set(choices.filter(pk__in=upcoming).values_list("pk", flat=True))
+        upcoming = [pk for pk in upcoming if pk in available][: upcoming_count + 1]
+        missing = upcoming_count + 1 - len(upcoming)
+        if missing > 0:
+            candidates = choices.exclude(pk__in=upcoming).values_list("pk", flat=True)
+            upcoming += super().pick_many(
+                choices=candidates, quantity=min(missing, len(candidates))
+            )
+        if not upcoming:
+            raise ValueError("No more tracks to pick")
+        track = Track.objects.get(pk=upcoming.pop(0))
+        self.session.add(track)
+        cache.set(key, upcoming, UPCOMING_CACHE_TIMEOUT)
+        return track, upcoming
+
     def validate_session(self, data, **context):
         return data
 
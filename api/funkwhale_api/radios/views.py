@@ -4,6 +4,9 @@ from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 
 from funkwhale_api.common import permissions as common_permissions
+from funkwhale_api.common import preferences
+from funkwhale_api.common import utils as common_utils
+from funkwhale_api.music import tasks as music_tasks
 from funkwhale_api.music.serializers import TrackSerializer
 
 from . import filters, filtersets, models, serializers
@@ -105,8 +108,18 @@ class RadioSessionTrackViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet)
             assert request.user == session.user
         except AssertionError:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        session.radio.pick()
+        _, upcoming = session.radio.pick_next(
+            upcoming_count=preferences.get("music__prefetch_count")
+        )
         session_track = session.session_tracks.all().latest("id")
+        if upcoming:
+            # the tracks after the picked one are already chosen,
+            # so we warm the cache for them
+            common_utils.on_commit(
+                music_tasks.prefetch_tracks.delay,
+                user_id=request.user.pk,
+                track_ids=upcoming,
+            )
         # self.perform_create(serializer)
         # dirty override here, since we use a different serializer for creation and detail
         serializer = self.serializer_class(
@@ -9,7 +9,7 @@ from rest_framework.decorators import list_route
 from rest_framework.serializers import ValidationError
 
 from funkwhale_api.activity import record
-from funkwhale_api.common import preferences
+from funkwhale_api.common import preferences, streaming
 from funkwhale_api.favorites.models import TrackFavorite
 from funkwhale_api.music import models as music_models
 from funkwhale_api.music import utils
@@ -194,7 +194,9 @@ class SubsonicViewSet(viewsets.GenericViewSet):
         upload = queryset.first()
         if not upload:
             return response.Response(status=404)
-        return music_views.handle_serve(upload=upload, user=request.user)
+        return music_views.handle_serve(
+            upload=upload, user=request.user, request=request
+        )
 
     @list_route(methods=["get", "post"], url_name="star", url_path="star")
     @find_object(music_models.Track.objects.all())
@@ -464,6 +466,10 @@ class SubsonicViewSet(viewsets.GenericViewSet):
                 {"error": {"code": 70, "message": "cover art not found."}}
             )
 
+        if settings.REVERSE_PROXY_TYPE == "none":
+            file_obj, size = music_views.open_file(cover)
+            return streaming.serve_file(request, file_obj, size)
+
         mapping = {"nginx": "X-Accel-Redirect", "apache2": "X-Sendfile"}
         path = music_views.get_file_path(cover)
         file_header = mapping[settings.REVERSE_PROXY_TYPE]
@@ -26,6 +26,22 @@ def process_failure(sender, task_id, exception, args, kwargs, traceback, einfo,
     tb.print_exc()
 
 
+@celery.signals.worker_process_init.connect
+def reset_http_session(**kwargs):
+    from funkwhale_api.common import session
+
+    # the session inherited from the parent process must not be reused
+    session.close_session()
+
+
+@celery.signals.worker_process_shutdown.connect
+def close_http_session(**kwargs):
+    from funkwhale_api.common import session
+
+    session.log_pool_stats()
+    session.close_session()
+
+
 class CeleryConfig(AppConfig):
     name = "funkwhale_api.taskapp"
     verbose_name = "Celery Config"
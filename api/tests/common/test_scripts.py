@@ -259,3 +259,21 @@ def test_migrate_to_users_libraries_command(
 
     for part in ["followers", "following"]:
         generate_actor_urls.assert_any_call(part, command.stdout)
+
+
+def test_create_image_variations_resumes(factories, command, cache, mocker):
+    warm = mocker.patch("funkwhale_api.common.images.warm", return_value=(4, 0))
+    done, pending = factories["music.Album"].create_batch(size=2)
+    cursor_key = scripts.create_image_variations.get_cursor_key(
+        music_models.Album, "cover"
+    )
+    cache.set(cursor_key, done.pk)
+
+    scripts.create_image_variations.main(command)
+
+    album_querysets = [
+        c[0][0] for c in warm.call_args_list if c[0][0].model == music_models.Album
+    ]
+    assert len(album_querysets) == 1
+    assert list(album_querysets[0]) == [pending]
+    assert cache.get(cursor_key) is None
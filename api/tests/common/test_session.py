@@ -12,5 +12,36 @@ def test_get_user_agent(settings):
 
 
 def test_get_session():
+    session.close_session()
     expected = session.get_user_agent()
     assert session.get_session().headers["User-Agent"] == expected
+
+
+def test_get_session_is_reused():
+    assert session.get_session() is session.get_session()
+
+
+def test_get_session_rebuilt_after_fork(mocker):
+    s = session.get_session()
+    mocker.patch("os.getpid", return_value=-1)
+
+    assert session.get_session() is not s
+
+
+def test_get_session_default_timeout(settings, r_mock):
+    settings.EXTERNAL_REQUESTS_TIMEOUT = 3
+    r_mock.get("https://test.host/")
+    session.get_session().get("https://test.host/")
+
+    assert r_mock.last_request.timeout == 3
+
+
+def test_get_session_pool_settings(settings):
+    settings.EXTERNAL_REQUESTS_POOL_MAXSIZE = 7
+    settings.EXTERNAL_REQUESTS_RETRIES = 4
+    session.close_session()
+    adapter = session.get_session().get_adapter("https://test.host")
+
+    assert adapter._pool_maxsize == 7
+    assert adapter.max_retries.total == 4
+    session.close_session()
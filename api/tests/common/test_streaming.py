@@ -0,0 +1,91 @@
+import io
+
+import pytest
+
+from funkwhale_api.common import streaming
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (None, None),
+        ("", None),
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=900-5000", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        # multiple ranges are not supported, we serve the whole file
+        ("bytes=0-10,20-30", None),
+        ("items=0-10", None),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert streaming.parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=50-10", "bytes=-0"])
+def test_parse_range_header_unsatisfiable(header):
+    with pytest.raises(streaming.UnsatisfiableRange):
+        streaming.parse_range_header(header, 1000)
+
+
+def test_ranged_file():
+    f = streaming.RangedFile(io.BytesIO(b"0123456789"), 2, 5)
+
+    assert f.read(3) == b"234"
+    assert f.read(3) == b"5"
+    assert f.read() == b""
+
+
+def test_serve_file_full(api_request):
+    request = api_request.get("/")
+    response = streaming.serve_file(
+        request, io.BytesIO(b"0123456789"), 10, content_type="audio/ogg"
+    )
+
+    assert response.status_code == 200
+    assert response["Content-Length"] == "10"
+    assert response["Accept-Ranges"] == "bytes"
+    assert response["Content-Type"] == "audio/ogg"
+    assert b"".join(response.streaming_content) == b"0123456789"
+
+
+def test_serve_file_partial(api_request):
+    request = api_request.get("/", HTTP_RANGE="bytes=3-5")
+    response = streaming.serve_file(request, io.BytesIO(b"0123456789"), 10)
+
+    assert response.status_code == 206
+    assert response["Content-Length"] == "3"
+    assert response["Content-Range"] == "bytes 3-5/10"
+    assert b"".join(response.streaming_content) == b"345"
+
+
+def test_serve_file_unsatisfiable(api_request):
+    request = api_request.get("/", HTTP_RANGE="bytes=30-")
+    response = streaming.serve_file(request, io.BytesIO(b"0123456789"), 10)
+
+    assert response.status_code == 416
+    assert response["Content-Range"] == "bytes */10"
+
+
+def test_serve_file_if_range_mismatch(api_request, tmpfile):
+    tmpfile.write(b"0123456789")
+    tmpfile.flush()
+    request = api_request.get("/", HTTP_RANGE="bytes=3-5", HTTP_IF_RANGE='"nope"')
+    response = streaming.serve_file(request, open(tmpfile.name, "rb"), 10)
+
+    assert response.status_code == 200
+    assert response["ETag"] is not None
+    assert b"".join(response.streaming_content) == b"0123456789"
+
+
+def test_serve_file_if_range_match(api_request, tmpfile):
+    tmpfile.write(b"0123456789")
+    tmpfile.flush()
+    etag = streaming.serve_file(None, open(tmpfile.name, "rb"), 10)["ETag"]
+    request = api_request.get("/", HTTP_RANGE="bytes=3-5", HTTP_IF_RANGE=etag)
+    response = streaming.serve_file(request, open(tmpfile.name, "rb"), 10)
+
+    assert response.status_code == 206
+    assert b"".join(response.streaming_content) == b"345"
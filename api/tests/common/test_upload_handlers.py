@@ -0,0 +1,29 @@
+import hashlib
+
+import pytest
+
+from django.core.files.uploadhandler import StopFutureHandlers
+
+from funkwhale_api.common import upload_handlers
+
+
+@pytest.mark.parametrize(
+    "handler_class",
+    [
+        upload_handlers.ChecksumMemoryFileUploadHandler,
+        upload_handlers.ChecksumTemporaryFileUploadHandler,
+    ],
+)
+def test_upload_handler_computes_checksum(handler_class, rf):
+    handler = handler_class(rf.post("/"))
+    handler.handle_raw_input(None, {}, 11, "boundary")
+    try:
+        handler.new_file("audio_file", "test.ogg", "audio/ogg", 11)
+    except StopFutureHandlers:
+        # the memory handler takes care of small files alone
+        pass
+    handler.receive_data_chunk(b"hello ", 0)
+    handler.receive_data_chunk(b"world", 6)
+    f = handler.file_complete(11)
+
+    assert f.checksum == hashlib.sha256(b"hello world").hexdigest()
@@ -8,3 +8,8 @@ def test_chunk_queryset(factories):
 
     assert list(chunks[0]) == actors[0:2]
     assert list(chunks[1]) == actors[2:4]
+
+
+def test_batch():
+    assert list(utils.batch(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(utils.batch([], 2)) == []
@@ -23,6 +23,7 @@ from rest_framework import fields as rest_fields
 from rest_framework.test import APIClient, APIRequestFactory
 
 from funkwhale_api.activity import record
+from funkwhale_api.federation import keys
 from funkwhale_api.users.permissions import HasUserPermission
 
 
@@ -100,6 +101,15 @@ def cache():
     django_cache.clear()
 
 
+@pytest.fixture(autouse=True)
+def public_keys_cache():
+    """
+    Returns the in-memory cache of remote public keys, cleared after each test
+    """
+    yield keys.public_keys
+    keys.public_keys.clear()
+
+
 @pytest.fixture
 def factories(db):
     """
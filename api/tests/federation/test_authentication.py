@@ -38,3 +38,29 @@ def test_authenticate(factories, mocker, api_request):
     assert user.is_anonymous is True
     assert actor.public_key == public.decode("utf-8")
     assert actor.fid == actor_url
+
+
+def test_authenticate_uses_public_keys_cache(factories, mocker, api_request):
+    actor = factories["federation.Actor"]()
+    signed_request = factories["federation.SignedRequest"](
+        auth__key=actor.private_key.encode("utf-8"),
+        auth__key_id=actor.private_key_id,
+        auth__headers=["date"],
+    )
+    prepared = signed_request.prepare()
+    get_actor = mocker.spy(authentication.actors, "get_actor")
+    authenticator = authentication.SignatureAuthentication()
+
+    for i in range(2):
+        django_request = api_request.get(
+            "/",
+            **{
+                "HTTP_DATE": prepared.headers["date"],
+                "HTTP_SIGNATURE": prepared.headers["signature"],
+            }
+        )
+        authenticator.authenticate(django_request)
+        assert django_request.actor.pk == actor.pk
+
+    get_actor.assert_called_once_with(actor.fid)
+    assert keys.public_keys.get(actor.private_key_id).actor_pk == actor.pk
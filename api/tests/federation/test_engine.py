@@ -0,0 +1,65 @@
+import requests
+
+from funkwhale_api.federation import engine, signing, tasks
+
+
+def test_sign_delivery(factories):
+    delivery = factories["federation.Delivery"](
+        inbox_url="https://test.host/inbox", activity__actor__local=True
+    )
+    actor = delivery.activity.actor
+    auth = signing.get_auth(actor.private_key, actor.private_key_id)
+
+    signed = engine.sign_delivery(delivery, auth)
+
+    assert signed.delivery_id == delivery.pk
+    assert signed.url == delivery.inbox_url
+    assert signed.headers["Content-Type"] == "application/activity+json"
+    prepared = requests.Request(
+        "POST", signed.url, data=signed.body, headers=signed.headers
+    ).prepare()
+    assert signing.verify(prepared, actor.public_key.encode("utf-8")) is None
+
+
+def test_get_pending_hosts(factories, settings, cache):
+    settings.FEDERATION_DELIVERY_WORKER = True
+    factories["federation.Delivery"](inbox_url="https://pending.host/inbox")
+    factories["federation.Delivery"](
+        inbox_url="https://delivered.host/inbox", is_delivered=True
+    )
+    tasks.schedule_host_delivery("new.host")
+
+    assert engine.get_pending_hosts() == {"new.host"}
+    assert engine.get_pending_hosts() == set()
+    assert engine.get_pending_hosts(rescan=True) == {"pending.host"}
+
+
+def test_get_signed_batch(factories, now):
+    due = factories["federation.Delivery"](
+        inbox_url="https://test.host/inbox", activity__actor__local=True
+    )
+    factories["federation.Delivery"](
+        inbox_url="https://test.host/inbox", attempts=1, last_attempt_date=now
+    )
+    auths = {}
+
+    signed, cursor = engine.get_signed_batch("test.host", 0, auths)
+
+    assert [r.delivery_id for r in signed] == [due.pk]
+    assert list(auths.keys()) == [due.activity.actor.pk]
+    assert engine.get_signed_batch("test.host", cursor, auths) == ([], None)
+
+
+def test_record_results(factories, now):
+    delivered = factories["federation.Delivery"]()
+    failed = factories["federation.Delivery"]()
+
+    engine.record_results([delivered.pk], [failed.pk], now)
+    delivered.refresh_from_db()
+    failed.refresh_from_db()
+
+    assert delivered.is_delivered is True
+    assert delivered.attempts == 1
+    assert failed.is_delivered is False
+    assert failed.attempts == 1
+    assert failed.last_attempt_date == now
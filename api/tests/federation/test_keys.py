@@ -1,3 +1,4 @@
+import datetime
 import pytest
 
 from funkwhale_api.federation import keys
@@ -29,3 +30,35 @@ def test_get_key_from_header(raw, expected):
 def test_get_key_from_header_invalid(raw):
     with pytest.raises(ValueError):
         keys.get_key_id_from_signature_header(raw)
+
+
+def test_public_key_cache_lru(factories, now):
+    cache = keys.PublicKeyCache(max_size=2)
+    actors = factories["federation.Actor"].build_batch(size=3)
+    expires = now + datetime.timedelta(minutes=1)
+    cache.set("https://a/1#main-key", actors[0], "key1", expires)
+    cache.set("https://a/2#main-key", actors[1], "key2", expires)
+    # mark the first one as recently used
+    assert cache.get("https://a/1#main-key").public_key == "key1"
+    cache.set("https://a/3#main-key", actors[2], "key3", expires)
+
+    assert cache.get("https://a/2#main-key") is None
+    assert cache.get("https://a/1#main-key").actor == actors[0]
+    assert cache.get("https://a/3#main-key").public_key == "key3"
+
+
+def test_public_key_cache_expiry(factories, now):
+    cache = keys.PublicKeyCache(max_size=2)
+    actor = factories["federation.Actor"].build()
+    cache.set("https://a/1#main-key", actor, "key", now)
+
+    assert cache.get("https://a/1#main-key") is None
+
+
+def test_public_key_cache_invalidate(factories, now):
+    cache = keys.PublicKeyCache(max_size=2)
+    actor = factories["federation.Actor"].build(fid="https://a/1")
+    cache.set("https://a/1#main-key", actor, "key", now + datetime.timedelta(1))
+    cache.invalidate("https://a/1")
+
+    assert cache.get("https://a/1#main-key") is None
@@ -1,3 +1,4 @@
+import datetime
 import io
 import pytest
 import uuid
@@ -5,7 +6,7 @@ import uuid
 from django.core.paginator import Paginator
 from django.utils import timezone
 
-from funkwhale_api.federation import models, serializers, utils
+from funkwhale_api.federation import keys, models, serializers, utils
 
 
 def test_actor_serializer_from_ap(db):
@@ -921,3 +922,15 @@ def test_activity_serializer_validate_recipients_empty(db):
 
     with pytest.raises(serializers.serializers.ValidationError):
         s.validate_recipients({"cc": []})
+
+
+def test_actor_serializer_save_invalidates_public_keys_cache(factories, now):
+    actor = factories["federation.Actor"]()
+    expires = now + datetime.timedelta(minutes=1)
+    keys.public_keys.set(actor.private_key_id, actor, "key", expires)
+    serializer = serializers.ActorSerializer(actor)
+    serializer = serializers.ActorSerializer(data=serializer.data)
+    assert serializer.is_valid(raise_exception=True)
+    serializer.save()
+
+    assert keys.public_keys.get(actor.private_key_id) is None
@@ -17,6 +17,25 @@ def test_can_sign_and_verify_request(nodb_factories):
     assert signing.verify(prepared_request, public) is None
 
 
+def test_can_verify_request_with_loaded_key(nodb_factories):
+    private, public = nodb_factories["federation.KeyPair"]()
+    auth = nodb_factories["federation.SignatureAuth"](key=private)
+    request = nodb_factories["federation.SignedRequest"](auth=auth)
+    prepared_request = request.prepare()
+    public_key = keys.load_public_key(public)
+
+    assert signing.verify(prepared_request, public_key) is None
+
+
+def test_verify_with_loaded_key_fails_with_wrong_key(nodb_factories):
+    wrong_private, wrong_public = nodb_factories["federation.KeyPair"]()
+    request = nodb_factories["federation.SignedRequest"]()
+    prepared_request = request.prepare()
+
+    with pytest.raises(cryptography.exceptions.InvalidSignature):
+        signing.verify(prepared_request, keys.load_public_key(wrong_public))
+
+
 def test_can_sign_and_verify_request_digest(nodb_factories):
     private, public = nodb_factories["federation.KeyPair"]()
     auth = nodb_factories["federation.SignatureAuth"](key=private)
@@ -127,3 +146,47 @@ def test_can_verify_django_request_failure(factories, fake_request, now):
     )
     with pytest.raises(forms.ValidationError):
         signing.verify_django(django_request, public_key)
+
+
+def test_get_auth_is_cached(nodb_factories):
+    private, public = nodb_factories["federation.KeyPair"]()
+    auth = signing.get_auth(private.decode("utf-8"), "https://test.key")
+
+    assert signing.get_auth(private.decode("utf-8"), "https://test.key") is auth
+
+
+@pytest.mark.parametrize("method,data", [("get", None), ("post", b"hello=world")])
+def test_signature_auth_can_be_verified(nodb_factories, method, data):
+    private, public = nodb_factories["federation.KeyPair"]()
+    auth = signing.SignatureAuth(
+        private, key_id="https://test.key", headers=signing.SIGNED_HEADERS
+    )
+    request = nodb_factories["federation.SignedRequest"](
+        auth=auth, method=method, data=data
+    )
+    prepared_request = request.prepare()
+
+    assert signing.verify(prepared_request, public) is None
+    # the auth can be reused for other requests
+    assert auth.headers == signing.SIGNED_HEADERS
+
+
+def test_signature_auth_signature_cache(nodb_factories, mocker):
+    private, public = nodb_factories["federation.KeyPair"]()
+    auth = signing.SignatureAuth(
+        private,
+        key_id="https://test.key",
+        headers=signing.SIGNED_HEADERS,
+        signature_cache_size=10,
+    )
+    auth.key = mocker.Mock(wraps=auth.key)
+    headers = {"Date": "Mon, 08 Oct 2018 10:00:00 GMT"}
+    first = nodb_factories["federation.SignedRequest"](
+        auth=auth, url="https://test.host", headers=dict(headers)
+    ).prepare()
+    second = nodb_factories["federation.SignedRequest"](
+        auth=auth, url="https://test.host", headers=dict(headers)
+    ).prepare()
+
+    assert first.headers["Signature"] == second.headers["Signature"]
+    assert auth.key.sign.call_count == 1
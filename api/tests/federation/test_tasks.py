@@ -44,6 +44,112 @@ def test_clean_federation_music_cache_if_no_listen(preferences, factories):
     assert os.path.exists(path4) is True
 
 
+def test_clean_federation_music_cache_max_size(preferences, factories, now, cache):
+    mb = 1024 * 1024
+    preferences["federation__music_cache_duration"] = 0
+    preferences["federation__music_cache_size"] = 2
+    remote_library = factories["music.Library"]()
+    oldest = factories["music.Upload"](
+        library=remote_library, size=mb, accessed_date=now - datetime.timedelta(days=2)
+    )
+    never_played = factories["music.Upload"](
+        library=remote_library, size=mb, accessed_date=None
+    )
+    recent = factories["music.Upload"](
+        library=remote_library, size=mb, accessed_date=now
+    )
+    # local upload, should not be cleaned
+    local = factories["music.Upload"](library__actor__local=True, accessed_date=None)
+
+    tasks.clean_music_cache()
+
+    for upload in [oldest, never_played, recent, local]:
+        upload.refresh_from_db()
+
+    assert bool(never_played.audio_file) is False
+    assert bool(oldest.audio_file) is True
+    assert bool(recent.audio_file) is True
+    assert bool(local.audio_file) is True
+
+
+def test_clean_federation_music_cache_max_size_ignores_deleted_uploads(
+    preferences, factories, cache
+):
+    mb = 1024 * 1024
+    preferences["federation__music_cache_duration"] = 0
+    preferences["federation__music_cache_size"] = 2
+    kept = factories["music.Upload"](library=factories["music.Library"](), size=mb)
+    deleted = factories["music.Upload"](library=factories["music.Library"](), size=mb)
+    # uploads deleted in cascade leave the cache too
+    deleted.library.delete()
+
+    assert tasks.compute_music_cache_size() == mb
+    tasks.clean_music_cache()
+    kept.refresh_from_db()
+
+    assert bool(kept.audio_file) is True
+
+
+def test_clean_federation_music_cache_pinned(preferences, factories):
+    preferences["federation__music_cache_duration"] = 60
+    preferences["federation__music_cache_pin_listenings"] = 2
+    remote_library = factories["music.Library"]()
+    pinned = factories["music.Upload"](library=remote_library, accessed_date=None)
+    not_pinned = factories["music.Upload"](library=remote_library, accessed_date=None)
+    factories["history.Listening"].create_batch(size=2, track=pinned.track)
+    factories["history.Listening"](track=not_pinned.track)
+
+    tasks.clean_music_cache()
+    pinned.refresh_from_db()
+    not_pinned.refresh_from_db()
+
+    assert bool(pinned.audio_file) is True
+    assert bool(not_pinned.audio_file) is False
+
+
+def test_clean_federation_music_cache_reschedules_when_budget_is_spent(
+    preferences, factories, mocker
+):
+    preferences["federation__music_cache_duration"] = 60
+    mocker.patch.object(tasks, "EVICTION_BATCH_SIZE", 2)
+    mocker.patch.object(tasks, "CLEANING_TIME_BUDGET", 0)
+    apply_async = mocker.patch.object(tasks.clean_music_cache, "apply_async")
+    clean_orphaned_files = mocker.patch.object(tasks, "clean_orphaned_files")
+    remote_library = factories["music.Library"]()
+    uploads = [
+        factories["music.Upload"](library=remote_library, accessed_date=None)
+        for i in range(3)
+    ]
+
+    tasks.clean_music_cache()
+
+    for upload in uploads:
+        upload.refresh_from_db()
+
+    # a single batch is processed, the remaining files are left to the next run
+    assert [bool(u.audio_file) for u in uploads] == [False, False, True]
+    clean_orphaned_files.assert_not_called()
+    apply_async.assert_called_once_with(countdown=tasks.CLEANING_RESCHEDULE_DELAY)
+
+
+def test_clean_federation_music_cache_orphaned_stops_at_deadline(
+    settings, cache, mocker
+):
+    path = os.path.join(settings.MEDIA_ROOT, "federation_cache", "tracks")
+    paths = [os.path.join(path, "a", "b", "{}.ogg".format(i)) for i in range(3)]
+    os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+    for p in paths:
+        pathlib.Path(p).touch()
+    mocker.patch.object(tasks, "ORPHANS_BATCH_SIZE", 2)
+
+    assert tasks.clean_orphaned_files(deadline=0) == 2
+
+    assert [os.path.exists(p) for p in paths] == [False, False, True]
+    assert (
+        cache.get(tasks.ORPHANS_CURSOR_CACHE_KEY) == "federation_cache/tracks/a/b/1.ogg"
+    )
+
+
 def test_clean_federation_music_cache_orphaned(settings, preferences, factories):
     preferences["federation__music_cache_duration"] = 60
     path = os.path.join(settings.MEDIA_ROOT, "federation_cache", "tracks")
@@ -66,6 +172,65 @@ def test_clean_federation_music_cache_orphaned(settings, preferences, factories)
     assert os.path.exists(remove_path) is False
 
 
+def test_clean_federation_music_cache_orphaned_in_batches(
+    settings, preferences, factories, cache, mocker, django_assert_num_queries
+):
+    path = os.path.join(settings.MEDIA_ROOT, "federation_cache", "tracks")
+    paths = [os.path.join(path, "a", "b", "{}.ogg".format(i)) for i in range(5)]
+    os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+    for p in paths:
+        pathlib.Path(p).touch()
+    factories["music.Upload"](audio_file="federation_cache/tracks/a/b/1.ogg")
+    mocker.patch.object(tasks, "ORPHANS_BATCH_SIZE", 2)
+
+    with django_assert_num_queries(3):
+        assert tasks.clean_orphaned_files() == 4
+
+    assert [os.path.exists(p) for p in paths] == [False, True, False, False, False]
+    assert cache.get(tasks.ORPHANS_CURSOR_CACHE_KEY) is None
+
+
+def test_clean_federation_music_cache_orphaned_resume(settings, factories, cache):
+    path = os.path.join(settings.MEDIA_ROOT, "federation_cache", "tracks")
+    paths = [
+        os.path.join(path, "a", "b", "1.ogg"),
+        os.path.join(path, "a", "c", "2.ogg"),
+        os.path.join(path, "d", "e", "3.ogg"),
+    ]
+    for p in paths:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        pathlib.Path(p).touch()
+    # a previous run was interrupted after the second file
+    cache.set(tasks.ORPHANS_CURSOR_CACHE_KEY, "federation_cache/tracks/a/c/2.ogg")
+
+    tasks.clean_orphaned_files()
+
+    assert [os.path.exists(p) for p in paths] == [True, True, False]
+    assert cache.get(tasks.ORPHANS_CURSOR_CACHE_KEY) is None
+
+
+def test_iter_files_non_local_storage(mocker):
+    storage = mocker.Mock()
+    storage.path.side_effect = NotImplementedError()
+    storage.listdir.side_effect = lambda path: {
+        "root": (["b", "a"], ["z.ogg"]),
+        "root/a": ([], ["2.ogg", "1.ogg"]),
+        "root/b": ([], ["3.ogg"]),
+    }[path]
+
+    assert list(tasks.iter_files(storage, "root")) == [
+        "root/a/1.ogg",
+        "root/a/2.ogg",
+        "root/b/3.ogg",
+        "root/z.ogg",
+    ]
+    assert list(tasks.iter_files(storage, "root", start_after="root/a/1.ogg")) == [
+        "root/a/2.ogg",
+        "root/b/3.ogg",
+        "root/z.ogg",
+    ]
+
+
 def test_handle_in(factories, mocker, now, queryset_equal_list):
     mocked_dispatch = mocker.patch("funkwhale_api.federation.routes.inbox.dispatch")
 
@@ -83,29 +248,29 @@ def test_handle_in(factories, mocker, now, queryset_equal_list):
 
 def test_dispatch_outbox(factories, mocker):
     mocked_inbox = mocker.patch("funkwhale_api.federation.tasks.dispatch_inbox.delay")
-    mocked_deliver_to_remote = mocker.patch(
-        "funkwhale_api.federation.tasks.deliver_to_remote.delay"
+    schedule_host_delivery = mocker.patch(
+        "funkwhale_api.federation.tasks.schedule_host_delivery"
     )
     activity = factories["federation.Activity"](actor__local=True)
     factories["federation.InboxItem"](activity=activity)
     delivery = factories["federation.Delivery"](activity=activity)
     tasks.dispatch_outbox(activity_id=activity.pk)
     mocked_inbox.assert_called_once_with(activity_id=activity.pk)
-    mocked_deliver_to_remote.assert_called_once_with(delivery_id=delivery.pk)
+    schedule_host_delivery.assert_called_once_with(delivery.host)
 
 
 def test_dispatch_outbox_disabled_federation(factories, mocker, preferences):
     preferences["federation__enabled"] = False
     mocked_inbox = mocker.patch("funkwhale_api.federation.tasks.dispatch_inbox.delay")
-    mocked_deliver_to_remote = mocker.patch(
-        "funkwhale_api.federation.tasks.deliver_to_remote.delay"
+    schedule_host_delivery = mocker.patch(
+        "funkwhale_api.federation.tasks.schedule_host_delivery"
     )
     activity = factories["federation.Activity"](actor__local=True)
     factories["federation.InboxItem"](activity=activity)
     factories["federation.Delivery"](activity=activity)
     tasks.dispatch_outbox(activity_id=activity.pk)
     mocked_inbox.assert_called_once_with(activity_id=activity.pk)
-    mocked_deliver_to_remote.assert_not_called()
+    schedule_host_delivery.assert_not_called()
 
 
 def test_deliver_to_remote_success_mark_as_delivered(factories, r_mock, now):
@@ -138,3 +303,89 @@ def test_deliver_to_remote_error(factories, r_mock, now):
     assert delivery.is_delivered is False
     assert delivery.attempts == 1
     assert delivery.last_attempt_date == now
+
+
+def test_delivery_host_is_populated(factories):
+    delivery = factories["federation.Delivery"](inbox_url="https://test.host/inbox")
+
+    assert delivery.host == "test.host"
+
+
+def test_schedule_host_delivery_only_once(mocker, cache):
+    apply_async = mocker.patch.object(tasks.deliver_to_host, "apply_async")
+    tasks.schedule_host_delivery("test.host")
+    tasks.schedule_host_delivery("test.host")
+
+    apply_async.assert_called_once_with(kwargs={"host": "test.host"}, countdown=None)
+
+
+def test_schedule_host_delivery_during_pending_retry(mocker, cache):
+    apply_async = mocker.patch.object(tasks.deliver_to_host, "apply_async")
+    tasks.schedule_host_delivery("test.host", countdown=600)
+    tasks.schedule_host_delivery("test.host", countdown=600)
+    # new activities are still delivered immediately
+    tasks.schedule_host_delivery("test.host")
+
+    assert apply_async.call_args_list == [
+        mocker.call(kwargs={"host": "test.host", "retry": True}, countdown=600),
+        mocker.call(kwargs={"host": "test.host"}, countdown=None),
+    ]
+
+
+def test_deliver_to_host_retry_clears_retry_flag(mocker, cache):
+    mocker.patch.object(tasks.deliver_to_host, "apply_async")
+    tasks.schedule_host_delivery("test.host")
+    tasks.schedule_host_delivery("test.host", countdown=600)
+
+    tasks.deliver_to_host(host="test.host", retry=True)
+
+    assert cache.get(tasks.get_delivery_cache_key("retry", "test.host")) is None
+    assert cache.get(tasks.get_delivery_cache_key("scheduled", "test.host")) is True
+
+
+def test_deliver_to_host(factories, r_mock, now, mocker):
+    schedule = mocker.patch("funkwhale_api.federation.tasks.schedule_host_delivery")
+    ok1 = factories["federation.Delivery"](inbox_url="https://test.host/inbox")
+    ok2 = factories["federation.Delivery"](inbox_url="https://test.host/inbox")
+    error = factories["federation.Delivery"](inbox_url="https://test.host/error")
+    other_host = factories["federation.Delivery"](inbox_url="https://other.host/")
+    r_mock.post("https://test.host/inbox")
+    r_mock.post("https://test.host/error", status_code=500)
+
+    result = tasks.deliver_to_host(host="test.host")
+
+    assert result == {"delivered": 2, "failed": 1}
+    assert r_mock.call_count == 3
+    for delivery in [ok1, ok2]:
+        delivery.refresh_from_db()
+        assert delivery.is_delivered is True
+        assert delivery.attempts == 1
+        assert delivery.last_attempt_date == now
+
+    error.refresh_from_db()
+    assert error.is_delivered is False
+    assert error.attempts == 1
+    other_host.refresh_from_db()
+    assert other_host.attempts == 0
+    # the failed delivery is retried later
+    schedule.assert_called_once_with(
+        "test.host", countdown=tasks.DELIVERY_RETRY_DELAY + 1
+    )
+
+
+def test_deliver_to_host_skips_deliveries_not_due(factories, r_mock, now, mocker):
+    schedule = mocker.patch("funkwhale_api.federation.tasks.schedule_host_delivery")
+    factories["federation.Delivery"](
+        inbox_url="https://test.host/inbox", attempts=2, last_attempt_date=now
+    )
+    factories["federation.Delivery"](
+        inbox_url="https://test.host/inbox", attempts=tasks.DELIVERY_MAX_ATTEMPTS
+    )
+
+    result = tasks.deliver_to_host(host="test.host")
+
+    assert result == {"delivered": 0, "failed": 0}
+    assert r_mock.called is False
+    schedule.assert_called_once_with(
+        "test.host", countdown=tasks.DELIVERY_RETRY_DELAY * 2 + 1
+    )
@@ -140,6 +140,25 @@ def test_music_library_retrieve_page_public(factories, api_client):
     assert response.data == expected
 
 
+def test_music_library_retrieve_page_conditional(factories, api_client):
+    library = factories["music.Library"](privacy_level="everyone")
+    factories["music.Upload"](library=library, import_status="finished")
+    url = reverse("federation:music:libraries-detail", kwargs={"uuid": library.uuid})
+
+    response = api_client.get(url, {"page": 1})
+    etag = response["ETag"]
+    assert response.status_code == 200
+    assert "Last-Modified" in response
+
+    response = api_client.get(url, {"page": 1}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    factories["music.Upload"](library=library, import_status="finished")
+    response = api_client.get(url, {"page": 1}, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 200
+    assert response["ETag"] != etag
+
+
 @pytest.mark.parametrize("privacy_level", ["me", "instance"])
 def test_music_library_retrieve_page_private(factories, api_client, privacy_level):
     library = factories["music.Library"](privacy_level=privacy_level)
@@ -0,0 +1,46 @@
+import datetime
+
+from funkwhale_api.music import access, models
+
+
+def test_record_access_is_buffered(factories, now, cache):
+    upload = factories["music.Upload"](accessed_date=None)
+
+    access.record_access(upload)
+    upload.refresh_from_db()
+
+    assert upload.accessed_date is None
+
+    assert access.flush_all() == {"music.Upload": 1, "music.UploadVersion": 0}
+    upload.refresh_from_db()
+
+    assert upload.accessed_date == now
+
+
+def test_flush_keeps_most_recent_date(factories, now, cache):
+    upload1 = factories["music.Upload"](accessed_date=None)
+    upload2 = factories["music.Upload"](accessed_date=now)
+    access.record_access(upload1, now - datetime.timedelta(days=1))
+    access.record_access(upload1, now)
+    access.record_access(upload2, now - datetime.timedelta(days=1))
+
+    access.flush(upload1.__class__)
+    upload1.refresh_from_db()
+    upload2.refresh_from_db()
+
+    assert upload1.accessed_date == now
+    assert upload2.accessed_date == now
+
+
+def test_flush_empty_buffer(cache):
+    assert access.flush(models.UploadVersion) == 0
+
+
+def test_record_access_fallback_to_database(factories, now, mocker):
+    mocker.patch.object(access, "get_redis_connection", side_effect=Exception())
+    upload = factories["music.Upload"](accessed_date=None)
+
+    access.record_access(upload)
+    upload.refresh_from_db()
+
+    assert upload.accessed_date == now
@@ -1,6 +1,10 @@
 import os
 
-from funkwhale_api.music.management.commands import fix_uploads
+from django.core.management import call_command
+from watchdog import events
+
+from funkwhale_api.music import rescan
+from funkwhale_api.music.management.commands import fix_uploads, watch_library
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -11,8 +15,8 @@ def test_fix_uploads_bitrate_length(factories, mocker):
     c = fix_uploads.Command()
 
     mocker.patch(
-        "funkwhale_api.music.utils.get_audio_file_data",
-        return_value={"bitrate": 42, "length": 43},
+        "funkwhale_api.music.metadata.AudioProbe.get_audio_data",
+        return_value={"bitrate": 42, "duration": 43, "size": 44},
     )
 
     c.fix_file_data(dry_run=False)
@@ -73,3 +77,179 @@ def test_fix_uploads_mimetype(factories, mocker):
 
     assert upload1.mimetype == "audio/mpeg"
     assert upload2.mimetype == "audio/something"
+
+
+def test_fix_uploads_mimetype_ignores_transcoding_formats(factories):
+    opus_path = os.path.join(DATA_DIR, "test.opus")
+    upload = factories["music.Upload"](
+        audio_file__from_path=opus_path,
+        source="file://{}".format(opus_path),
+        mimetype="application/x-empty",
+    )
+    c = fix_uploads.Command()
+    c.fix_mimetypes(dry_run=False)
+
+    upload.refresh_from_db()
+
+    # opus files are stored as audio/ogg, audio/opus is only used
+    # for transcoded versions
+    assert upload.mimetype == "application/x-empty"
+
+
+def test_fix_uploads_checksum(factories):
+    upload1 = factories["music.Upload"](library__actor__local=True)
+    upload2 = factories["music.Upload"](library__actor__local=True)
+    upload1.__class__.objects.filter(pk=upload1.pk).update(checksum="hello")
+    upload2.__class__.objects.filter(pk=upload2.pk).update(checksum=None)
+    c = fix_uploads.Command()
+
+    c.fix_checksums(dry_run=False)
+
+    upload1.refresh_from_db()
+    upload2.refresh_from_db()
+
+    # not updated
+    assert upload1.checksum == "hello"
+
+    # updated
+    assert upload2.checksum == rescan.compute_checksum(upload2.audio_file.path)
+
+
+def test_watch_library_collector_debounce(mocker):
+    monotonic = mocker.patch("time.monotonic", return_value=100)
+    collector = watch_library.ChangesCollector()
+    collector.dispatch(events.FileCreatedEvent("/music/album/1.ogg"))
+    collector.dispatch(events.FileCreatedEvent("/music/album/cover.jpg"))
+    collector.dispatch(events.FileDeletedEvent("/music/other/2.mp3"))
+    monotonic.return_value = 105
+    collector.dispatch(events.FileModifiedEvent("/music/album/2.ogg"))
+    collector.dispatch(
+        events.FileMovedEvent("/music/album/.3.tmp", "/music/album/3.ogg")
+    )
+
+    # the album directory is still receiving events
+    monotonic.return_value = 111
+    assert collector.pop_ready(10) == ([], {}, ["/music/other/2.mp3"])
+
+    monotonic.return_value = 115
+    assert collector.pop_ready(10) == (
+        ["/music/album/1.ogg", "/music/album/2.ogg", "/music/album/3.ogg"],
+        {},
+        [],
+    )
+    assert collector.pop_ready(10) == ([], {}, [])
+
+
+def test_watch_library_collector_move_across_busy_directories(mocker):
+    monotonic = mocker.patch("time.monotonic", return_value=100)
+    collector = watch_library.ChangesCollector()
+    collector.dispatch(events.FileMovedEvent("/music/a/1.ogg", "/music/b/1.ogg"))
+    monotonic.return_value = 105
+    collector.dispatch(events.FileCreatedEvent("/music/b/2.ogg"))
+
+    # the source directory is ready, but not the destination
+    monotonic.return_value = 111
+    assert collector.pop_ready(10) == ([], {}, [])
+
+    monotonic.return_value = 116
+    assert collector.pop_ready(10) == (
+        ["/music/b/2.ogg"],
+        {"/music/a/1.ogg": "/music/b/1.ogg"},
+        [],
+    )
+
+
+def test_watch_library_collector_directory_move(mocker):
+    monotonic = mocker.patch("time.monotonic", return_value=100)
+    collector = watch_library.ChangesCollector()
+    collector.dispatch(events.FileCreatedEvent("/music/album/1.ogg"))
+    collector.dispatch(events.DirMovedEvent("/music/album", "/music/renamed"))
+
+    monotonic.return_value = 111
+    assert collector.pop_ready(10) == (
+        ["/music/renamed/1.ogg"],
+        {"/music/album": "/music/renamed"},
+        [],
+    )
+
+
+def test_watch_library_expand_directory_moves(factories, tmpdir):
+    library = factories["music.Library"](actor__local=True)
+    src = str(tmpdir.join("album"))
+    dest = str(tmpdir.join("renamed"))
+    os.mkdir(src)
+    for name in ["1.ogg", "2.ogg", "cover.jpg"]:
+        with open(os.path.join(src, name), "wb") as f:
+            f.write(b"test")
+    upload = factories["music.Upload"](
+        library=library,
+        source="file://{}".format(os.path.join(src, "1.ogg")),
+        in_place=True,
+    )
+    rescan.index_uploads([upload])
+    os.rename(src, dest)
+
+    result = watch_library.Command().expand_moves(library, {src: dest})
+
+    assert result == {
+        os.path.join(src, "1.ogg"): os.path.join(dest, "1.ogg"),
+        os.path.join(src, "2.ogg"): os.path.join(dest, "2.ogg"),
+    }
+
+
+def test_watch_library_handle_changes_in_place(factories, tmpdir, mocker):
+    library = factories["music.Library"](actor__local=True)
+    moved_path = str(tmpdir.join("moved.ogg"))
+    deleted_path = str(tmpdir.join("deleted.ogg"))
+    new_path = str(tmpdir.join("new.ogg"))
+    for path in [moved_path, deleted_path, new_path]:
+        with open(path, "wb") as f:
+            f.write(b"test")
+    moved = factories["music.Upload"](
+        library=library, source="file://{}".format(moved_path), in_place=True
+    )
+    deleted = factories["music.Upload"](
+        library=library, source="file://{}".format(deleted_path), in_place=True
+    )
+    rescan.index_uploads([moved, deleted])
+    new_moved_path = str(tmpdir.join("new-location.ogg"))
+    os.rename(moved_path, new_moved_path)
+    os.remove(deleted_path)
+    do_import = mocker.patch.object(watch_library.Command, "do_import", return_value=[])
+    command = watch_library.Command()
+    options = {"in_place": True, "batch_size": 10, "reference": "test", "async_": True}
+
+    command.handle_changes(
+        library, [new_path], {moved_path: new_moved_path}, [deleted_path], options
+    )
+
+    moved.refresh_from_db()
+    assert moved.source == "file://{}".format(new_moved_path)
+    assert library.uploads.filter(pk=deleted.pk).exists() is False
+    do_import.assert_called_once_with(
+        [new_path], library=library, reference="test", options=options
+    )
+
+
+def test_watch_library_keeps_running_after_errors(factories, tmpdir, mocker):
+    library = factories["music.Library"](actor__local=True)
+    mocker.patch.object(watch_library, "Observer")
+    mocker.patch.object(watch_library.time, "sleep")
+    mocker.patch.object(
+        watch_library.ChangesCollector,
+        "pop_ready",
+        side_effect=[
+            (["/music/gone.ogg"], {}, []),
+            (["/music/new.ogg"], {}, []),
+            KeyboardInterrupt(),
+        ],
+    )
+    handle_changes = mocker.patch.object(
+        watch_library.Command,
+        "handle_changes",
+        side_effect=[FileNotFoundError("gone.ogg"), None],
+    )
+
+    call_command("watch_library", str(library.uuid), str(tmpdir))
+
+    assert handle_changes.call_count == 2
@@ -200,3 +200,42 @@ def test_mbid_clean_keeps_only_first(field_name):
 )
 def test_date_parsing(raw, expected):
     assert metadata.get_date(raw) == expected
+
+
+@pytest.mark.parametrize(
+    "name,mimetype,duration,bitrate",
+    [
+        ("sample.flac", "audio/x-flac", 0, 1608000),
+        ("test.mp3", "audio/mpeg", 267, 8000),
+        ("test.ogg", "audio/ogg", 229, 128000),
+    ],
+)
+def test_audio_probe(name, mimetype, duration, bitrate):
+    path = os.path.join(DATA_DIR, name)
+    with open(path, "rb") as f:
+        probe = metadata.AudioProbe(f)
+
+        assert probe.mimetype == mimetype
+        assert probe.get_audio_data() == {
+            "duration": duration,
+            "bitrate": bitrate,
+            "size": os.path.getsize(path),
+        }
+        assert probe.get("title") is not None
+
+
+def test_audio_probe_opus():
+    path = os.path.join(DATA_DIR, "test.opus")
+    probe = metadata.AudioProbe(path)
+
+    assert probe.mimetype == "audio/ogg"
+    assert probe.size == os.path.getsize(path)
+    assert probe.get("title") is not None
+
+
+def test_audio_probe_picture():
+    path = os.path.join(DATA_DIR, "test.mp3")
+    probe = metadata.AudioProbe(path)
+
+    assert probe.size == os.path.getsize(path)
+    assert probe.get_picture("cover_front")["mimetype"].startswith("image/")
@@ -1,11 +1,14 @@
+import datetime
+import hashlib
 import os
 
 import pytest
 
+from django.core.files.base import ContentFile
 from django.utils import timezone
 from django.urls import reverse
 
-from funkwhale_api.music import importers, models, tasks
+from funkwhale_api.music import importers, models, tasks, utils
 from funkwhale_api.federation import utils as federation_utils
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -164,6 +167,18 @@ def test_audio_track_mime_type(extention, mimetype, factories):
     assert upload.mimetype == mimetype
 
 
+def test_upload_probes_audio_file_on_save(factories, mocker):
+    guess_mimetype = mocker.spy(utils, "guess_mimetype")
+    path = os.path.join(DATA_DIR, "test.ogg")
+    upload = factories["music.Upload"](audio_file__from_path=path, mimetype=None)
+
+    assert upload.mimetype == "audio/ogg"
+    assert upload.duration == 229
+    assert upload.bitrate == 128000
+    assert upload.size == os.path.getsize(path)
+    guess_mimetype.assert_not_called()
+
+
 def test_upload_file_name(factories):
     name = "test.mp3"
     path = os.path.join(DATA_DIR, name)
@@ -172,6 +187,33 @@ def test_upload_file_name(factories):
     assert upload.filename == upload.track.full_name + ".mp3"
 
 
+def test_upload_reuses_identical_audio_file(factories):
+    path = os.path.join(DATA_DIR, "test.mp3")
+    upload1 = factories["music.Upload"](
+        audio_file__from_path=path, library__actor__local=True
+    )
+    upload2 = factories["music.Upload"](
+        audio_file__from_path=path, library__actor__local=True
+    )
+
+    assert upload1.checksum is not None
+    assert upload1.audio_file.name.startswith("tracks/")
+    assert upload2.checksum == upload1.checksum
+    assert upload2.audio_file.name == upload1.audio_file.name
+
+
+def test_upload_does_not_reuse_federation_cache_file(factories):
+    path = os.path.join(DATA_DIR, "test.mp3")
+    remote = factories["music.Upload"](audio_file__from_path=path)
+    upload = factories["music.Upload"](
+        audio_file__from_path=path, library__actor__local=True
+    )
+
+    assert remote.audio_file.name.startswith("federation_cache/")
+    assert upload.checksum == remote.checksum
+    assert upload.audio_file.name != remote.audio_file.name
+
+
 def test_track_get_file_size(factories):
     name = "test.mp3"
     path = os.path.join(DATA_DIR, name)
@@ -220,6 +262,88 @@ def test_playable_by_correct_status(status, expected, factories):
     assert match is expected
 
 
+def test_viewable_ids_are_cached(factories, cache, django_assert_num_queries):
+    library = factories["music.Library"](privacy_level="everyone")
+    actor = factories["federation.Actor"]()
+
+    assert models.Library.objects.viewable_ids(actor) == [library.pk]
+    with django_assert_num_queries(0):
+        assert models.Library.objects.viewable_ids(actor) == [library.pk]
+
+
+def test_viewable_ids_invalidated_on_library_creation(factories, cache):
+    actor = factories["federation.Actor"]()
+    assert models.Library.objects.viewable_ids(actor) == []
+
+    library = factories["music.Library"](privacy_level="everyone", actor__local=True)
+
+    assert models.Library.objects.viewable_ids(actor) == [library.pk]
+
+
+def test_viewable_ids_invalidated_on_remote_public_library_creation(factories, cache):
+    user = factories["users.User"](with_actor=True)
+    assert models.Library.objects.viewable_ids(user.actor) == []
+    assert models.Library.objects.viewable_ids(None) == []
+
+    library = factories["music.Library"](
+        privacy_level="everyone", actor__domain="remote.test"
+    )
+
+    assert models.Library.objects.viewable_ids(user.actor) == [library.pk]
+    assert models.Library.objects.viewable_ids(None) == [library.pk]
+
+
+def test_private_library_creation_only_invalidates_owner(factories, cache):
+    generation = models.get_viewable_libraries_generation()
+    owner = factories["federation.Actor"]()
+    models.Library.objects.viewable_ids(owner)
+
+    library = factories["music.Library"](privacy_level="me", actor=owner)
+
+    assert models.get_viewable_libraries_generation() == generation
+    assert library.pk in models.Library.objects.viewable_ids(owner)
+
+
+def test_viewable_ids_invalidated_on_privacy_change(factories, cache):
+    library = factories["music.Library"](privacy_level="everyone")
+    actor = factories["federation.Actor"]()
+    assert models.Library.objects.viewable_ids(actor) == [library.pk]
+
+    library.privacy_level = "me"
+    library.save(update_fields=["privacy_level"])
+
+    assert models.Library.objects.viewable_ids(actor) == []
+
+
+def test_viewable_ids_invalidated_on_library_deletion(factories, cache):
+    library = factories["music.Library"](privacy_level="everyone")
+    actor = factories["federation.Actor"]()
+    assert models.Library.objects.viewable_ids(actor) == [library.pk]
+
+    library.delete()
+
+    assert models.Library.objects.viewable_ids(actor) == []
+
+
+def test_viewable_ids_invalidated_on_follow_approval(factories, cache):
+    library = factories["music.Library"](privacy_level="me")
+    follow = factories["federation.LibraryFollow"](target=library, approved=None)
+    other_actor = factories["federation.Actor"]()
+    models.Library.objects.viewable_ids(other_actor)
+    assert models.Library.objects.viewable_ids(follow.actor) == []
+
+    follow.approved = True
+    follow.save(update_fields=["approved"])
+
+    assert models.Library.objects.viewable_ids(follow.actor) == [library.pk]
+    # other actors are not affected
+    assert cache.get(models.get_viewable_libraries_cache_key(other_actor)) == []
+
+    follow.delete()
+
+    assert models.Library.objects.viewable_ids(follow.actor) == []
+
+
 @pytest.mark.parametrize(
     "privacy_level,expected", [("me", True), ("instance", True), ("everyone", True)]
 )
@@ -444,6 +568,27 @@ def test_library_schedule_scan_too_recent(factories, now):
     assert scan.library.scans.count() == 1
 
 
+@pytest.mark.parametrize("full", [True, False])
+def test_library_schedule_scan_incremental(factories, now, mocker, full):
+    mocker.patch("funkwhale_api.common.utils.on_commit")
+    previous = factories["music.LibraryScan"](
+        status="finished",
+        creation_date=now - datetime.timedelta(days=2),
+        last_creation_date=now - datetime.timedelta(days=3),
+        last_fid="https://upload.test",
+        page_etags={"https://library.test/?page=1": '"abc"'},
+    )
+
+    scan = previous.library.schedule_scan(previous.library.actor, full=full)
+
+    assert scan.is_incremental is not full
+    if not full:
+        assert scan.since == previous.last_creation_date
+        assert scan.since_fid == previous.last_fid
+        assert scan.last_creation_date == previous.last_creation_date
+        assert scan.page_etags == previous.page_etags
+
+
 def test_get_audio_data(factories):
     upload = factories["music.Upload"]()
 
@@ -502,3 +647,228 @@ def test_fid_is_populated(factories, model, factory_args, namespace):
     assert instance.fid == federation_utils.full_url(
         reverse(namespace, kwargs={"uuid": instance.uuid})
     )
+
+
+@pytest.mark.parametrize(
+    "max_bitrate,original_bitrate,expected",
+    [
+        (None, None, 320000),
+        (None, 128000, 128000),
+        (192000, 320000, 192000),
+        (200000, 320000, 192000),
+        (320000, 150000, 128000),
+        (32000, None, 64000),
+    ],
+)
+def test_get_transcoding_bitrate(max_bitrate, original_bitrate, expected):
+    assert utils.get_transcoding_bitrate(max_bitrate, original_bitrate) == expected
+
+
+def test_upload_get_transcoded_version_existing(factories, mocker):
+    version = factories["music.UploadVersion"](
+        upload__bitrate=320000, bitrate=128000, mimetype="audio/mpeg"
+    )
+    create = mocker.patch.object(version.upload.__class__, "create_transcoded_version")
+
+    assert version.upload.get_transcoded_version("mp3", 128000) == version
+    create.assert_not_called()
+
+
+def test_upload_create_transcoded_version(factories, mocker):
+    upload = factories["music.Upload"](bitrate=320000)
+    transcoded = open(os.path.join(DATA_DIR, "test.mp3"), "rb")
+    transcode = mocker.patch.object(utils, "transcode_file", return_value=transcoded)
+
+    version = upload.get_transcoded_version("mp3", 128000)
+
+    transcode.assert_called_once_with(upload.audio_file.path, "mp3", 128000)
+    assert version.upload == upload
+    assert version.mimetype == "audio/mpeg"
+    assert version.bitrate == 128000
+    assert version.size == os.path.getsize(os.path.join(DATA_DIR, "test.mp3"))
+    assert version.audio_file.name.endswith(".mp3")
+
+
+def test_track_availability_created_on_upload_import(factories):
+    upload = factories["music.Upload"](import_status="pending")
+    assert upload.track.availabilities.count() == 0
+
+    upload.import_status = "finished"
+    upload.save(update_fields=["import_status"])
+
+    availability = upload.track.availabilities.get()
+    assert availability.library == upload.library
+    assert availability.actor == upload.library.actor
+    assert availability.privacy_level == upload.library.privacy_level
+
+
+def test_track_availability_deleted_with_last_upload(factories):
+    upload1 = factories["music.Upload"](import_status="finished")
+    upload2 = factories["music.Upload"](
+        import_status="finished", track=upload1.track, library=upload1.library
+    )
+    assert upload1.track.availabilities.count() == 1
+
+    upload1.delete()
+    assert upload1.track.availabilities.count() == 1
+
+    upload2.delete()
+    assert upload1.track.availabilities.count() == 0
+
+
+@pytest.mark.parametrize("update_fields", [None, ["track"]])
+def test_track_availability_updated_when_upload_track_changes(factories, update_fields):
+    upload = factories["music.Upload"](import_status="finished")
+    old_track = upload.track
+    new_track = factories["music.Track"]()
+    assert old_track.availabilities.count() == 1
+
+    upload.track = new_track
+    upload.save(update_fields=update_fields)
+
+    assert old_track.availabilities.count() == 0
+    assert new_track.availabilities.get().library == upload.library
+
+
+def test_track_availability_privacy_level_follows_library(factories):
+    upload = factories["music.Upload"](
+        import_status="finished", library__privacy_level="me"
+    )
+
+    upload.library.privacy_level = "everyone"
+    upload.library.save()
+
+    assert upload.track.availabilities.get().privacy_level == "everyone"
+
+
+def test_track_annotate_playable_by_actor(factories):
+    playable = factories["music.Upload"](playable=True).track
+    not_playable = factories["music.Upload"](
+        import_status="finished", library__privacy_level="me"
+    ).track
+
+    tracks = models.Track.objects.annotate_playable_by_actor(None).order_by("pk")
+
+    assert [t.is_playable_by_actor for t in tracks] == [True, False]
+    assert list(models.Track.objects.playable_by(None)) == [playable]
+    assert list(models.Track.objects.playable_by(None, False)) == [not_playable]
+
+
+def test_rebuild_track_availabilities(factories):
+    upload = factories["music.Upload"](import_status="finished")
+    models.TrackAvailability.objects.all().delete()
+
+    models.rebuild_track_availabilities()
+
+    assert upload.track.availabilities.get().library == upload.library
+
+
+def test_saving_album_cover_schedules_warming(factories, mocker):
+    schedule = mocker.patch("funkwhale_api.music.tasks.schedule_album_covers_warming")
+    album = factories["music.Album"]()
+    schedule.assert_called_once_with([album.pk])
+    schedule.reset_mock()
+
+    album.save(update_fields=["title"])
+    schedule.assert_not_called()
+
+
+def test_import_batch_status_counters(factories, mocker):
+    notify = mocker.patch(
+        "funkwhale_api.music.tasks.import_batch_notify_followers.delay"
+    )
+    batch = factories["music.ImportBatch"]()
+    job1 = factories["music.ImportJob"](batch=batch)
+    job2 = factories["music.ImportJob"](batch=batch)
+    batch.refresh_from_db()
+
+    assert batch.pending_count == 2
+    assert batch.status == "pending"
+
+    job1.status = "finished"
+    job1.save(update_fields=["status"])
+    job2.status = "skipped"
+    job2.save()
+    batch.refresh_from_db()
+
+    assert batch.pending_count == 0
+    assert batch.finished_count == 1
+    assert batch.skipped_count == 1
+    assert batch.status == "finished"
+    notify.assert_called_once_with(import_batch_id=batch.pk)
+
+    job2.delete()
+    batch.refresh_from_db()
+    assert batch.skipped_count == 0
+
+
+def test_upload_import_summary(factories):
+    library = factories["music.Library"]()
+    upload1 = factories["music.Upload"](library=library, import_reference="test")
+    upload2 = factories["music.Upload"](library=library, import_reference="test")
+    factories["music.Upload"](library=library, import_reference="other")
+
+    upload1.import_status = "finished"
+    upload1.save(update_fields=["import_status"])
+    upload2.import_status = "errored"
+    upload2.save()
+    # saving without a status change should not affect the counters
+    upload2.save()
+    upload1.delete()
+
+    summary = library.import_summaries.get(import_reference="test")
+    assert summary.get_counts() == {
+        "pending": 0,
+        "finished": 0,
+        "errored": 1,
+        "skipped": 0,
+    }
+
+
+def test_record_bulk_import_status_change(factories):
+    library = factories["music.Library"]()
+    uploads = models.Upload.objects.bulk_create(
+        [
+            models.Upload(library=library, import_reference="test"),
+            models.Upload(library=library, import_reference="test"),
+        ]
+    )
+    models.record_bulk_import_status_change(uploads, created=True)
+    summary = library.import_summaries.get(import_reference="test")
+    assert summary.pending_count == 2
+
+    for upload in uploads:
+        upload.import_status = "finished"
+    models.record_bulk_import_status_change(uploads)
+    summary.refresh_from_db()
+
+    assert summary.pending_count == 0
+    assert summary.finished_count == 2
+
+
+def test_upload_session_assemble_chunks_without_filesystem(factories, mocker):
+    session = factories["music.UploadSession"](size=10)
+    session.add_chunk(ContentFile(b"hello"))
+    session.add_chunk(ContentFile(b"world"))
+    storage = session.storage
+    path = storage.path
+    saved = {}
+
+    def remote_path(name):
+        if name == "tracks/test.ogg":
+            # like storages that are not on the local filesystem
+            raise NotImplementedError()
+        return path(name)
+
+    def save(name, content):
+        saved[name] = content.read()
+        return "tracks/test_1.ogg"
+
+    mocker.patch.object(storage, "path", side_effect=remote_path)
+    mocker.patch.object(storage, "save", side_effect=save)
+
+    name, checksum = session.assemble_chunks("tracks/test.ogg")
+
+    assert name == "tracks/test_1.ogg"
+    assert checksum == hashlib.sha256(b"helloworld").hexdigest()
+    assert saved == {"tracks/test.ogg": b"helloworld"}
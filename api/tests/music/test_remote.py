@@ -0,0 +1,118 @@
+import io
+
+import pytest
+
+from funkwhale_api.music import remote
+
+
+def test_stream_upload_attaches_to_download_in_progress(
+    factories, api_request, cache, tmpdir, mocker
+):
+    upload = factories["music.Upload"](audio_file="", source="https://file.test")
+    path = str(tmpdir.join("partial"))
+    with open(path, "wb") as f:
+        f.write(b"0123456789")
+    cache.set(
+        remote.get_cache_key(upload),
+        {"status": "downloading", "size": 20, "path": path},
+    )
+    get_remote_response = mocker.patch.object(
+        upload.__class__, "get_remote_audio_response"
+    )
+    request = api_request.get("/", HTTP_RANGE="bytes=2-5")
+
+    response = remote.stream_upload(upload, user=None, request=request)
+
+    get_remote_response.assert_not_called()
+    assert response.status_code == 206
+    assert response["Content-Range"] == "bytes 2-5/20"
+    assert response["Content-Length"] == "4"
+    assert b"".join(response.streaming_content) == b"2345"
+
+
+def test_stream_upload_no_download_in_progress(factories, cache, mocker):
+    upload = factories["music.Upload"](audio_file="", source="https://file.test")
+    cache.set(remote.get_cache_key(upload), {"status": "starting"})
+    mocker.patch.object(remote, "READ_TIMEOUT", 0)
+
+    assert remote.stream_upload(upload, user=None) is None
+
+
+def test_follow_file_stops_when_download_is_over(cache):
+    f = io.BytesIO(b"0123456789")
+
+    assert b"".join(remote.follow_file(f, "noop", 3)) == b"3456789"
+    assert f.closed is True
+
+
+@pytest.mark.parametrize(
+    "state,end",
+    [({"status": "errored"}, None), ({"status": "finished"}, 19), (None, 19)],
+)
+def test_follow_file_aborts_incomplete_download(cache, state, end):
+    f = io.BytesIO(b"0123456789")
+    if state:
+        cache.set("download", state)
+    content = remote.follow_file(f, "download", 0, end)
+
+    assert next(content) == b"0123456789"
+    with pytest.raises(remote.IncompleteDownload):
+        next(content)
+    assert f.closed is True
+
+
+def test_follow_file_backs_off_while_waiting(cache, mocker):
+    sleep = mocker.patch("time.sleep")
+    mocker.patch.object(remote, "READ_TIMEOUT", 1)
+    cache.set("download", {"status": "downloading"})
+
+    with pytest.raises(remote.IncompleteDownload):
+        list(remote.follow_file(io.BytesIO(b""), "download", 0, 9))
+
+    assert sleep.call_args_list == [
+        mocker.call(0.1),
+        mocker.call(0.2),
+        mocker.call(0.4),
+        mocker.call(0.8),
+    ]
+
+
+def test_remote_download_stores_file(factories, tmpdir, mocker, cache):
+    upload = factories["music.Upload"](
+        audio_file="", source="https://file.test", mimetype="audio/ogg"
+    )
+    response = mocker.MagicMock()
+    response.__enter__.return_value.iter_content.return_value = [b"te", b"st"]
+    path = str(tmpdir.join("partial"))
+    download = remote.RemoteDownload(upload, response, path, 4)
+    cache.set(download.key, {"status": "downloading"})
+
+    download.run()
+    upload.refresh_from_db()
+
+    assert upload.audio_file.read() == b"test"
+    assert cache.get(download.key) == {"status": "finished", "size": 4}
+
+
+def test_remote_download_does_not_store_truncated_file(
+    factories, tmpdir, mocker, cache
+):
+    upload = factories["music.Upload"](
+        audio_file="", source="https://file.test", mimetype="audio/ogg"
+    )
+    response = mocker.MagicMock()
+    # the remote closed the connection early
+    response.__enter__.return_value.iter_content.return_value = [b"te"]
+    path = str(tmpdir.join("partial"))
+    download = remote.RemoteDownload(upload, response, path, 4)
+    store = mocker.spy(download, "store")
+
+    with pytest.raises(remote.IncompleteDownload):
+        download.download()
+    download.run()
+    upload.refresh_from_db()
+
+    store.assert_not_called()
+    assert not upload.audio_file
+    assert download.status == "errored"
+    assert cache.get(download.key) == {"status": "errored", "size": 4}
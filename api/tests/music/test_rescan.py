@@ -0,0 +1,152 @@
+import os
+
+from funkwhale_api.music import rescan
+
+
+def create_file(tmpdir, name, content=b"hello"):
+    path = str(tmpdir.join(name))
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def create_indexed_upload(factories, library, path, **kwargs):
+    upload = factories["music.Upload"](
+        library=library, source="file://{}".format(path), in_place=True, **kwargs
+    )
+    rescan.index_uploads([upload])
+    return upload
+
+
+def test_index_uploads(factories, tmpdir):
+    path = create_file(tmpdir, "test.ogg")
+    upload = factories["music.Upload"](source="file://{}".format(path), in_place=True)
+    missing = factories["music.Upload"](source="file:///nope.ogg", in_place=True)
+
+    rescan.index_uploads([upload, missing], checksum=True)
+
+    entry = upload.indexed_file
+    stat = os.stat(path)
+    assert entry.path == path
+    assert entry.library == upload.library
+    assert entry.size == stat.st_size
+    assert entry.mtime == stat.st_mtime
+    assert entry.inode == stat.st_ino
+    assert entry.checksum == rescan.compute_checksum(path)
+    assert missing.__class__.objects.filter(indexed_file__isnull=False).count() == 1
+
+
+def test_bootstrap_index(factories, tmpdir):
+    library = factories["music.Library"]()
+    path = create_file(tmpdir, "test.ogg")
+    upload = factories["music.Upload"](
+        library=library, source="file://{}".format(path), in_place=True
+    )
+    factories["music.Upload"](library=library)
+
+    assert rescan.bootstrap_index(library) == 1
+    assert upload.indexed_file.path == path
+
+
+def test_scan(factories, tmpdir):
+    library = factories["music.Library"]()
+    unchanged_path = create_file(tmpdir, "unchanged.ogg")
+    modified_path = create_file(tmpdir, "modified.ogg")
+    moved_path = create_file(tmpdir, "moved.ogg")
+    deleted_path = create_file(tmpdir, "deleted.ogg")
+    create_indexed_upload(factories, library, unchanged_path)
+    modified = create_indexed_upload(factories, library, modified_path)
+    moved = create_indexed_upload(factories, library, moved_path)
+    deleted = create_indexed_upload(factories, library, deleted_path)
+
+    with open(modified_path, "ab") as f:
+        f.write(b" world")
+    new_moved_path = str(tmpdir.join("new-location.ogg"))
+    os.rename(moved_path, new_moved_path)
+    os.remove(deleted_path)
+    new_path = create_file(tmpdir, "new.ogg")
+
+    changes = rescan.scan(
+        [unchanged_path, modified_path, new_moved_path, new_path], library
+    )
+
+    assert changes.unchanged == 1
+    assert changes.new == [new_path]
+    assert [e.upload_id for e, _ in changes.modified] == [modified.pk]
+    assert [(e.upload_id, p) for e, p, _ in changes.moved] == [
+        (moved.pk, new_moved_path)
+    ]
+    assert [e.upload_id for e in changes.deleted] == [deleted.pk]
+
+
+def test_scan_keeps_files_outside_of_scanned_paths(factories, tmpdir):
+    library = factories["music.Library"]()
+    path = create_file(tmpdir, "test.ogg")
+    create_indexed_upload(factories, library, path)
+
+    changes = rescan.scan([], library)
+
+    assert changes.deleted == []
+
+
+def test_apply_changes(factories, tmpdir):
+    library = factories["music.Library"]()
+    modified_path = create_file(tmpdir, "modified.ogg")
+    moved_path = create_file(tmpdir, "moved.ogg")
+    deleted_path = create_file(tmpdir, "deleted.ogg")
+    modified = create_indexed_upload(
+        factories, library, modified_path, import_status="finished", duration=42
+    )
+    moved = create_indexed_upload(factories, library, moved_path)
+    deleted = create_indexed_upload(factories, library, deleted_path)
+    with open(modified_path, "ab") as f:
+        f.write(b" world")
+    new_moved_path = str(tmpdir.join("new-location.ogg"))
+    os.rename(moved_path, new_moved_path)
+    os.remove(deleted_path)
+    changes = rescan.scan([modified_path, new_moved_path], library)
+
+    rescan.apply_moves(changes.moved)
+    rescan.apply_deletions(changes.deleted)
+    pending = rescan.reset_modified(changes.modified)
+
+    moved.refresh_from_db()
+    modified.refresh_from_db()
+    assert moved.source == "file://{}".format(new_moved_path)
+    assert moved.indexed_file.path == new_moved_path
+    assert deleted.__class__.objects.filter(pk=deleted.pk).exists() is False
+    assert pending == [modified]
+    assert modified.import_status == "pending"
+    assert modified.duration is None
+    assert modified.indexed_file.size == os.path.getsize(modified_path)
+
+
+def test_reset_modified_uses_bulk_updates(factories, tmpdir, mocker):
+    library = factories["music.Library"]()
+    track = factories["music.Track"]()
+    paths = [create_file(tmpdir, "{}.ogg".format(i)) for i in range(3)]
+    uploads = [
+        create_indexed_upload(
+            factories, library, path, track=track, import_status="finished"
+        )
+        for path in paths
+    ]
+    for path in paths:
+        with open(path, "ab") as f:
+            f.write(b" world")
+    changes = rescan.scan(paths, library)
+    assert track.availabilities.filter(library=library).exists() is True
+    upload_save = mocker.spy(uploads[0].__class__, "save")
+    entry_save = mocker.spy(uploads[0].indexed_file.__class__, "save")
+
+    pending = rescan.reset_modified(changes.modified)
+
+    assert upload_save.call_count == 0
+    assert entry_save.call_count == 0
+    assert sorted(u.pk for u in pending) == sorted(u.pk for u in uploads)
+    for upload in uploads:
+        upload.refresh_from_db()
+        assert upload.import_status == "pending"
+        assert upload.indexed_file.size == os.path.getsize(upload.indexed_file.path)
+    # the track is not available anymore until the files are imported again
+    assert track.availabilities.filter(library=library).exists() is False
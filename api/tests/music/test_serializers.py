@@ -1,3 +1,5 @@
+import pytest
+
 from funkwhale_api.music import models
 from funkwhale_api.music import serializers
 from funkwhale_api.music import tasks
@@ -216,6 +218,41 @@ def test_create_file_checks_for_user_quota(
     assert s.errors["non_field_errors"] == ["upload_quota_reached"]
 
 
+def test_upload_session_checks_for_user_quota(factories, mocker):
+    mocker.patch(
+        "funkwhale_api.users.models.User.get_quota_status",
+        return_value={"remaining": 10},
+    )
+    user = factories["users.User"]()
+    library = factories["music.Library"](actor__user=user)
+    # space reserved by another upload in progress
+    factories["music.UploadSession"](library=library, size=6 * 1000 * 1000)
+    s = serializers.UploadSessionSerializer(
+        data={"library": library.uuid, "filename": "test.ogg", "size": 5 * 1000 * 1000},
+        context={"user": user},
+    )
+    assert s.is_valid() is False
+    assert s.errors["non_field_errors"] == ["upload_quota_reached"]
+
+
+@pytest.mark.parametrize("status", ["finished", "errored"])
+def test_upload_session_quota_ignores_inactive_sessions(status, factories, mocker):
+    mocker.patch(
+        "funkwhale_api.users.models.User.get_quota_status",
+        return_value={"remaining": 10},
+    )
+    user = factories["users.User"]()
+    library = factories["music.Library"](actor__user=user)
+    factories["music.UploadSession"](
+        library=library, size=6 * 1000 * 1000, status=status
+    )
+    s = serializers.UploadSessionSerializer(
+        data={"library": library.uuid, "filename": "test.ogg", "size": 5 * 1000 * 1000},
+        context={"user": user},
+    )
+    assert s.is_valid(raise_exception=True) is True
+
+
 def test_manage_upload_action_delete(factories, queryset_equal_list, mocker):
     dispatch = mocker.patch("funkwhale_api.federation.routes.outbox.dispatch")
     library1 = factories["music.Library"]()
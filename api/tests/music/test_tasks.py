@@ -1,14 +1,18 @@
 import datetime
+import hashlib
 import io
 import os
 import pytest
 import uuid
 
+from django.core.files.base import ContentFile
 from django.core.paginator import Paginator
 from django.utils import timezone
+from django_redis import get_redis_connection
 
+from funkwhale_api.common import utils as common_utils
 from funkwhale_api.federation import serializers as federation_serializers
-from funkwhale_api.music import metadata, signals, tasks
+from funkwhale_api.music import metadata, remote, signals, tasks
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -354,6 +358,223 @@ def test_upload_import_updates_cover_if_no_cover(factories, mocker, now):
     mocked_update.assert_called_once_with(album, source=None, cover_data=None)
 
 
+def test_resolve_track_from_import_metadata_memo(factories):
+    data = {"title": "Hello", "artist": "Artist", "album": "Album"}
+    memo = {}
+
+    track = tasks.resolve_track_from_import_metadata(data, memo=memo)
+
+    assert track.pk is None
+    assert track.artist.name == "Artist"
+    assert track.album.title == "Album"
+    assert tasks.resolve_track_from_import_metadata(data, memo=memo) is track
+    other = tasks.resolve_track_from_import_metadata(
+        {"title": "World", "artist": "artist", "album": "album"}, memo=memo
+    )
+    assert other.artist is track.artist
+    assert other.album is track.album
+
+
+def test_process_uploads_batch(factories, mocker, now, temp_signal):
+    mocker.patch("funkwhale_api.music.metadata.Metadata.all", return_value={})
+    mocker.patch("funkwhale_api.music.metadata.Metadata.get_picture", return_value=None)
+    mocker.patch(
+        "funkwhale_api.music.models.Upload.get_audio_data",
+        return_value={"size": 23, "duration": 42, "bitrate": 66},
+    )
+    outbox = mocker.patch("funkwhale_api.federation.routes.outbox.dispatch")
+    library = factories["music.Library"]()
+    uploads = [
+        factories["music.Upload"](
+            library=library,
+            track=None,
+            import_reference="album",
+            import_metadata={"title": title, "artist": "Artist", "album": "Album"},
+        )
+        for title in ["Hello", "World", "hello"]
+    ]
+
+    with temp_signal(signals.upload_import_status_updated) as handler:
+        result = tasks.process_uploads_batch(upload_ids=[u.pk for u in uploads])
+
+    assert result == {"finished": 2, "skipped": 1, "errored": 0}
+    for upload in uploads:
+        upload.refresh_from_db()
+    hello, world, duplicate = uploads
+    assert hello.import_status == "finished"
+    assert hello.import_date == now
+    assert hello.duration == 42
+    assert hello.track.title == "Hello"
+    assert world.track.title == "World"
+    assert world.track.album == hello.track.album
+    assert world.track.fid == world.track.get_federation_id()
+    assert duplicate.import_status == "skipped"
+    assert duplicate.import_details == {
+        "code": "already_imported_in_owned_libraries",
+        "duplicates": [str(hello.uuid)],
+    }
+    assert hello.track.availabilities.filter(library=library).exists()
+    assert handler.call_count == 3
+    assert outbox.call_count == 2
+
+
+def test_process_uploads_batch_error(factories, mocker, now):
+    mocker.patch("funkwhale_api.music.metadata.Metadata.all", return_value={})
+    mocker.patch("funkwhale_api.music.metadata.Metadata.get_picture", return_value=None)
+    track = factories["music.Track"]()
+    errored = factories["music.Upload"](
+        import_metadata={"funkwhale": {"track": {"uuid": str(uuid.uuid4())}}}
+    )
+    upload = factories["music.Upload"](
+        track=None, import_metadata={"funkwhale": {"track": {"uuid": str(track.uuid)}}}
+    )
+
+    tasks.process_uploads_batch(upload_ids=[errored.pk, upload.pk])
+
+    errored.refresh_from_db()
+    upload.refresh_from_db()
+    assert errored.import_status == "errored"
+    assert errored.import_details == {"error_code": "track_uuid_not_found"}
+    assert upload.import_status == "finished"
+    assert upload.track == track
+
+
+def test_create_tracks_reuses_concurrently_created_tracks(factories):
+    existing = factories["music.Track"](fid="https://track.test/1")
+    album = existing.album
+    new = factories["music.Track"].build(
+        album=album, artist=album.artist, fid="https://track.test/2"
+    )
+    duplicate = factories["music.Track"].build(
+        album=album, artist=album.artist, fid=existing.fid
+    )
+
+    result = tasks.create_tracks([new, duplicate])
+
+    assert result[0].pk is not None
+    assert result[0].fid == new.fid
+    assert result[1] == existing
+
+
+def test_clean_upload_sessions(factories, now):
+    active = factories["music.UploadSession"](modification_date=now)
+    abandoned = factories["music.UploadSession"]()
+    abandoned.add_chunk(ContentFile(b"hello"))
+    abandoned.__class__.objects.filter(pk=abandoned.pk).update(
+        modification_date=now - tasks.UPLOAD_SESSIONS_MAX_AGE - datetime.timedelta(1)
+    )
+
+    assert tasks.clean_upload_sessions() == 1
+
+    assert abandoned.get_chunk_names() == []
+    assert abandoned.__class__.objects.get() == active
+
+
+def test_finalize_upload_session(factories, mocker, audio_file):
+    process_upload = mocker.patch.object(tasks.process_upload, "delay")
+    content = audio_file.read()
+    middle = len(content) // 2
+    session = factories["music.UploadSession"](
+        size=len(content), import_reference="test", status="finalizing"
+    )
+    session.add_chunk(ContentFile(content[:middle]))
+    session.add_chunk(ContentFile(content[middle:]))
+
+    tasks.finalize_upload_session(upload_session_id=session.pk)
+    session.refresh_from_db()
+
+    upload = session.upload
+    assert session.status == "finished"
+    assert session.get_chunk_names() == []
+    assert upload.audio_file.read() == content
+    assert upload.checksum == hashlib.sha256(content).hexdigest()
+    assert upload.source == "upload://test.ogg"
+    assert upload.import_reference == "test"
+    assert upload.mimetype == "audio/ogg"
+    process_upload.assert_called_once_with(upload_id=upload.pk)
+
+
+def test_finalize_upload_session_reuses_identical_file(factories, mocker):
+    mocker.patch.object(tasks.process_upload, "delay")
+    existing = factories["music.Upload"](
+        audio_file__from_path=os.path.join(DATA_DIR, "test.mp3"),
+        library__actor__local=True,
+    )
+    content = existing.audio_file.read()
+    session = factories["music.UploadSession"](
+        library=existing.library, size=len(content), status="finalizing"
+    )
+    session.add_chunk(ContentFile(content))
+
+    tasks.finalize_upload_session(upload_session_id=session.pk)
+    session.refresh_from_db()
+
+    assert session.upload.audio_file.name == existing.audio_file.name
+
+
+def test_finalize_upload_session_errored(factories, mocker):
+    process_upload = mocker.patch.object(tasks.process_upload, "delay")
+    session = factories["music.UploadSession"](size=5, status="finalizing")
+    session.add_chunk(ContentFile(b"hello"))
+    mocker.patch.object(
+        session.__class__, "assemble_chunks", side_effect=IOError("disk full")
+    )
+
+    tasks.finalize_upload_session(upload_session_id=session.pk)
+    session.refresh_from_db()
+
+    assert session.status == "errored"
+    assert session.upload is None
+    assert len(session.get_chunk_names()) == 1
+    process_upload.assert_not_called()
+
+
+def test_schedule_album_covers_warming(cache, mocker):
+    on_commit = mocker.patch("funkwhale_api.common.utils.on_commit")
+
+    tasks.schedule_album_covers_warming([1, 2])
+    tasks.schedule_album_covers_warming([3])
+
+    # a single task is launched for albums saved together
+    on_commit.assert_called_once_with(
+        tasks.warm_album_covers.apply_async, countdown=tasks.COVERS_DELAY
+    )
+    connection = get_redis_connection("default")
+    assert connection.smembers(tasks.COVERS_PENDING_KEY) == {b"1", b"2", b"3"}
+
+
+def test_warm_album_covers(factories, cache, mocker):
+    mocker.patch.object(tasks, "COVERS_BATCH_SIZE", 1)
+    warm = mocker.patch(
+        "funkwhale_api.common.images.warm", side_effect=[(4, 0), (3, 1)]
+    )
+    albums = factories["music.Album"].create_batch(size=2)
+    connection = get_redis_connection("default")
+    connection.delete(tasks.COVERS_PENDING_KEY)
+    connection.sadd(tasks.COVERS_PENDING_KEY, *[a.pk for a in albums])
+
+    result = tasks.warm_album_covers()
+
+    assert result == {"created": 7, "failed": 1}
+    assert warm.call_count == 2
+    warmed = [list(c[0][0])[0] for c in warm.call_args_list]
+    assert sorted(warmed, key=lambda a: a.pk) == albums
+    assert connection.scard(tasks.COVERS_PENDING_KEY) == 0
+
+
+def test_pop_pending_album_covers():
+    connection = get_redis_connection("default")
+    connection.delete(tasks.COVERS_PENDING_KEY)
+    connection.sadd(tasks.COVERS_PENDING_KEY, 1, 2, 3)
+
+    first = tasks.pop_pending_album_covers(connection, 2)
+    second = tasks.pop_pending_album_covers(connection, 5)
+
+    assert len(first) == 2
+    assert sorted(first + second) == [1, 2, 3]
+    assert tasks.pop_pending_album_covers(connection, 5) == []
+
+
 def test_update_album_cover_mbid(factories, mocker):
     album = factories["music.Album"](cover="")
 
@@ -477,14 +698,77 @@ def test_scan_library_fetches_page_and_calls_scan_page(now, mocker, factories, r
     r_mock.get(collection_conf["id"], json=data)
     tasks.start_library_scan(library_scan_id=scan.pk)
 
-    scan_page.assert_called_once_with(library_scan_id=scan.pk, page_url=data["first"])
+    scan_page.assert_called_once_with(
+        library_scan_id=scan.pk,
+        page_url=data["first"],
+        page=1,
+        concurrency=tasks.SCAN_CONCURRENCY,
+    )
     scan.refresh_from_db()
 
     assert scan.status == "scanning"
     assert scan.total_files == len(collection_conf["items"])
+    assert scan.total_pages == 1
     assert scan.modification_date == now
 
 
+@pytest.mark.parametrize(
+    "first, last, expected",
+    [
+        (
+            "https://a.test/l?page=1",
+            "https://a.test/l?page=3",
+            [
+                "https://a.test/l?page=1",
+                "https://a.test/l?page=2",
+                "https://a.test/l?page=3",
+            ],
+        ),
+        (
+            "https://a.test/l?page=1",
+            "https://a.test/l?page=1",
+            ["https://a.test/l?page=1"],
+        ),
+        ("https://a.test/l?page=1", None, None),
+        ("https://a.test/l?cursor=abc", "https://a.test/l?cursor=def", None),
+        ("https://a.test/l?page=1", "https://a.test/other?page=3", None),
+    ],
+)
+def test_get_page_urls(first, last, expected):
+    assert tasks.get_page_urls({"first": first, "last": last}) == expected
+
+
+def test_scan_library_dispatches_pages_concurrently(mocker, factories, r_mock):
+    scan = factories["music.LibraryScan"]()
+    collection_conf = {
+        "actor": scan.library.actor,
+        "id": scan.library.fid,
+        "page_size": 2,
+        "items": range(12),
+        "type": "Library",
+        "name": "hello",
+    }
+    data = federation_serializers.PaginatedCollectionSerializer(collection_conf).data
+    data["followers"] = "https://followers.domain"
+    scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    mocker.patch.object(tasks, "SCAN_CONCURRENCY", 2)
+    r_mock.get(collection_conf["id"], json=data)
+
+    tasks.start_library_scan(library_scan_id=scan.pk)
+
+    assert scan_page.call_args_list == [
+        mocker.call(
+            library_scan_id=scan.pk,
+            page_url=common_utils.set_query_parameter(scan.library.fid, page=i),
+            page=i,
+            concurrency=2,
+        )
+        for i in [1, 2]
+    ]
+    scan.refresh_from_db()
+    assert scan.total_pages == 6
+
+
 def test_scan_page_fetches_page_and_creates_tracks(now, mocker, factories, r_mock):
     scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
     scan = factories["music.LibraryScan"](status="scanning", total_files=5)
@@ -519,13 +803,87 @@ def test_scan_page_fetches_page_and_creates_tracks(now, mocker, factories, r_moc
 
     assert scan.status == "scanning"
     assert scan.processed_files == 3
+    assert scan.processed_pages == 1
     assert scan.modification_date == now
+    assert scan.library.import_summaries.get().finished_count == 3
 
     scan_page.assert_called_once_with(
         library_scan_id=scan.pk, page_url=page.data["next"]
     )
 
 
+def test_scan_page_skips_known_uploads(mocker, factories, r_mock):
+    mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    scan = factories["music.LibraryScan"](status="scanning", total_files=3)
+    existing = factories["music.Upload"](
+        fid="https://track.test/0", library=scan.library
+    )
+    uploads = [existing] + [
+        factories["music.Upload"].build(
+            fid="https://track.test/{}".format(i), library=scan.library
+        )
+        for i in [1, 2]
+    ]
+    page_conf = {
+        "actor": scan.library.actor,
+        "id": scan.library.fid,
+        "page": Paginator(uploads, 3).page(1),
+        "item_serializer": federation_serializers.UploadSerializer,
+    }
+    page = federation_serializers.CollectionPageSerializer(page_conf)
+    r_mock.get(page.data["id"], json=page.data)
+
+    tasks.scan_library_page(library_scan_id=scan.pk, page_url=page.data["id"])
+
+    scan.refresh_from_db()
+    assert scan.library.uploads.count() == 3
+    assert scan.library.uploads.filter(fid=existing.fid).get() == existing
+    assert scan.processed_files == 3
+    assert scan.errored_files == 0
+
+
+def test_scan_page_concurrent_chains_and_finishes(mocker, factories, r_mock):
+    scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    scan = factories["music.LibraryScan"](
+        status="scanning", total_files=4, total_pages=4, processed_pages=2
+    )
+    uploads = factories["music.Upload"].build_batch(size=4, library=scan.library)
+    page_conf = {
+        "actor": scan.library.actor,
+        "id": scan.library.fid,
+        "page": Paginator(uploads, 1).page(2),
+        "item_serializer": federation_serializers.UploadSerializer,
+    }
+    page = federation_serializers.CollectionPageSerializer(page_conf)
+    r_mock.get(page.data["id"], json=page.data)
+
+    tasks.scan_library_page(
+        library_scan_id=scan.pk, page_url=page.data["id"], page=2, concurrency=2
+    )
+
+    scan_page.assert_called_once_with(
+        library_scan_id=scan.pk,
+        page_url=common_utils.set_query_parameter(page.data["id"], page=4),
+        page=4,
+        concurrency=2,
+    )
+    scan.refresh_from_db()
+    assert scan.status == "scanning"
+    assert scan.processed_pages == 3
+
+    page_conf["page"] = Paginator(uploads, 1).page(4)
+    page = federation_serializers.CollectionPageSerializer(page_conf)
+    r_mock.get(page.data["id"], json=page.data)
+    tasks.scan_library_page(
+        library_scan_id=scan.pk, page_url=page.data["id"], page=4, concurrency=2
+    )
+
+    scan.refresh_from_db()
+    assert scan.status == "finished"
+    assert scan.processed_pages == 4
+    assert scan.processed_files == 2
+
+
 def test_scan_page_trigger_next_page_scan_skip_if_same(mocker, factories, r_mock):
     patched_scan = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
     scan = factories["music.LibraryScan"](status="scanning", total_files=5)
@@ -546,3 +904,227 @@ def test_scan_page_trigger_next_page_scan_skip_if_same(mocker, factories, r_mock
     scan.refresh_from_db()
 
     assert scan.status == "finished"
+
+
+def test_scan_library_incremental_fetches_pages_in_order(mocker, factories, r_mock):
+    scan = factories["music.LibraryScan"](since=timezone.now())
+    collection_conf = {
+        "actor": scan.library.actor,
+        "id": scan.library.fid,
+        "page_size": 2,
+        "items": range(12),
+        "type": "Library",
+        "name": "hello",
+    }
+    data = federation_serializers.PaginatedCollectionSerializer(collection_conf).data
+    data["followers"] = "https://followers.domain"
+    scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    r_mock.get(collection_conf["id"], json=data)
+
+    tasks.start_library_scan(library_scan_id=scan.pk)
+
+    scan_page.assert_called_once_with(library_scan_id=scan.pk, page_url=data["first"])
+
+
+def test_scan_page_not_modified(mocker, factories, r_mock):
+    scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    page_url = "https://library.test/?page=1"
+    scan = factories["music.LibraryScan"](
+        status="scanning", since=timezone.now(), page_etags={page_url: '"abc"'}
+    )
+    r_mock.get(page_url, status_code=304, request_headers={"If-None-Match": '"abc"'})
+
+    tasks.scan_library_page(library_scan_id=scan.pk, page_url=page_url)
+
+    scan.refresh_from_db()
+    assert scan.status == "finished"
+    assert scan.processed_pages == 1
+    scan_page.assert_not_called()
+
+
+def test_scan_page_incremental_stops_at_known_page(mocker, factories, r_mock):
+    scan_page = mocker.patch("funkwhale_api.music.tasks.scan_library_page.delay")
+    scan = factories["music.LibraryScan"](status="scanning", total_files=5)
+    known = factories["music.Upload"](library=scan.library)
+    new = factories["music.Upload"].build(
+        library=scan.library,
+        creation_date=known.creation_date + datetime.timedelta(hours=1),
+    )
+    scan.since = known.creation_date
+    scan.since_fid = known.get_federation_id()
+    scan.save()
+    page_conf = {
+        "actor": scan.library.actor,
+        "id": scan.library.fid,
+        "page": Paginator([new, known], 2).page(1),
+        "item_serializer": federation_serializers.UploadSerializer,
+    }
+    page = federation_serializers.CollectionPageSerializer(page_conf)
+    r_mock.get(page.data["id"], json=page.data, headers={"ETag": '"new"'})
+
+    tasks.scan_library_page(library_scan_id=scan.pk, page_url=page.data["id"])
+
+    scan.refresh_from_db()
+    scan_page.assert_not_called()
+    assert scan.status == "finished"
+    assert scan.library.uploads.filter(fid=new.fid).exists()
+    assert scan.last_creation_date == new.creation_date
+    assert scan.last_fid == new.fid
+    assert scan.page_etags == {page.data["id"]: '"new"'}
+
+
+def test_clean_transcoding_cache(preferences, now, factories):
+    preferences["music__transcoding_cache_size"] = 1
+    mb = 1024 * 1024
+    oldest = factories["music.UploadVersion"](
+        size=mb, accessed_date=now - datetime.timedelta(days=3)
+    )
+    never_played = factories["music.UploadVersion"](size=mb, accessed_date=None)
+    recent = factories["music.UploadVersion"](size=mb, accessed_date=now)
+
+    tasks.clean_transcoding_cache()
+
+    assert list(recent.__class__.objects.all()) == [recent]
+    with pytest.raises(oldest.__class__.DoesNotExist):
+        oldest.refresh_from_db()
+    with pytest.raises(never_played.__class__.DoesNotExist):
+        never_played.refresh_from_db()
+
+
+def test_clean_transcoding_cache_under_limit(preferences, factories):
+    preferences["music__transcoding_cache_size"] = 10
+    version = factories["music.UploadVersion"](size=1024)
+
+    tasks.clean_transcoding_cache()
+
+    version.refresh_from_db()
+
+
+def test_prefetch_tracks(factories, preferences, mocker):
+    preferences["music__prefetch_count"] = 2
+    preferences["music__prefetch_max_downloads_per_user"] = 5
+    user = factories["users.User"](with_actor=True)
+    remote_upload = factories["music.Upload"](
+        playable=True, audio_file="", source="https://remote.test/file.ogg", size=10
+    )
+    cached_upload = factories["music.Upload"](playable=True)
+    ignored_upload = factories["music.Upload"](
+        playable=True, audio_file="", source="https://remote.test/file2.ogg", size=10
+    )
+    prefetch_upload = mocker.patch.object(tasks.prefetch_upload, "delay")
+
+    tasks.prefetch_tracks(
+        user_id=user.pk,
+        track_ids=[
+            remote_upload.track_id,
+            cached_upload.track_id,
+            ignored_upload.track_id,
+        ],
+    )
+
+    prefetch_upload.assert_called_once_with(upload_id=remote_upload.pk, user_id=user.pk)
+
+
+def test_prefetch_tracks_max_downloads_per_user(factories, preferences, mocker):
+    preferences["music__prefetch_count"] = 3
+    preferences["music__prefetch_max_downloads_per_user"] = 1
+    user = factories["users.User"](with_actor=True)
+    uploads = [
+        factories["music.Upload"](
+            playable=True, audio_file="", source="https://remote.test/file.ogg", size=10
+        )
+        for _ in range(2)
+    ]
+    prefetch_upload = mocker.patch.object(tasks.prefetch_upload, "delay")
+
+    tasks.prefetch_tracks(user_id=user.pk, track_ids=[u.track_id for u in uploads])
+
+    prefetch_upload.assert_called_once_with(upload_id=uploads[0].pk, user_id=user.pk)
+
+
+def test_prefetch_tracks_budget(factories, preferences, mocker):
+    preferences["music__prefetch_count"] = 3
+    preferences["music__prefetch_hourly_budget"] = 1
+    user = factories["users.User"](with_actor=True)
+    upload = factories["music.Upload"](
+        playable=True,
+        audio_file="",
+        source="https://remote.test/file.ogg",
+        size=2 * 1024 * 1024,
+    )
+    prefetch_upload = mocker.patch.object(tasks.prefetch_upload, "delay")
+
+    tasks.prefetch_tracks(user_id=user.pk, track_ids=[upload.track_id])
+
+    prefetch_upload.assert_not_called()
+    assert tasks.acquire_prefetch_slot(user.pk) is True
+
+
+def test_prefetch_tracks_unknown_size(factories, preferences, mocker):
+    preferences["music__prefetch_count"] = 3
+    user = factories["users.User"](with_actor=True)
+    upload = factories["music.Upload"](
+        playable=True, audio_file="", source="https://remote.test/file.ogg", size=None
+    )
+    prefetch_upload = mocker.patch.object(tasks.prefetch_upload, "delay")
+
+    tasks.prefetch_tracks(user_id=user.pk, track_ids=[upload.track_id])
+
+    prefetch_upload.assert_not_called()
+
+
+def test_prefetch_upload(factories, mocker, now, cache):
+    user = factories["users.User"](with_actor=True)
+    upload = factories["music.Upload"](
+        audio_file="", source="https://remote.test/file.ogg"
+    )
+    tasks.acquire_prefetch_slot(user.pk)
+    download = mocker.Mock(status="finished")
+    open_download = mocker.patch(
+        "funkwhale_api.music.remote.open_download", return_value=download
+    )
+    release = mocker.spy(tasks, "release_prefetch_slot")
+
+    tasks.prefetch_upload(upload_id=upload.pk, user_id=user.pk)
+    upload.refresh_from_db()
+
+    # the download was claimed before being opened
+    assert cache.get(remote.get_cache_key(upload)) == {"status": "starting"}
+    open_download.assert_called_once_with(upload, user=user)
+    download.run.assert_called_once_with()
+    release.assert_called_once_with(user.pk)
+    assert upload.accessed_date == now
+
+
+def test_prefetch_upload_failed_download(factories, mocker, now):
+    user = factories["users.User"](with_actor=True)
+    upload = factories["music.Upload"](
+        audio_file="", source="https://remote.test/file.ogg"
+    )
+    download = mocker.Mock(status="errored")
+    mocker.patch("funkwhale_api.music.remote.open_download", return_value=download)
+    release = mocker.spy(tasks, "release_prefetch_slot")
+
+    tasks.prefetch_upload(upload_id=upload.pk, user_id=user.pk)
+    upload.refresh_from_db()
+
+    release.assert_called_once_with(user.pk)
+    assert upload.accessed_date is None
+
+
+def test_prefetch_upload_skips_download_in_progress(factories, mocker, cache):
+    user = factories["users.User"](with_actor=True)
+    upload = factories["music.Upload"](
+        audio_file="", source="https://remote.test/file.ogg"
+    )
+    # a listener started the download
+    cache.set(remote.get_cache_key(upload), {"status": "downloading"})
+    get_remote_response = mocker.patch.object(
+        upload.__class__, "get_remote_audio_response"
+    )
+
+    tasks.prefetch_upload(upload_id=upload.pk, user_id=user.pk)
+    upload.refresh_from_db()
+
+    get_remote_response.assert_not_called()
+    assert upload.accessed_date is None
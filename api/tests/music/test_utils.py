@@ -36,3 +36,9 @@ def test_get_audio_file_data(name, expected):
         result = utils.get_audio_file_data(f)
 
     assert result == expected
+
+
+def test_transcoding_mimetypes_are_not_used_for_imports():
+    assert utils.TRANSCODING_FORMATS["opus"]["mimetype"] == "audio/opus"
+    assert utils.TRANSCODING_MIMETYPE_TO_EXTENSION["audio/opus"] == "opus"
+    assert utils.get_type_from_ext("opus") is None
@@ -2,10 +2,11 @@ import io
 import os
 
 import pytest
+from django import http
 from django.urls import reverse
 from django.utils import timezone
 
-from funkwhale_api.music import serializers, tasks, views
+from funkwhale_api.music import access, remote, serializers, tasks, views
 from funkwhale_api.federation import api_serializers as federation_api_serializers
 
 DATA_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -225,7 +226,9 @@ def test_serve_file_media(
     assert response[headers[proxy]] == expected
 
 
-def test_can_proxy_remote_track(factories, settings, api_client, r_mock, preferences):
+def test_can_proxy_remote_track(
+    factories, settings, api_client, r_mock, preferences, mocker
+):
     preferences["common__api_authentication_required"] = False
     url = "https://file.test"
     upload = factories["music.Upload"](
@@ -236,6 +239,8 @@ def test_can_proxy_remote_track(factories, settings, api_client, r_mock, prefere
     )
 
     r_mock.get(url, body=io.BytesIO(b"test"))
+    # we run the download synchronously
+    mocker.patch.object(remote.RemoteDownload, "start", remote.RemoteDownload.run)
     response = api_client.get(upload.track.listen_url)
     upload.refresh_from_db()
 
@@ -246,7 +251,28 @@ def test_can_proxy_remote_track(factories, settings, api_client, r_mock, prefere
     assert upload.audio_file.read() == b"test"
 
 
-def test_serve_updates_access_date(factories, settings, api_client, preferences):
+def test_serve_remote_track_while_downloading(
+    factories, api_client, preferences, mocker
+):
+    preferences["common__api_authentication_required"] = False
+    upload = factories["music.Upload"](
+        library__privacy_level="everyone",
+        audio_file="",
+        source="https://file.test",
+        import_status="finished",
+    )
+    stream_upload = mocker.patch.object(
+        remote, "stream_upload", return_value=http.HttpResponse(b"test")
+    )
+    response = api_client.get(upload.track.listen_url)
+
+    assert response.status_code == 200
+    assert response.content == b"test"
+    assert response["Content-Type"] == "audio/ogg"
+    stream_upload.assert_called_once_with(upload, user=mocker.ANY, request=mocker.ANY)
+
+
+def test_serve_updates_access_date(factories, settings, api_client, preferences, cache):
     preferences["common__api_authentication_required"] = False
     upload = factories["music.Upload"](
         library__privacy_level="everyone", import_status="finished"
@@ -258,6 +284,11 @@ def test_serve_updates_access_date(factories, settings, api_client, preferences)
     upload.refresh_from_db()
 
     assert response.status_code == 200
+    # the update is buffered
+    assert upload.accessed_date is None
+
+    access.flush_all()
+    upload.refresh_from_db()
     assert upload.accessed_date > now
 
 
@@ -309,7 +340,64 @@ def test_listen_explicit_file(factories, logged_in_api_client, mocker):
     response = logged_in_api_client.get(url, {"upload": upload2.uuid})
 
     assert response.status_code == 200
-    mocked_serve.assert_called_once_with(upload2, user=logged_in_api_client.user)
+    mocked_serve.assert_called_once_with(
+        upload2,
+        user=logged_in_api_client.user,
+        format=None,
+        max_bitrate=None,
+        request=mocker.ANY,
+    )
+
+
+@pytest.mark.parametrize(
+    "mimetype,bitrate,format,max_bitrate,expected",
+    [
+        ("audio/ogg", 128000, None, None, False),
+        ("audio/ogg", 128000, "ogg", None, False),
+        ("audio/ogg", 128000, "mp3", None, True),
+        ("audio/ogg", 128000, "wav", None, False),
+        ("audio/ogg", 320000, None, 192000, True),
+        ("audio/ogg", 128000, None, 192000, False),
+        (None, 128000, "mp3", None, False),
+    ],
+)
+def test_should_transcode(
+    mimetype, bitrate, format, max_bitrate, expected, factories, preferences
+):
+    preferences["music__transcoding_enabled"] = True
+    upload = factories["music.Upload"].build(mimetype=mimetype, bitrate=bitrate)
+
+    assert views.should_transcode(upload, format, max_bitrate=max_bitrate) is expected
+
+
+def test_should_transcode_disabled(factories, preferences):
+    preferences["music__transcoding_enabled"] = False
+    upload = factories["music.Upload"].build(mimetype="audio/ogg")
+
+    assert views.should_transcode(upload, "mp3") is False
+
+
+def test_listen_transcoded(factories, logged_in_api_client, mocker, settings, cache):
+    upload = factories["music.Upload"](
+        library__privacy_level="everyone",
+        import_status="finished",
+        mimetype="audio/ogg",
+        bitrate=320000,
+    )
+    version = factories["music.UploadVersion"](upload=upload, bitrate=192000)
+    get_version = mocker.spy(upload.__class__, "get_transcoded_version")
+    url = reverse("api:v1:listen-detail", kwargs={"uuid": upload.track.uuid})
+    response = logged_in_api_client.get(url, {"to": "mp3", "max_bitrate": 192})
+    access.flush_all()
+    version.refresh_from_db()
+
+    assert response.status_code == 200
+    assert response["Content-Type"] == "audio/mpeg"
+    assert response["X-Accel-Redirect"] == "{}{}".format(
+        settings.PROTECT_FILES_PATH, version.audio_file.url
+    )
+    assert version.accessed_date is not None
+    get_version.assert_called_once_with(mocker.ANY, "mp3", max_bitrate=192000)
 
 
 def test_user_can_create_library(factories, logged_in_api_client):
@@ -432,6 +520,105 @@ def test_user_can_create_upload(logged_in_api_client, factories, mocker, audio_f
     m.assert_called_once_with(tasks.process_upload.delay, upload_id=upload.pk)
 
 
+def test_user_can_upload_file_in_chunks(
+    logged_in_api_client, factories, mocker, audio_file
+):
+    library = factories["music.Library"](actor__user=logged_in_api_client.user)
+    m = mocker.patch("funkwhale_api.common.utils.on_commit")
+    content = audio_file.read()
+    middle = len(content) // 2
+
+    response = logged_in_api_client.post(
+        reverse("api:v1:upload-sessions-list"),
+        {
+            "library": library.uuid,
+            "filename": "test.ogg",
+            "size": len(content),
+            "import_reference": "test",
+        },
+        format="json",
+    )
+    assert response.status_code == 201
+    assert response.data["offset"] == 0
+
+    url = reverse(
+        "api:v1:upload-sessions-detail", kwargs={"uuid": response.data["uuid"]}
+    )
+    chunks = [(0, content[:middle]), (middle, content[middle:])]
+    for start, chunk in chunks:
+        response = logged_in_api_client.put(
+            url,
+            chunk,
+            content_type="application/octet-stream",
+            HTTP_CONTENT_RANGE="bytes {}-{}/{}".format(
+                start, start + len(chunk) - 1, len(content)
+            ),
+        )
+        assert response.status_code == 200
+        assert response.data["offset"] == start + len(chunk)
+
+    session = library.upload_sessions.get()
+    response = logged_in_api_client.post(
+        reverse("api:v1:upload-sessions-finalize", kwargs={"uuid": session.uuid})
+    )
+
+    assert response.status_code == 202
+    assert response.data["status"] == "finalizing"
+    session.refresh_from_db()
+    assert session.status == "finalizing"
+    assert len(session.get_chunk_names()) == 2
+    m.assert_called_once_with(
+        tasks.finalize_upload_session.delay, upload_session_id=session.pk
+    )
+
+
+def test_upload_session_rejects_unexpected_offset(logged_in_api_client, factories):
+    session = factories["music.UploadSession"](
+        library__actor__user=logged_in_api_client.user, size=10
+    )
+    url = reverse("api:v1:upload-sessions-detail", kwargs={"uuid": session.uuid})
+
+    response = logged_in_api_client.put(
+        url,
+        b"hello",
+        content_type="application/octet-stream",
+        HTTP_CONTENT_RANGE="bytes 5-9/10",
+    )
+
+    assert response.status_code == 409
+    assert response.data["offset"] == 0
+
+
+def test_upload_session_finalize_requires_whole_file(logged_in_api_client, factories):
+    session = factories["music.UploadSession"](
+        library__actor__user=logged_in_api_client.user, size=10, received=5
+    )
+    url = reverse("api:v1:upload-sessions-finalize", kwargs={"uuid": session.uuid})
+
+    response = logged_in_api_client.post(url)
+
+    assert response.status_code == 400
+    assert response.data["offset"] == 5
+
+
+def test_upload_session_cannot_be_finalized_twice(
+    logged_in_api_client, factories, mocker
+):
+    m = mocker.patch("funkwhale_api.common.utils.on_commit")
+    session = factories["music.UploadSession"](
+        library__actor__user=logged_in_api_client.user,
+        size=10,
+        received=10,
+        status="finalizing",
+    )
+    url = reverse("api:v1:upload-sessions-finalize", kwargs={"uuid": session.uuid})
+
+    response = logged_in_api_client.post(url)
+
+    assert response.status_code == 409
+    m.assert_not_called()
+
+
 def test_user_can_list_own_library_follows(factories, logged_in_api_client):
     actor = logged_in_api_client.user.create_actor()
     library = factories["music.Library"](actor=actor)
@@ -480,3 +667,40 @@ def test_can_get_libraries_for_music_entities(
         "previous": None,
         "results": [expected],
     }
+
+
+def test_serve_without_reverse_proxy(factories, api_client, settings, preferences):
+    preferences["common__api_authentication_required"] = False
+    settings.REVERSE_PROXY_TYPE = "none"
+    upload = factories["music.Upload"](
+        library__privacy_level="everyone", import_status="finished"
+    )
+    size = upload.audio_file.size
+    response = api_client.get(upload.track.listen_url, HTTP_RANGE="bytes=10-19")
+
+    assert response.status_code == 206
+    assert response["Content-Range"] == "bytes 10-19/{}".format(size)
+    assert response["Content-Type"] == "audio/ogg"
+    assert "X-Accel-Redirect" not in response
+    with upload.audio_file.open("rb") as f:
+        f.seek(10)
+        assert b"".join(response.streaming_content) == f.read(10)
+
+
+def test_upload_import_summary(logged_in_api_client, factories):
+    actor = logged_in_api_client.user.create_actor()
+    library = factories["music.Library"](actor=actor)
+    factories["music.Upload"].create_batch(
+        size=2, library=library, import_reference="test"
+    )
+    factories["music.Upload"](
+        library=library, import_reference="test", import_status="finished"
+    )
+    # not owned by the user
+    factories["music.Upload"](import_reference="test")
+    url = reverse("api:v1:uploads-import-summary")
+
+    response = logged_in_api_client.get(url, {"import_reference": "test"})
+
+    assert response.status_code == 200
+    assert response.data == {"pending": 2, "finished": 1, "errored": 0, "skipped": 0}
@@ -1,6 +1,7 @@
 import pytest
 from django.urls import reverse
 
+from funkwhale_api.music import tasks as music_tasks
 from funkwhale_api.playlists import models, serializers
 
 
@@ -139,6 +140,44 @@ def test_playlist_track_privacy_respected_in_list_anon(
     assert response.data["count"] == 0
 
 
+def test_listing_tracks_from_playlist_can_trigger_prefetch(
+    factories, logged_in_api_client, preferences, mocker
+):
+    preferences["music__prefetch_count"] = 1
+    plts = factories["playlists.PlaylistTrack"].create_batch(
+        size=2, playlist__user=logged_in_api_client.user
+    )
+    on_commit = mocker.patch("funkwhale_api.common.utils.on_commit")
+    url = reverse("api:v1:playlists-tracks", kwargs={"pk": plts[0].playlist.pk})
+    response = logged_in_api_client.get(url, {"prefetch": "true"})
+
+    assert response.status_code == 200
+    on_commit.assert_called_once_with(
+        music_tasks.prefetch_tracks.delay,
+        user_id=logged_in_api_client.user.pk,
+        track_ids=[plts[1].track_id],
+    )
+
+
+def test_listing_tracks_from_playlist_prefetch_after_position(
+    factories, logged_in_api_client, preferences, mocker
+):
+    preferences["music__prefetch_count"] = 2
+    plts = factories["playlists.PlaylistTrack"].create_batch(
+        size=4, playlist__user=logged_in_api_client.user
+    )
+    on_commit = mocker.patch("funkwhale_api.common.utils.on_commit")
+    url = reverse("api:v1:playlists-tracks", kwargs={"pk": plts[0].playlist.pk})
+    response = logged_in_api_client.get(url, {"prefetch": "true", "position": 2})
+
+    assert response.status_code == 200
+    on_commit.assert_called_once_with(
+        music_tasks.prefetch_tracks.delay,
+        user_id=logged_in_api_client.user.pk,
+        track_ids=[plts[3].track_id],
+    )
+
+
 @pytest.mark.parametrize("level", ["instance", "me", "followers"])
 def test_can_list_tracks_from_playlist(level, factories, logged_in_api_client):
     plt = factories["playlists.PlaylistTrack"](playlist__user=logged_in_api_client.user)
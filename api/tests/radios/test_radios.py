@@ -6,6 +6,7 @@ from django.core.exceptions import ValidationError
 from django.urls import reverse
 
 from funkwhale_api.favorites.models import TrackFavorite
+from funkwhale_api.music import tasks as music_tasks
 from funkwhale_api.radios import models, radios, serializers
 
 
@@ -142,6 +143,50 @@ def test_can_start_radio_for_logged_in_user(logged_in_api_client):
     assert session.user == logged_in_api_client.user
 
 
+def test_getting_track_for_session_triggers_prefetch(
+    factories, logged_in_api_client, mocker, preferences
+):
+    preferences["music__prefetch_count"] = 1
+    actor = logged_in_api_client.user.create_actor()
+    uploads = factories["music.Upload"].create_batch(
+        size=2, library__actor=actor, import_status="finished"
+    )
+    on_commit = mocker.patch("funkwhale_api.common.utils.on_commit")
+    url = reverse("api:v1:radios:sessions-list")
+    logged_in_api_client.post(url, {"radio_type": "random"})
+    session = models.RadioSession.objects.latest("id")
+
+    url = reverse("api:v1:radios:tracks-list")
+    logged_in_api_client.post(url, {"session": session.pk})
+
+    picked = session.session_tracks.latest("id").track_id
+    upcoming = [u.track_id for u in uploads if u.track_id != picked]
+    on_commit.assert_called_once_with(
+        music_tasks.prefetch_tracks.delay,
+        user_id=logged_in_api_client.user.pk,
+        track_ids=upcoming,
+    )
+
+
+def test_session_radio_pick_next_serves_upcoming_tracks(factories):
+    user = factories["users.User"]()
+    uploads = factories["music.Upload"].create_batch(size=3)
+    radio = radios.RandomRadio()
+    radio.start_session(user)
+
+    first, upcoming = radio.pick_next(upcoming_count=1, filter_playable=False)
+    second, next_upcoming = radio.pick_next(upcoming_count=1, filter_playable=False)
+
+    assert len(upcoming) == 1
+    assert second.pk == upcoming[0]
+    assert len(next_upcoming) == 1
+    assert {first.pk, second.pk, next_upcoming[0]} == {u.track_id for u in uploads}
+    assert [st.track for st in radio.session.session_tracks.order_by("id")] == [
+        first,
+        second,
+    ]
+
+
 def test_can_get_track_for_session_from_api(factories, logged_in_api_client):
     actor = logged_in_api_client.user.create_actor()
     track = factories["music.Upload"](
@@ -1,9 +1,14 @@
+import concurrent.futures
+import io
 import os
 
 import pytest
 from django.core.management import call_command
 from django.core.management.base import CommandError
 
+from funkwhale_api.music import models as music_models
+from funkwhale_api.music import tasks as music_tasks
+
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files")
 
@@ -160,3 +165,154 @@ def test_import_files_in_place(factories, mocker, settings):
 def test_storage_rename_utf_8_files(factories):
     upload = factories["music.Upload"](audio_file__filename="été.ogg")
     assert upload.audio_file.name.endswith("ete.ogg")
+
+
+def test_import_files_with_workers(factories, mocker, now):
+    mocker.patch(
+        "concurrent.futures.ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor
+    )
+    mocker.patch("django.db.connections.close_all")
+    mocked_process = mocker.patch("funkwhale_api.music.tasks.process_upload")
+    library = factories["music.Library"](actor__local=True)
+    paths = [
+        os.path.join(DATA_DIR, "dummy_file.ogg"),
+        os.path.join(DATA_DIR, "utf8-éà◌.ogg"),
+    ]
+    call_command(
+        "import_files",
+        str(library.uuid),
+        *paths,
+        workers=2,
+        batch_size=1,
+        async_=False,
+        interactive=False
+    )
+
+    uploads = library.uploads.order_by("source")
+    assert [u.source for u in uploads] == ["file://{}".format(p) for p in paths]
+    for upload in uploads:
+        assert upload.import_reference == "cli-{}".format(now.isoformat())
+        assert upload.import_status == "pending"
+        assert upload.fid == upload.get_federation_id()
+        assert upload.size == os.path.getsize(upload.source.replace("file://", ""))
+        assert upload.duration is not None
+        assert upload.mimetype == "audio/ogg"
+        mocked_process.assert_any_call(upload_id=upload.pk)
+
+
+def test_import_files_with_workers_async(factories, mocker):
+    mocker.patch(
+        "concurrent.futures.ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor
+    )
+    mocker.patch("django.db.connections.close_all")
+    mocked_process = mocker.patch("funkwhale_api.music.tasks.process_uploads_batch")
+    library = factories["music.Library"](actor__local=True)
+    paths = [
+        os.path.join(DATA_DIR, "dummy_file.ogg"),
+        os.path.join(DATA_DIR, "utf8-éà◌.ogg"),
+    ]
+    call_command(
+        "import_files",
+        str(library.uuid),
+        *paths,
+        workers=2,
+        async_=True,
+        interactive=False
+    )
+
+    uploads = library.uploads.order_by("pk")
+    mocked_process.delay.assert_called_once_with(
+        upload_ids=[u.pk for u in uploads]
+    )
+
+
+def test_import_files_with_workers_reports_errors(factories, mocker, tmpfile):
+    mocker.patch(
+        "concurrent.futures.ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor
+    )
+    mocker.patch("django.db.connections.close_all")
+    mocked_process = mocker.patch("funkwhale_api.music.tasks.process_upload")
+    library = factories["music.Library"](actor__local=True)
+    tmpfile.write(b"not an audio file")
+    tmpfile.flush()
+
+    call_command(
+        "import_files", str(library.uuid), tmpfile.name, workers=1, interactive=False
+    )
+
+    assert library.uploads.count() == 0
+    mocked_process.assert_not_called()
+
+
+def test_import_files_with_workers_reports_import_errors(factories, mocker):
+    mocker.patch(
+        "concurrent.futures.ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor
+    )
+    mocker.patch("django.db.connections.close_all")
+
+    def process_upload(upload_id):
+        # tags are only parsed at this stage
+        upload = music_models.Upload.objects.get(pk=upload_id)
+        music_tasks.fail_import(upload, "invalid_metadata")
+
+    mocker.patch("funkwhale_api.music.tasks.process_upload", process_upload)
+    library = factories["music.Library"](actor__local=True)
+    path = os.path.join(DATA_DIR, "dummy_file.ogg")
+    stderr = io.StringIO()
+
+    call_command(
+        "import_files",
+        str(library.uuid),
+        path,
+        workers=1,
+        async_=False,
+        interactive=False,
+        stderr=stderr,
+    )
+
+    assert library.uploads.get().import_status == "errored"
+    assert "Error while importing {}".format(path) in stderr.getvalue()
+    assert "invalid_metadata" in stderr.getvalue()
+
+
+def test_import_files_rescan_requires_in_place(factories):
+    library = factories["music.Library"](actor__local=True)
+    path = os.path.join(DATA_DIR, "dummy_file.ogg")
+
+    with pytest.raises(CommandError) as e:
+        call_command(
+            "import_files", str(library.uuid), path, rescan=True, interactive=False
+        )
+
+    assert "Rescanning is only supported with --in-place" in str(e)
+
+
+def test_import_files_rescan(factories, mocker, settings):
+    settings.MUSIC_DIRECTORY_PATH = DATA_DIR
+    library = factories["music.Library"](actor__local=True)
+    path = os.path.join(DATA_DIR, "dummy_file.ogg")
+    mocked_process = mocker.patch("funkwhale_api.music.tasks.process_upload")
+    call_command(
+        "import_files",
+        str(library.uuid),
+        path,
+        in_place=True,
+        async_=False,
+        interactive=False,
+    )
+    upload = library.uploads.get()
+    assert upload.indexed_file.path == path
+    mocked_process.reset_mock()
+
+    call_command(
+        "import_files",
+        str(library.uuid),
+        path,
+        in_place=True,
+        rescan=True,
+        async_=False,
+        interactive=False,
+    )
+
+    assert library.uploads.count() == 1
+    mocked_process.assert_not_called()
@@ -0,0 +1 @@
+Upload large audio files in several chunks through the API, resume interrupted uploads, and assemble them in the background
@@ -0,0 +1 @@
+Added an optional asynchronous federation_worker process, that delivers activities with many concurrent requests instead of blocking celery workers (FEDERATION_DELIVERY_WORKER)
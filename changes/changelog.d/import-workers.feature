@@ -0,0 +1 @@
+Added a --workers option to import_files, to read tags in parallel and create uploads in batches
@@ -0,0 +1 @@
+Added a --rescan option to import_files, to only process new, modified, moved and deleted files of in-place libraries
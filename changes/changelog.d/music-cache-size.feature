@@ -0,0 +1 @@
+Added a size limit and pinning of popular tracks for the federated music cache
@@ -0,0 +1 @@
+Prefetch upcoming federated tracks of radios and playlists in the cache, within per-user and hourly limits
@@ -0,0 +1 @@
+Audio can now be transcoded on the fly using the ``to`` and ``max_bitrate`` parameters on the listen endpoint, with transcoded versions kept in a size-bounded cache
@@ -0,0 +1 @@
+Added a watch_library management command to import new music files continuously